@@ -0,0 +1,257 @@
+"""
+Benchmarks of the hot paths of the Robust PDFLinks service.
+
+Usage::
+
+  python -m benchmarks.bench [--quick] [--only SUITE [SUITE ...]] [--out PATH]
+
+The ``micro`` suite times ``URLUtil.pick_uniq_urls``, ``URLUtil.pick_new_urls`` and URL canonicalization on synthetic
+URL collections. The ``extract`` suite times ``Extractor.extract_all_urls`` on synthetic PDFs of varying size and link
+density, for each extraction engine. The ``robustify`` suite serves the app on a local port, points it at a stand-in
+Robust Links service, and measures the throughput and latency percentiles of ``/robustify`` under concurrent clients.
+
+All inputs are generated with fixed seeds, and results are written as JSON (along with the commit they were measured
+on), so that runs on different commits can be compared.
+
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import uuid
+from typing import Callable, Dict, List, Sequence
+
+import requests
+
+from .stub_rl import StubRobustLinks
+from .synthetic import make_pdf, make_url_pool, make_urls
+
+SUITES = ("micro", "extract", "robustify")
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+  """
+  Summarize timings (in seconds) by their count, mean and percentiles (nearest-rank).
+
+  :param samples: Timings in seconds
+  :return: Summary of the timings
+
+  """
+  ordered = sorted(samples)
+  if not ordered:
+    return {"n": 0}
+
+  def percentile(p: float) -> float:
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+  return {
+    "n": len(ordered),
+    "mean": sum(ordered) / len(ordered),
+    "min": ordered[0],
+    "p50": percentile(50),
+    "p90": percentile(90),
+    "p99": percentile(99),
+    "max": ordered[-1],
+  }
+
+
+def time_it(fn: Callable[[], object], repeat: int, setup: Callable[[], object] = lambda: None) -> Dict[str, float]:
+  """
+  Time ``repeat`` calls of ``fn`` (calling ``setup`` before each, untimed), and summarize the timings.
+
+  :param fn: Function to time
+  :param repeat: Number of calls to time
+  :param setup: Function to call before each call of ``fn``
+  :return: Summary of the timings
+
+  """
+  samples = []
+  for _ in range(repeat):
+    setup()
+    samples.append(timeit.timeit(fn, number=1))
+  return summarize(samples)
+
+
+def bench_micro(quick: bool) -> List[dict]:
+  from pdflinks.util import URLUtil
+
+  results = []
+  repeat = 3 if quick else 7
+  for size in ((200, 2000) if quick else (200, 2000, 10000)):
+    pool = set(make_url_pool(size, truncated_ratio=0.2, seed=size))
+    refs = set(make_url_pool(size // 4, truncated_ratio=0, seed=size))
+    raw = make_urls(size, repeat_ratio=0.5, seed=size)
+    util = URLUtil()
+    results.append({"name": "pick_uniq_urls", "size": size, **time_it(lambda: URLUtil.pick_uniq_urls(pool), repeat)})
+    results.append({"name": "pick_new_urls", "size": size, **time_it(lambda: URLUtil.pick_new_urls(pool, refs), repeat)})
+
+    def canonicalize_each():
+      for url in raw:
+        try:
+          util.canonicalize_url(url)
+        except Exception:
+          pass
+
+    def reset_verdicts():
+      util.verdicts = type(util.verdicts)(util.verdicts.max_size)
+
+    results.append({"name": "canonicalize_url", "size": size, **time_it(canonicalize_each, repeat)})
+    results.append({"name": "canonicalize_urls (cold)", "size": size,
+                    **time_it(lambda: util.canonicalize_urls(raw), repeat, setup=reset_verdicts)})
+    results.append({"name": "canonicalize_urls (warm)", "size": size, **time_it(lambda: util.canonicalize_urls(raw), repeat)})
+  return results
+
+
+def bench_extract(quick: bool, work_dir: str) -> List[dict]:
+  from pdflinks.extractor import Extractor
+
+  configs = [
+    {"pages": 10, "annots_per_page": 5, "text_urls_per_page": 10, "repeat_ratio": 0.2},
+    {"pages": 100, "annots_per_page": 10, "text_urls_per_page": 30, "repeat_ratio": 0.5},
+  ]
+  if not quick:
+    configs.append({"pages": 1000, "annots_per_page": 5, "text_urls_per_page": 20, "repeat_ratio": 0.8})
+  repeat = 2 if quick else 5
+  extractors = {
+    (engine, workers): Extractor(workers=workers, engine=engine)
+    for engine in (Extractor.ENGINE_PDFIUM, Extractor.ENGINE_PYPDF2) for workers in (1, os.cpu_count() or 1)
+  }
+  results = []
+  for config in configs:
+    path = os.path.join(work_dir, "{pages}-{annots_per_page}-{text_urls_per_page}-{repeat_ratio}.pdf".format(**config))
+    make_pdf(path, **config)
+    for (engine, workers), extractor in extractors.items():
+      urls = extractor.extract_all_urls(path)  # warm-up (e.g., starts the pool)
+      results.append({"name": "extract_all_urls", **config, "engine": engine, "workers": workers, "urls": len(urls),
+                      **time_it(lambda: extractor.extract_all_urls(path), repeat)})
+  return results
+
+
+def bench_robustify(quick: bool, work_dir: str, latency: float, rate: float) -> List[dict]:
+  import werkzeug.serving
+
+  # the app reads and writes relative paths, so it is imported (and run) within the work directory
+  os.chdir(work_dir)
+  os.makedirs("mappings", exist_ok=True)
+  from pdflinks import api
+  from pdflinks.util import TokenBucket
+
+  # the service-wide rate limit would cap the measured throughput, so it is raised to ``rate``
+  api.util.rate_limiter = TokenBucket(rate, int(rate))
+  logging.getLogger("werkzeug").setLevel(logging.WARNING)
+  server = werkzeug.serving.make_server("127.0.0.1", 0, api.app, threaded=True)
+  threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+  base_url = f"http://127.0.0.1:{server.server_port}"
+
+  # mappings are stored for an uploaded PDF, so one is uploaded before timing (and its hash is sent with each request)
+  pdf_path = os.path.join(work_dir, "robustify.pdf")
+  make_pdf(pdf_path, pages=1)
+  with open(pdf_path, "rb") as f:
+    res = requests.post(f"{base_url}/pdfs", files={"file": ("robustify.pdf", f, "application/pdf")},
+                        allow_redirects=False)
+  if res.status_code != 302:
+    raise RuntimeError(f"could not upload the benchmark PDF ({res.status_code}): {res.text}")
+  pdf_hash = res.headers["Location"].rstrip("/").rsplit("/", 1)[-1]
+
+  def post(uris: List[str]) -> dict:
+    started = time.monotonic()
+    latencies = []
+    with requests.post(f"{base_url}/robustify", json={"pdf_hash": pdf_hash, "uris": uris}, stream=True) as res:
+      if res.status_code != 200:
+        raise RuntimeError(f"/robustify failed ({res.status_code}): {res.text}")
+      for line in res.iter_lines():
+        if line:
+          # each line is a mapping (which fails to parse if the response is not what is measured)
+          json.loads(line)
+          latencies.append(time.monotonic() - started)
+    return {"total": time.monotonic() - started, "first": latencies[0] if latencies else None, "mappings": latencies}
+
+  results = []
+  with StubRobustLinks(latency) as stub:
+    api.util.robust_links_api_url = stub.url
+    for clients in ((1, 8) if quick else (1, 8, 32)):
+      requests_per_client = 2 if quick else 4
+      uris_per_request = 20 if quick else 50
+      # URIs are unique per run, so that none of them are served from the mapping cache
+      run_id = uuid.uuid4().hex[:8]
+      batches = [[f"https://bench.example.org/{run_id}/{c}/{r}/{i}" for i in range(uris_per_request)]
+                 for c in range(clients) for r in range(requests_per_client)]
+      started = time.monotonic()
+      with concurrent.futures.ThreadPoolExecutor(clients) as pool:
+        runs = list(pool.map(post, batches))
+      elapsed = time.monotonic() - started
+      mappings = sum(len(run["mappings"]) for run in runs)
+      results.append({
+        "name": "robustify",
+        "clients": clients,
+        "requests": len(batches),
+        "uris_per_request": uris_per_request,
+        "upstream_latency": latency,
+        "mappings": mappings,
+        "elapsed": elapsed,
+        "mappings_per_s": mappings / elapsed,
+        "request": summarize([run["total"] for run in runs]),
+        "first_mapping": summarize([run["first"] for run in runs if run["first"] is not None]),
+        "mapping": summarize([t for run in runs for t in run["mappings"]]),
+      })
+  server.shutdown()
+  return results
+
+
+def get_commit() -> str:
+  try:
+    return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return "unknown"
+
+
+def main(argv: List[str] = None) -> None:
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.bench", description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--only", nargs="+", choices=SUITES, default=SUITES, help="suites to run (default: all)")
+  parser.add_argument("--quick", action="store_true", help="run smaller inputs, with fewer repeats")
+  parser.add_argument("--latency", type=float, default=0.05, help="latency of the stand-in Robust Links service (s)")
+  parser.add_argument("--rate", type=float, default=1000, help="rate limit of calls to the Robust Links service (/s)")
+  parser.add_argument("--out", help="path to write results to (default: stdout)")
+  args = parser.parse_args(argv)
+
+  report = {
+    "commit": get_commit(),
+    "timestamp": datetime.datetime.now().isoformat(),
+    "python": sys.version.split()[0],
+    "platform": platform.platform(),
+    "cpus": os.cpu_count(),
+    "args": vars(args),
+  }
+  cwd = os.getcwd()
+  with tempfile.TemporaryDirectory(prefix="pdflinks-bench-") as work_dir:
+    for suite in SUITES:
+      if suite not in args.only:
+        continue
+      print(f"running {suite} benchmarks...", file=sys.stderr)
+      if suite == "micro":
+        report[suite] = bench_micro(args.quick)
+      elif suite == "extract":
+        report[suite] = bench_extract(args.quick, work_dir)
+      else:
+        report[suite] = bench_robustify(args.quick, work_dir, args.latency, args.rate)
+    os.chdir(cwd)
+  if args.out:
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as f:
+      json.dump(report, f, indent=2)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+  main()
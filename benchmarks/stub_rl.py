@@ -0,0 +1,89 @@
+"""
+A local stand-in for the Robust Links service, so that ``/robustify`` can be benchmarked without calling the real one.
+
+It answers every ``GET`` with a response in the same format as the Robust Links API, after a fixed ``latency``.
+URIs containing ``fail`` get an error response, like URIs that the Robust Links service cannot archive.
+
+"""
+import http.server
+import json
+import socketserver
+import threading
+import time
+import urllib.parse
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  latency = 0.05
+
+  def do_GET(self):
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+    uri = query.get("url", [""])[0]
+    time.sleep(self.latency)
+    if "fail" in uri:
+      body = {"friendly error": f"could not archive {uri}"}
+    else:
+      memento = f"https://web.archive.org/web/20210101000000/{uri}"
+      body = {"robust_links_html": {
+        "original_url_as_href": f'<a href="{uri}" data-versionurl="{memento}">{uri}</a>\n',
+        "memento_url_as_href": f'<a href="{memento}" data-originalurl="{uri}">{memento}</a>',
+      }}
+    data = json.dumps(body).encode()
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, *args):
+    pass
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+  daemon_threads = True
+
+
+class StubRobustLinks:
+  """
+  The ``StubRobustLinks`` class runs the stand-in Robust Links service on a background thread.
+
+  :param latency: Number of seconds to wait before answering each call
+  :param host: Host to listen on
+  :param port: Port to listen on (default: any free port)
+
+  """
+
+  def __init__(self, latency: float = 0.05, host: str = "127.0.0.1", port: int = 0) -> None:
+    handler = type("Handler", (_Handler,), {"latency": latency})
+    self.server = _Server((host, port), handler)
+    self.thread = threading.Thread(target=self.server.serve_forever, name="stub-rl", daemon=True)
+
+  @property
+  def url(self) -> str:
+    """
+    URL of the stand-in Robust Links API (to use as ``ROBUST_LINKS_API_URL``).
+
+    """
+    host, port = self.server.server_address[:2]
+    return f"http://{host}:{port}/api/"
+
+  def __enter__(self) -> "StubRobustLinks":
+    self.thread.start()
+    return self
+
+  def __exit__(self, *exc) -> None:
+    self.server.shutdown()
+    self.server.server_close()
+
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.stub_rl", description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+  parser.add_argument("--latency", type=float, default=0.05, help="seconds to wait before answering each call")
+  args = parser.parse_args()
+  with StubRobustLinks(args.latency, port=args.port) as stub:
+    print(f"serving a stand-in Robust Links API at {stub.url}")
+    stub.thread.join()
@@ -0,0 +1,112 @@
+"""
+Generators of synthetic PDFs and URL collections, for benchmarking.
+
+PDFs are written by hand (one Helvetica content stream and a set of link annotations per page), so no PDF library is
+needed to generate them. All generators are seeded, so the same arguments always give the same output.
+
+"""
+import random
+from typing import List
+
+
+def make_urls(count: int, repeat_ratio: float = 0.2, pool_size: int = 10, seed: int = 0) -> List[str]:
+  """
+  Generate URL-like strings, a fraction of which are repeated from a small pool (e.g., DOIs in running headers).
+
+  :param count: Number of URLs to generate
+  :param repeat_ratio: Fraction of URLs drawn from the pool of repeated URLs
+  :param pool_size: Number of distinct repeated URLs
+  :param seed: Seed of the random generator
+  :return: List of URL-like strings
+
+  """
+  rng = random.Random(seed)
+  pool = [f"https://journal{k}.example.org/article/{k * 7919}" for k in range(pool_size)]
+  urls = []
+  for i in range(count):
+    if rng.random() < repeat_ratio:
+      urls.append(rng.choice(pool))
+    else:
+      host = rng.choice(["github.com", "zenodo.org", "example.com", "www.example.edu", "data.example.net"])
+      urls.append(f"https://{host}/{rng.choice(['repo', 'record', 'files', 'docs'])}/{i}/{rng.randrange(10 ** 6)}")
+  return urls
+
+
+def make_url_pool(count: int, truncated_ratio: float = 0.2, seed: int = 0) -> List[str]:
+  """
+  Generate canonical URLs, a fraction of which are truncated copies of others (e.g., text URLs split by a newline).
+
+  :param count: Number of URLs to generate
+  :param truncated_ratio: Fraction of URLs that are truncated copies of other URLs
+  :param seed: Seed of the random generator
+  :return: List of canonical URLs
+
+  """
+  rng = random.Random(seed)
+  urls = [url if url.startswith("https://") else "https://" + url for url in make_urls(count, 0, seed=seed)]
+  truncated = int(count * truncated_ratio)
+  for i in range(truncated):
+    # truncate a copy of a URL that is not truncated itself
+    url = urls[rng.randrange(truncated, count)]
+    urls[i] = url[:rng.randrange(len("https://") + 8, len(url))]
+  return urls
+
+
+def _escape(text: str) -> str:
+  return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(path: str, pages: int = 10, annots_per_page: int = 5, text_urls_per_page: int = 10,
+             repeat_ratio: float = 0.2, seed: int = 0) -> None:
+  """
+  Write a synthetic PDF with URLs in both link annotations and text.
+
+  Each annotated URL is also written in the text under its annotation (as in most PDFs), and the remaining text URLs
+  are written without an annotation. A fraction of all URLs is repeated across pages.
+
+  :param path: Path to write the PDF to
+  :param pages: Number of pages
+  :param annots_per_page: Number of link annotations per page
+  :param text_urls_per_page: Number of URLs per page in text (including those under annotations, max. 60)
+  :param repeat_ratio: Fraction of URLs repeated across pages
+  :param seed: Seed of the random generator
+
+  """
+  text_urls_per_page = min(max(text_urls_per_page, annots_per_page), 60)
+  urls = make_urls(pages * text_urls_per_page, repeat_ratio, seed=seed)
+  objs = []
+
+  def add(obj: str) -> int:
+    objs.append(obj)
+    return len(objs)
+
+  catalog, pages_id = add(""), add("")
+  font = add("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+  kids = []
+  for p in range(pages):
+    lines, annots = [], []
+    for k in range(text_urls_per_page):
+      url = urls[p * text_urls_per_page + k]
+      y = 760 - 12 * k
+      lines.append(f"BT /F1 9 Tf 40 {y} Td (See {_escape(url)} for details) Tj ET")
+      if k < annots_per_page:
+        annots.append(add(f"<< /Type /Annot /Subtype /Link /Rect [60 {y - 2} 400 {y + 9}] /Border [0 0 0] "
+                          f"/A << /S /URI /URI ({_escape(url)}) >> >>"))
+    content = "\n".join(lines)
+    stream = add(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+    kids.append(add(f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 612 792] /Contents {stream} 0 R "
+                    f"/Resources << /Font << /F1 {font} 0 R >> >> /Annots [{' '.join(f'{a} 0 R' for a in annots)}] >>"))
+  objs[catalog - 1] = f"<< /Type /Catalog /Pages {pages_id} 0 R >>"
+  objs[pages_id - 1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>"
+
+  out = bytearray(b"%PDF-1.4\n")
+  offsets = []
+  for i, obj in enumerate(objs, 1):
+    offsets.append(len(out))
+    out += f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+  xref = len(out)
+  out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+  out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+  out += f"trailer\n<< /Size {len(objs) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+  with open(path, "wb") as f:
+    f.write(out)
@@ -1,22 +1,144 @@
+import atexit
 import concurrent.futures
 import hashlib
-import io
 import json
 import os
+import tempfile
+import time
+from typing import Iterator, List
 
 import flask
-import requests
 
+from .errors import ExtractionError
 from .extractor import Extractor
-from .util import APIUtil
+from .jobs import JobQueue
+from .pool import ExtractionPool
+from .prefetch import Prefetcher
+from .robustifier import Robustifier
+from .util import APIUtil, ExtractionCache, PDFStore, TTLCache
 
 app = flask.Flask(__name__)
 app.config['UPLOADS_FOLDER'] = './pdfs'
 app.config['MAPPING_FOLDER'] = './mappings'
 app.config['DOCS_FOLDER'] = '../docs/_build/html'
-extractor = Extractor()
+app.config['UPLOAD_CHUNK_SIZE'] = 1 << 20
+app.config['CACHE_FOLDER'] = './cache'
+app.config['CACHE_SIZE'] = 128
+app.config['ROBUSTIFY_CONCURRENCY'] = 100
+app.config['ROBUSTIFY_CONCURRENCY_PER_REQUEST'] = 10
+app.config['HTTP_POOL_SIZE'] = 10
+app.config['HTTP_CONNECT_TIMEOUT'] = 5
+app.config['HTTP_READ_TIMEOUT'] = 60
+app.config['MAPPING_CACHE_SIZE'] = 10000
+app.config['MAPPING_CACHE_TTL'] = 24 * 60 * 60
+app.config['MAPPING_COMPACT_EVERY'] = 50
+app.config['MAPPING_SHARD_DEPTH'] = 2
+app.config['STORAGE_BACKEND'] = 'local'
+app.config['STORAGE_SHARD_DEPTH'] = 2
+app.config['JOBS_DB'] = './jobs.db'
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_LEASE'] = 60
+app.config['EXTRACTOR_WORKERS'] = os.cpu_count()
+# isolated workers (see ExtractionPool) extract serially, so EXTRACTOR_PARALLEL_PAGES and EXTRACTOR_CONCURRENT_PASSES
+# only apply if EXTRACTOR_ISOLATE is False (PDFs are still extracted concurrently, by EXTRACTOR_WORKERS workers)
+app.config['EXTRACTOR_PARALLEL_PAGES'] = 100
+app.config['EXTRACTOR_CONCURRENT_PASSES'] = True
+app.config['EXTRACTOR_ENGINE'] = 'pdfium'
+app.config['EXTRACTOR_STREAM_PAGES'] = 500
+app.config['EXTRACTOR_ISOLATE'] = True
+app.config['EXTRACTOR_TIMEOUT'] = 60
+app.config['EXTRACTOR_MEMORY_LIMIT'] = 1 << 30
+app.config['EXTRACTOR_MAX_JOBS'] = 100
+app.config['EXTRACTOR_PREFETCH'] = True
+app.config['EXTRACTOR_PREFETCH_WORKERS'] = 2
+app.config['EXTRACTION_STATUS_MAX_WAIT'] = 30
+app.config['EXTRACTION_MAX_FAILURES'] = 3
+app.config['LDN_CONCURRENCY'] = 10
+app.config['SERVER_TIMING'] = True
+app.config['PDF_MAX_AGE'] = 365 * 24 * 60 * 60
 util = APIUtil(app)
-executor = concurrent.futures.ThreadPoolExecutor(5)
+if app.config['EXTRACTOR_ISOLATE']:
+  extractor = ExtractionPool(
+    app.config['EXTRACTOR_WORKERS'],
+    app.config['EXTRACTOR_TIMEOUT'],
+    app.config['EXTRACTOR_MEMORY_LIMIT'],
+    app.config['EXTRACTOR_MAX_JOBS'],
+    app.config['EXTRACTOR_ENGINE'],
+    util.metrics,
+  )
+  atexit.register(extractor.close)
+else:
+  extractor = Extractor(
+    app.config['EXTRACTOR_WORKERS'],
+    app.config['EXTRACTOR_PARALLEL_PAGES'],
+    app.config['EXTRACTOR_CONCURRENT_PASSES'],
+    app.config['EXTRACTOR_ENGINE'],
+    util.metrics,
+  )
+extraction_cache = ExtractionCache(app.config['CACHE_FOLDER'], extractor.version, app.config['CACHE_SIZE'])
+prefetcher = Prefetcher(extractor, extraction_cache, util.pdfs, app.config['EXTRACTOR_PREFETCH_WORKERS'], util.metrics,
+                        app.config['EXTRACTOR_STREAM_PAGES'])
+atexit.register(prefetcher.close)
+robustifier = Robustifier(util, app.config['ROBUSTIFY_CONCURRENCY'], app.config['ROBUSTIFY_CONCURRENCY_PER_REQUEST'])
+atexit.register(robustifier.close)
+mapping_cache = TTLCache(app.config['MAPPING_CACHE_SIZE'], app.config['MAPPING_CACHE_TTL'])
+jobs = JobQueue(app.config['JOBS_DB'], robustifier, util.mappings, mapping_cache, app.config['JOB_WORKERS'], util.pdfs,
+                app.config['JOB_LEASE'])
+ldn_pool = concurrent.futures.ThreadPoolExecutor(app.config['LDN_CONCURRENCY'], thread_name_prefix="ldn")
+# digest of the links page template, so that cached links pages are not reused once it changes
+with open(os.path.join(app.root_path, app.template_folder, "links.html"), "rb") as f:
+  links_template_digest = hashlib.md5(f.read()).hexdigest()
+
+
+@app.errorhandler(ExtractionError)
+def handle_extraction_error(e: ExtractionError):
+  """
+  Respond with a ``422 Unprocessable Entity`` response when links could not be extracted from a PDF (e.g., because
+  it is malformed, or its extraction exceeded ``EXTRACTOR_MEMORY_LIMIT``), or with a ``503 Service Unavailable``
+  response if extracting it again may succeed (e.g., if it exceeded ``EXTRACTOR_TIMEOUT`` under load, or crashed
+  its worker). PDFs are extracted again after transient failures, until they fail ``EXTRACTION_MAX_FAILURES`` times.
+
+  :param e: The error raised
+  :return: An HTTP Response
+
+  """
+  return util.make_error_res(503 if e.transient else 422, f"{util.ERR_EXTRACTION_FAILED} ({e.reason})")
+
+
+@app.before_first_request
+def start_jobs():
+  """
+  Start running robustification jobs (see ``JobQueue``) once the app serves requests, rather than when it is imported.
+
+  """
+  jobs.start()
+
+
+@app.before_request
+def start_timer():
+  flask.g.started = time.perf_counter()
+
+
+@app.after_request
+def record_timings(res: flask.Response):
+  """
+  Record the latency of each request in ``pdflinks_request_seconds``, and (unless ``SERVER_TIMING`` is False)
+  send the time spent on each stage of the request in a ``Server-Timing`` header, along with its total time.
+
+  For streamed responses, only the stages completed before the response started are included.
+
+  :param res: The HTTP Response
+  :return: The HTTP Response, with a ``Server-Timing`` header
+
+  """
+  elapsed = time.perf_counter() - flask.g.get("started", time.perf_counter())
+  endpoint = flask.request.endpoint or "none"
+  util.metrics.histogram("pdflinks_request_seconds", "Time taken to respond to requests (until the response starts)",
+                         ["endpoint", "status"]).observe(elapsed, endpoint=endpoint, status=res.status_code)
+  if app.config['SERVER_TIMING']:
+    timings = [*flask.g.get("timings", []), ("total", elapsed)]
+    res.headers["Server-Timing"] = util.metrics.format_server_timing(timings)
+  return res
 
 
 @app.route('/pdfs', methods=['POST'])
@@ -31,6 +153,13 @@ def upload_pdf():
   Upon success, this function will return a ``302 Found`` that redirects to ``/links/<pdf_hash>``.
   Here, ``pdf_hash`` is the MD5 hash of the uploaded PDF (calculated server-side).
 
+  The PDF is streamed to disk in chunks of ``UPLOAD_CHUNK_SIZE`` bytes while its hash is calculated, and is only
+  stored (see ``PDFStore``) if a PDF with the same hash was not uploaded already. Its original filename, size and page
+  count are recorded in the index of uploaded PDFs.
+
+  Unless ``EXTRACTOR_PREFETCH`` is False, links are then extracted from the PDF in the background, while the client
+  follows the redirect (see ``/links/<pdf_hash>/status``).
+
   Upon error, this function with return a ``400 Bad Request`` response with information about the error.
 
   :return: An HTTP Response
@@ -46,21 +175,33 @@ def upload_pdf():
   # ensure that the file is a pdf
   if file.mimetype != 'application/pdf':
     return flask.abort(util.make_error_res(400, util.ERR_ONLY_PDF_ALLOWED))
-  # copy the PDF into an in-memory buffer
-  data = io.BytesIO()
-  data.write(file.stream.read())
-  # seek to the beginning of the buffer
-  data.seek(0)
-  # calculate MD5 hash (which will be used as filename)
-  out_basename = hashlib.md5(data.read()).hexdigest()
-  out_path = os.path.join(app.config['UPLOADS_FOLDER'], out_basename)
-  # seek to the beginning of the buffer
-  data.seek(0)
-  # write the buffer to file
-  with open(out_path + ".pdf", "wb") as f:
-    f.write(data.read())
-  with open(out_path + ".pdf.txt", "w") as f:
-    f.write(orig_filename)
+  # stream the PDF into a temporary file, while calculating its MD5 hash (which will be used as filename)
+  md5 = hashlib.md5()
+  size = 0
+  fd, tmp_path = tempfile.mkstemp(dir=app.config['UPLOADS_FOLDER'], suffix=".part")
+  try:
+    with util.metrics.timer("upload_hash"), os.fdopen(fd, "wb") as f:
+      for chunk in iter(lambda: file.stream.read(app.config['UPLOAD_CHUNK_SIZE']), b""):
+        md5.update(chunk)
+        f.write(chunk)
+        size += len(chunk)
+    util.metrics.histogram("pdflinks_upload_bytes", "Size of uploaded PDFs", buckets=util.metrics.SIZE_BUCKETS).observe(size)
+    out_basename = md5.hexdigest()
+    # store the file (unless the same PDF was uploaded before), and index its metadata
+    pages = None
+    if not util.pdfs.exists(out_basename):
+      try:
+        pages = extractor.count_pages(tmp_path)
+      except ExtractionError:
+        # the PDF is still stored, and its extraction fails (with a clean error) when requested
+        pass
+    util.pdfs.add(out_basename, tmp_path, orig_filename, pages)
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+  # start extracting links in the background, so they are ready (or nearly) when the redirect is followed
+  if app.config['EXTRACTOR_PREFETCH']:
+    prefetcher.submit(out_basename)
   # redirect to URL extraction page
   return flask.redirect(f'/links/{out_basename}')
 
@@ -75,17 +216,26 @@ def get_pdf(pdf_hash: str):
   If found, it returns a ``200 OK`` response with the PDF.
   If not, it returns a ``404 Not Found`` response.
 
+  PDFs are content-addressed, so the ``pdf_hash`` is used as a strong ETag, and PDFs are cached as ``immutable`` for
+  ``PDF_MAX_AGE`` seconds. Requests with a matching ``If-None-Match`` get a ``304 Not Modified`` response, and requests
+  with a ``Range`` header get a ``206 Partial Content`` response, so PDF viewers can fetch large PDFs incrementally.
+
   :param pdf_hash: MD5 hash of an uploaded PDF
   :return: An HTTP Response
 
   """
 
   # assert that PDF exists
-  pdf_path = os.path.join(app.config['UPLOADS_FOLDER'], pdf_hash + ".pdf")
-  if not os.path.exists(pdf_path):
+  if not util.pdfs.exists(pdf_hash):
     return flask.abort(util.make_error_res(404, util.ERR_PDF_NOT_FOUND))
-  # send file
-  return flask.send_file(pdf_path)
+  pdf_path = util.pdfs.path(pdf_hash)
+  # send file (or the requested range of it)
+  res = flask.send_file(pdf_path, mimetype='application/pdf', etag=pdf_hash, max_age=app.config['PDF_MAX_AGE'])
+  res.cache_control.public = True
+  res.cache_control.immutable = True
+  # advertise range support even on full responses, so that viewers know they can fetch incrementally
+  res.accept_ranges = "bytes"
+  return res
 
 
 @app.route("/links/<pdf_hash>", methods=['GET'])
@@ -98,19 +248,126 @@ def get_extracted_links_page(pdf_hash: str):
   If found, it extracts links from that PDF and returns a ``200 OK`` response with them.
   If not, it returns a ``404 Not Found`` response.
 
+  Extracted links are cached by ``pdf_hash`` and extractor version, so repeat requests do not re-parse the PDF.
+  The page has a strong ETag made of both, and of the digest of its template (which clients must revalidate on each
+  use), and requests with a matching ``If-None-Match`` get a ``304 Not Modified`` response, without extracting (or
+  rendering) anything.
+
+  PDFs are extracted in the background as soon as they are uploaded (see ``Prefetcher``), so if the links are not
+  cached yet, they are usually being extracted, and this function attaches to that extraction instead of starting
+  another. If either the ``stream`` query parameter is given (e.g., ``?stream=1``) or the PDF has at least
+  ``EXTRACTOR_STREAM_PAGES`` pages, the page is streamed, and each link is rendered as soon as the page of the PDF
+  that it is on is extracted (see ``Prefetcher.follow``). Else, the page is rendered once the PDF is extracted.
+  Streamed pages may list URLs that the final list of links does not have, so they have no ETag.
+
   :param pdf_hash: MD5 hash of an uploaded PDF
   :return: An HTTP Response
 
   """
 
   # assert that PDF exists
-  pdf_path = os.path.join(app.config['UPLOADS_FOLDER'], pdf_hash + ".pdf")
-  if not os.path.exists(pdf_path):
+  pdf_meta = util.pdfs.get(pdf_hash)
+  if pdf_meta is None:
     return flask.abort(util.make_error_res(404, util.ERR_PDF_NOT_FOUND))
-  # extracts links from PDF
-  urls = extractor.extract_all_urls(pdf_path)
+  # the page only changes with the extractor version (or its template), so the client may have it already
+  etag = f"{pdf_hash}-{extractor.version}-{links_template_digest[:8]}"
+  not_modified = util.make_not_modified_res(etag)
+  if not_modified is not None:
+    return not_modified
+  # get links from cache
+  urls = extraction_cache.get(pdf_hash)
+  if urls is None and pdf_meta['extraction_status'] == PDFStore.EXTRACTION_FAILED:
+    raise ExtractionError(f"a previous extraction failed: {pdf_meta['extraction_error']}")
+  util.metrics.count_cache("extraction", urls is not None)
+  if urls is None:
+    pdf_path = util.pdfs.path(pdf_hash)
+    stream = flask.request.args.get('stream', default='0') not in ('0', 'false')
+    if pdf_meta['pages'] is None and prefetcher.get(pdf_hash) is None:
+      try:
+        pdf_meta['pages'] = extractor.count_pages(pdf_path)
+      except ExtractionError as e:
+        util.pdfs.fail_extraction(pdf_hash, e.reason, e.transient)
+        raise
+      util.pdfs.set_status(pdf_hash, pages=pdf_meta['pages'])
+    if stream or (pdf_meta['pages'] or 0) >= app.config['EXTRACTOR_STREAM_PAGES']:
+      # follow the extraction in progress (e.g., started at upload), or start one, while rendering its links
+      followed = prefetcher.follow(pdf_hash)
+      if followed is None:
+        # the extraction in progress does not publish its progress (e.g., of a small PDF), so extract links from PDF
+        # page by page here instead (and cache them once done). Its failures are recorded by that extraction.
+        def on_done(all_urls: List[str]) -> None:
+          extraction_cache.put(pdf_hash, all_urls)
+          util.pdfs.set_status(pdf_hash, extraction=PDFStore.EXTRACTION_DONE)
+
+        followed = extractor.iter_urls(pdf_path, on_done=on_done)
+
+      def iter_urls() -> Iterator[str]:
+        try:
+          yield from followed
+        except ExtractionError:
+          # the response has started already, so the page is cut short instead (the failure is recorded already)
+          pass
+
+      context = dict(filename=pdf_hash, urls=iter_urls())
+      app.update_template_context(context)
+      template = app.jinja_env.get_template("links.html")
+      res = flask.Response(flask.stream_with_context(template.stream(context)))
+      # the streamed page is not the page that the ETag identifies, so it is not stored at all
+      res.cache_control.no_store = True
+      return res
+    # attach to the extraction in progress (e.g., started at upload), or start one, and wait for it
+    with util.metrics.timer("extraction_wait"):
+      urls = prefetcher.submit(pdf_hash).result()
   # send extracted links
-  return flask.render_template("links.html", filename=pdf_hash, urls=urls)
+  res = flask.make_response(flask.render_template("links.html", filename=pdf_hash, urls=urls))
+  res.set_etag(etag)
+  res.cache_control.no_cache = True
+  return res
+
+
+@app.route("/links/<pdf_hash>/status", methods=['GET'])
+def get_extraction_status(pdf_hash: str):
+  """
+  Route to get the extraction status of a PDF file (e.g., to poll until its links page is ready).
+
+  This function intercepts ``GET`` requests to ``/links/<pdf_hash>/status``.
+  If the PDF is found, it returns a ``200 OK`` response with its metadata as JSON, which has the following fields.
+
+  * ``pdf_hash``: MD5 hash of the PDF
+  * ``filename``: Original filename of the PDF
+  * ``size`` and ``pages``: Size of the PDF (in bytes), and its number of pages (if known)
+  * ``uploaded``: UNIX timestamp of when the PDF was uploaded
+  * ``extraction_status``: One of ``pending``, ``running``, ``done``, or ``failed``
+  * ``mapping_status``: Either ``none``, or ``stored`` once mappings are stored for the PDF
+  * ``extraction_error`` and ``extraction_failures``: Why the last failed extraction failed (if any), and the number
+    of failed extractions. PDFs whose extraction failed transiently (e.g., timed out under load) are ``pending`` again
+    (see ``PDFStore.fail_extraction``).
+
+  If the PDF is not extracted yet, its extraction is started (unless it is in progress, or has failed).
+  If the ``wait`` query parameter is given (e.g., ``?wait=10``), the response is held until the extraction is done,
+  or ``wait`` seconds (at most ``EXTRACTION_STATUS_MAX_WAIT``) have passed, so clients can long-poll instead.
+
+  If not, it returns a ``404 Not Found`` response.
+
+  :param pdf_hash: MD5 hash of an uploaded PDF
+  :return: An HTTP Response
+
+  """
+
+  # assert that PDF exists
+  pdf_meta = util.pdfs.get(pdf_hash)
+  if pdf_meta is None:
+    return flask.abort(util.make_error_res(404, util.ERR_PDF_NOT_FOUND))
+  if pdf_meta['extraction_status'] in (PDFStore.EXTRACTION_PENDING, PDFStore.EXTRACTION_RUNNING):
+    # attach to the extraction in progress (or start one, e.g., if it was interrupted by a restart)
+    future = prefetcher.submit(pdf_hash)
+    wait = min(flask.request.args.get('wait', default=0, type=float), app.config['EXTRACTION_STATUS_MAX_WAIT'])
+    if wait > 0:
+      concurrent.futures.wait([future], timeout=wait)
+    pdf_meta = util.pdfs.get(pdf_hash)
+  res = flask.jsonify(pdf_meta)
+  res.cache_control.no_cache = True
+  return res
 
 
 @app.route("/mappings/<pdf_hash>", methods=['GET'])
@@ -123,21 +380,25 @@ def get_mappings(pdf_hash: str):
   If found, it looks for stored ``URI-R -> URI-M`` mappings for that PDF, and returns a ``200 OK`` response with them.
   If either the PDF or the mappings are not found, it returns a ``404 Not Found`` response.
 
+  Mappings change as URIs are robustified, so the digest of the mappings is used as a strong ETag, and clients must
+  revalidate their copy on each use. Requests with a matching ``If-None-Match`` get a ``304 Not Modified`` response.
+
   :param pdf_hash: MD5 hash of an uploaded PDF to which the mappings correspond to
   :return: An HTTP Response
 
   """
 
   # assert that PDF exists
-  pdf_path = os.path.join(app.config['UPLOADS_FOLDER'], pdf_hash + ".pdf")
-  if not os.path.exists(pdf_path):
+  if not util.pdfs.exists(pdf_hash):
     return flask.abort(util.make_error_res(404, util.ERR_PDF_NOT_FOUND))
-  # assert that mappings exist
-  mapping_path = os.path.join(app.config['MAPPING_FOLDER'], pdf_hash + ".pdf.json")
-  if not os.path.exists(mapping_path):
+  # assert that mappings exist (and compact them)
+  digest = util.mappings.digest(pdf_hash)
+  if digest is None:
     return flask.abort(util.make_error_res(404, util.ERR_MAPPING_NOT_FOUND))
-  # send mappings
-  return flask.send_file(mapping_path)
+  # send mappings (unless the client has them already)
+  res = flask.send_file(util.mappings.snapshot_path(pdf_hash), mimetype='application/json', etag=digest)
+  res.cache_control.no_cache = True
+  return res
 
 
 @app.route("/robustify", methods=['POST'])
@@ -151,50 +412,187 @@ def robustify():
   The ``uris`` is a a subset of URIs from the PDF which should be robustified.
 
   For each URI, the function calls the Robust PDFLinks service to create a ``URI-R -> URI-M`` mapping.
+  These calls are made concurrently by the ``Robustifier``, which limits the number of in-flight calls per request
+  (``ROBUSTIFY_CONCURRENCY_PER_REQUEST``) and across all requests (``ROBUSTIFY_CONCURRENCY``).
   The HTTP response `streams` each mapping as a JSON blob.
+  Successful mappings are cached service-wide for ``MAPPING_CACHE_TTL`` seconds, and URIs with a cached mapping
+  are not sent to the Robust PDFLinks service again. Cached mappings are streamed first, ahead of the others.
+  Duplicate URIs are streamed once, and URIs that are being robustified for another request (or job) at the same time
+  share its call to the Robust PDFLinks service.
   The request completes when each URL is processed through the Robust PDFLinks service.
-  Upon completion, the generated ``URI-R -> URI-M`` mappings are stored in a file, which can be accessed via ``/mappings/<pdf_hash>``.
+  Each generated ``URI-R -> URI-M`` mapping is stored as soon as it is streamed, and is merged with the mappings
+  stored for the same PDF earlier. The stored mappings can be accessed via ``/mappings/<pdf_hash>``.
   Here, ``pdf_hash`` is the MD5 hash of the corresponding PDF.
 
   :return: An HTTP Response
 
   """
 
-  req_json = flask.request.get_json()
+  req_json = util.get_req_payload_as_json()
+  if 'pdf_hash' not in req_json:
+    return flask.abort(util.make_error_res(400, util.ERR_MISSING_PARAM_PDF_HASH))
+  if 'uris' not in req_json:
+    return flask.abort(util.make_error_res(400, util.ERR_MISSING_PARAM_URIS))
   pdf_hash = req_json['pdf_hash']
-  uris = req_json['uris']
+  # assert that PDF exists (so that mappings are only stored for uploaded PDFs)
+  if not util.pdfs.exists(pdf_hash):
+    return flask.abort(util.make_error_res(404, util.ERR_PDF_NOT_FOUND))
+  # duplicate URIs are only robustified (and streamed) once
+  uris = list(dict.fromkeys(uri.strip() for uri in req_json['uris']))
 
   def run():
-    # dict of generated mappings
-    mappings = {}
-    # local list storing future results
-    futures = []
+    # local list storing URIs to robustify
+    pending = []
+    # local list storing cached mappings
+    cached = []
     try:
-      # submit robustification requests
+      # pick URIs without a cached mapping for robustification
       for uri in uris:
-        futures.append(executor.submit(util.call_robust_links_svc, uri.strip()))
-      # process each future as completed
-      for future in concurrent.futures.as_completed(futures):
-        payload = future.result()
+        payload = mapping_cache.get(uri)
+        util.metrics.count_cache("mapping", payload is not None)
+        if payload is None:
+          pending.append(uri)
+        else:
+          cached.append(payload)
+      # submit robustification requests (generator of results)
+      results = robustifier.robustify(pending)
+      # process each cached mapping first
+      for payload in cached:
+        # store the payload
+        util.mappings.append(pdf_hash, payload)
+        # yield a JSON response
+        yield json.dumps(payload) + "\n"
+      # process each result as completed
+      for payload in results:
         uri = payload["uri"]
-        # append the payload into a dict, for saving later
-        mappings[uri] = payload
+        # cache successful mappings, for other requests
+        if payload["ok"]:
+          mapping_cache.put(uri, payload)
+        # store the payload
+        util.mappings.append(pdf_hash, payload)
         # yield a JSON response
         yield json.dumps(payload) + "\n"
     except GeneratorExit:
       app.logger.info(f"client {flask.request.host_url} disconnected, cleaning up resources.")
-      for future in futures:
-        future.cancel()
+      results.close()
     finally:
-      app.logger.info("writing generated mappings to file.")
-      # write generated mappings to file
-      mapping_path = os.path.join(app.config['MAPPING_FOLDER'], pdf_hash + ".pdf.json")
-      with open(mapping_path, "w") as f:
-        json.dump(mappings, f)
+      app.logger.info("compacting generated mappings.")
+      if util.mappings.compact(pdf_hash) is not None:
+        util.pdfs.set_status(pdf_hash, mapping=PDFStore.MAPPING_STORED)
 
   return app.response_class(run(), content_type='application/octet-stream')
 
 
+@app.route("/jobs", methods=['POST'])
+def submit_job():
+  """
+  Route to submit a job that robustifies URIs in a PDF file, in the background.
+
+  This function intercepts ``POST`` requests to ``/jobs``.
+  It expects the request body to contain JSON with two keys: ``pdf_hash`` and ``uris``, like ``/robustify``.
+  If the PDF is not found, it returns a ``404 Not Found`` response.
+  Else, it queues a job and returns a ``202 Accepted`` response with the status of the job (see ``/jobs/<job_id>``).
+
+  Unlike ``/robustify``, the job keeps running if the client disconnects, and resumes if the service restarts.
+  Its progress can be followed via ``/jobs/<job_id>/events``.
+
+  :return: An HTTP Response
+
+  """
+  req_json = util.get_req_payload_as_json()
+  if 'pdf_hash' not in req_json:
+    return flask.abort(util.make_error_res(400, util.ERR_MISSING_PARAM_PDF_HASH))
+  if 'uris' not in req_json:
+    return flask.abort(util.make_error_res(400, util.ERR_MISSING_PARAM_URIS))
+  pdf_hash = req_json['pdf_hash']
+  # assert that PDF exists
+  if not util.pdfs.exists(pdf_hash):
+    return flask.abort(util.make_error_res(404, util.ERR_PDF_NOT_FOUND))
+  # queue the job
+  job_id = jobs.submit(pdf_hash, req_json['uris'])
+  res = flask.jsonify(jobs.get(job_id))
+  res.status_code = 202
+  res.headers['Location'] = f"/jobs/{job_id}"
+  return res
+
+
+@app.route("/jobs/<job_id>", methods=['GET'])
+def get_job(job_id: str):
+  """
+  Route to get the status of a robustification job.
+
+  This function intercepts ``GET`` requests to ``/jobs/<job_id>``.
+  If the job is found, it returns a ``200 OK`` response with its status as JSON, which has the following fields.
+
+  * ``id``: The id of the job
+  * ``pdf_hash``: MD5 hash of the PDF whose URIs are robustified
+  * ``status``: One of ``queued``, ``running``, ``done``, or ``failed``
+  * ``error``: Why the job failed (if it did)
+  * ``created`` and ``updated``: UNIX timestamps of when the job was created and last updated
+  * ``total``, ``completed`` and ``ok``: Number of URIs in total, processed so far, and robustified successfully
+
+  If not, it returns a ``404 Not Found`` response.
+
+  :param job_id: The id of a robustification job
+  :return: An HTTP Response
+
+  """
+  job = jobs.get(job_id)
+  if job is None:
+    return flask.abort(util.make_error_res(404, util.ERR_JOB_NOT_FOUND))
+  return flask.jsonify(job)
+
+
+@app.route("/jobs/<job_id>/events", methods=['GET'])
+def get_job_events(job_id: str):
+  """
+  Route to follow the progress of a robustification job.
+
+  This function intercepts ``GET`` requests to ``/jobs/<job_id>/events``.
+  If the job is found, it `streams` each mapping generated by the job as a JSON blob (like ``/robustify``),
+  starting from the mappings generated so far. The request completes when the job is finished.
+  A client may re-attach at any time, and pass the number of mappings it already received as the ``after`` query param.
+  If the job is not found, it returns a ``404 Not Found`` response.
+
+  :param job_id: The id of a robustification job
+  :return: An HTTP Response
+
+  """
+  if jobs.get(job_id) is None:
+    return flask.abort(util.make_error_res(404, util.ERR_JOB_NOT_FOUND))
+  after = flask.request.args.get('after', 0, type=int)
+
+  def run():
+    for payload in jobs.events(job_id, after):
+      yield json.dumps(payload) + "\n"
+
+  return app.response_class(run(), content_type='application/octet-stream')
+
+
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+  """
+  Route to get the metrics of the service.
+
+  This function intercepts ``GET`` requests to ``/metrics``.
+  It returns a ``200 OK`` response with all metrics, in the Prometheus text format (see ``Metrics``), including
+
+  * ``pdflinks_stage_seconds``: Time spent on each stage of processing (e.g., ``upload_hash``, ``page_extraction``, ``dedup``)
+  * ``pdflinks_upload_bytes``: Size of uploaded PDFs
+  * ``pdflinks_upstream_seconds``: Latency of calls to the Robust Links service, by outcome
+  * ``pdflinks_robustified_total``: Number of URIs robustified, by outcome
+  * ``pdflinks_robustify_queued``, ``pdflinks_robustify_waiting`` and ``pdflinks_robustify_in_flight``: Number of
+    URIs queued, calls waiting for a free slot, and calls in-flight
+  * ``pdflinks_extractor_pending``: Number of extraction tasks submitted to the pool, but not completed
+  * ``pdflinks_cache_lookups_total``: Number of cache lookups, by cache and result (i.e., ``hit`` or ``miss``)
+  * ``pdflinks_request_seconds``: Time taken to respond to requests, by endpoint and status
+
+  :return: An HTTP Response
+
+  """
+  return flask.Response(util.metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route("/ldn/<pdf_hash>", methods=['GET'])
 def get_ldn_json(pdf_hash: str):
   """
@@ -241,11 +639,67 @@ def send_ldn(pdf_hash: str):
   # generate LDN payload
   ldn_payload = util.generate_ldn_payload(pdf_hash, ld_server_url, ldp_inbox_url).get_json()
   # send LDN payload to LDP inbox of LD server
-  res = requests.post(ldp_inbox_url, json=ldn_payload, headers={'Content-Type': 'application/ld+json'})
+  res = util.send_ldn_payload(ldp_inbox_url, ldn_payload)
   # proxy response from LD server
   return flask.make_response(res.content, res.status_code)
 
 
+@app.route("/ldn", methods=['POST'])
+def send_ldns():
+  """
+  Route to send many LDNs at once, each notifying an LD server of the ``URI-R -> URI-M`` mappings of a PDF.
+
+  This function intercepts ``POST`` requests to ``/ldn``.
+  It expects the request body to contain JSON with a ``notifications`` key, which lists the LDNs to send as objects
+  with two string keys: ``pdf_hash`` and ``ld_server_url``. Otherwise, it returns a ``400 Bad Request`` response.
+
+  The LDP inbox of each distinct LD server is resolved once (see ``APIUtil.resolve_ldp_inbox_url``), and then the
+  LDNs are delivered concurrently, with at most ``LDN_CONCURRENCY`` deliveries in-flight across all requests.
+  The HTTP response `streams` the status of each delivery as a JSON blob (one per line), as soon as it completes.
+  See ``APIUtil.deliver_ldn`` for the fields of each status. Deliveries to LD servers that could not be resolved,
+  or of PDFs without mappings, are streamed as failed deliveries, as are deliveries that fail unexpectedly.
+
+  :return: An HTTP Response
+
+  """
+
+  req_json = util.get_req_payload_as_json()
+  notifications = req_json.get('notifications') if isinstance(req_json, dict) else None
+  if not isinstance(notifications, list) or not all(
+    isinstance(n, dict) and isinstance(n.get('pdf_hash'), str) and isinstance(n.get('ld_server_url'), str)
+    for n in notifications):
+    return flask.abort(util.make_error_res(400, util.ERR_MISSING_PARAM_NOTIFICATIONS))
+  # duplicate notifications are only delivered once
+  pairs = list(dict.fromkeys((n['pdf_hash'], n['ld_server_url']) for n in notifications))
+  host_url = flask.request.host_url
+
+  def run():
+    # resolve the LDP inbox of each distinct LD server once (these are queued ahead of the deliveries that need them)
+    inboxes = {url: ldn_pool.submit(util.lookup_ldp_inbox_url, url) for url in dict.fromkeys(url for _, url in pairs)}
+
+    def deliver(pdf_hash: str, ld_server_url: str) -> dict:
+      try:
+        ldp_inbox_url, error = inboxes[ld_server_url].result()
+        return util.deliver_ldn(pdf_hash, ld_server_url, ldp_inbox_url, host_url, error)
+      except Exception as e:
+        # e.g., if the mappings could not be compacted. this is streamed as a failed delivery, like any other failure,
+        # instead of cutting the stream short
+        app.logger.exception(f"could not deliver the LDN of {pdf_hash} to {ld_server_url}")
+        return {"pdf_hash": pdf_hash, "ld_server_url": ld_server_url, "ldp_inbox_url": None, "ok": False,
+                "status": None, "error": f"The LDN could not be delivered ({type(e).__name__})"}
+
+    futures = [ldn_pool.submit(deliver, pdf_hash, ld_server_url) for pdf_hash, ld_server_url in pairs]
+    try:
+      for future in concurrent.futures.as_completed(futures):
+        yield json.dumps(future.result()) + "\n"
+    finally:
+      # deliveries that have not started are dropped if the client disconnects
+      for future in futures:
+        future.cancel()
+
+  return app.response_class(run(), content_type='application/x-ndjson')
+
+
 @app.route("/preview", methods=['POST'])
 def request_ldn_preview():
   """
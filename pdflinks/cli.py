@@ -0,0 +1,213 @@
+"""
+Command-line entry point to extract and robustify the URLs of a whole corpus of PDFs.
+
+Usage::
+
+  python -m pdflinks.cli [--out DIR] [--workers N] [--timeout SECONDS] [--threads N] [--retry-failed] [--no-robustify]
+                         [--verbose] INPUT [INPUT ...]
+
+Each ``INPUT`` is either a directory (searched recursively for ``*.pdf`` files), a PDF, or a manifest file that
+lists one PDF path per line. URLs are extracted from each PDF with a pool of ``--workers`` processes (see
+``ExtractionPool``), so a PDF that crashes its worker, or takes longer than ``--timeout`` seconds, fails on its own
+rather than stopping the run. Next, URIs are deduplicated across the whole corpus, and each unique URI is robustified once, by ``--threads`` threads.
+Finally, the mappings of each PDF are written to ``<out>/<pdf_hash>.pdf.json``, in the same format that
+``/mappings/<pdf_hash>`` serves.
+
+Progress is recorded in ``<out>/extracted.jsonl`` and ``<out>/robustified.jsonl`` as it is made, so an interrupted
+run resumes where it stopped when started again with the same ``--out``. PDFs whose URLs could not be extracted
+(including those that crashed or timed out) are recorded with an ``error`` (instead of ``urls``), and are extracted
+again when the run is resumed.
+
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import flask
+
+from .errors import ExtractionError
+from .pool import ExtractionPool
+from .util import APIUtil, MappingStore
+
+logger = logging.getLogger("pdflinks.cli")
+
+
+def _extract(pool: ExtractionPool, path: str) -> dict:
+  # return the entry of a PDF in extracted.jsonl (with an error instead of URLs, if extraction failed)
+  try:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+      for chunk in iter(lambda: f.read(1 << 20), b""):
+        md5.update(chunk)
+    return {"path": path, "pdf_hash": md5.hexdigest(), "urls": pool.extract_all_urls(path)}
+  except ExtractionError as e:
+    # the pool logs the failure (e.g., a crash, or a timeout)
+    return {"path": path, "error": e.reason}
+  except Exception as e:
+    logger.warning(f"could not extract URLs from {path}: {e!r}")
+    return {"path": path, "error": repr(e)}
+
+
+def find_pdfs(inputs: Iterable[str]) -> List[str]:
+  """
+  Return the paths of PDFs given by the inputs (i.e., directories, PDFs, or manifest files).
+
+  :param inputs: Paths of directories, PDFs, or manifest files
+  :return: Sorted list of unique PDF paths
+
+  """
+  paths = set()
+  for path in inputs:
+    if os.path.isdir(path):
+      for root, _, files in os.walk(path):
+        paths.update(os.path.join(root, name) for name in files if name.lower().endswith(".pdf"))
+    elif path.lower().endswith(".pdf"):
+      paths.add(path)
+    else:
+      with open(path) as f:
+        paths.update(line.strip() for line in f if line.strip())
+  return sorted(paths)
+
+
+def read_jsonl(path: str) -> Iterator[dict]:
+  """
+  Yield each JSON object in a JSON Lines file (skipping partially written lines).
+
+  :param path: Path of the JSON Lines file
+  :return: A generator of JSON objects
+
+  """
+  if not os.path.exists(path):
+    return
+  with open(path) as f:
+    for line in f:
+      try:
+        yield json.loads(line)
+      except ValueError:
+        continue
+
+
+class Progress:
+  """
+  The ``Progress`` class logs the progress and throughput of a stage, every ``interval`` seconds.
+
+  :param stage: Name of the stage
+  :param total: Number of items to process in the stage
+  :param interval: Minimum number of seconds between log lines
+
+  """
+
+  def __init__(self, stage: str, total: int, interval: float = 5) -> None:
+    self.stage = stage
+    self.total = total
+    self.interval = interval
+    self.done = 0
+    self.started = self.logged = time.monotonic()
+
+  def update(self, n: int = 1) -> None:
+    self.done += n
+    now = time.monotonic()
+    if now - self.logged >= self.interval or self.done == self.total:
+      self.logged = now
+      rate = self.done / max(now - self.started, 1e-9)
+      eta = (self.total - self.done) / rate if rate else float("inf")
+      logger.info(f"{self.stage}: {self.done}/{self.total} ({rate:.1f}/s, eta {eta:.0f}s)")
+
+
+def run(pdfs: List[str], out_dir: str, workers: int, threads: int, retry_failed: bool, robustify: bool,
+        timeout: float = 300) -> None:
+  """
+  Extract and robustify the URLs of a corpus of PDFs, resuming from the progress recorded in ``out_dir``.
+
+  :param pdfs: Paths of the PDFs
+  :param out_dir: Directory to write mappings (and progress) to
+  :param workers: Number of processes to extract URLs with
+  :param threads: Number of threads to robustify URIs with
+  :param retry_failed: Whether to robustify URIs that failed in a previous run again
+  :param robustify: Whether to robustify URIs (or only extract them)
+  :param timeout: Seconds that the extraction of each PDF may take
+
+  """
+  os.makedirs(out_dir, exist_ok=True)
+  extracted_path = os.path.join(out_dir, "extracted.jsonl")
+  robustified_path = os.path.join(out_dir, "robustified.jsonl")
+
+  # extract URLs from the PDFs that were not extracted in a previous run (or whose extraction failed)
+  extracted: Dict[str, dict] = {e["path"]: e for e in read_jsonl(extracted_path)}
+  pending = [path for path in pdfs if path not in extracted or "error" in extracted[path]]
+  logger.info(f"extract: {len(pdfs)} PDFs, {len(pdfs) - len(pending)} extracted in a previous run")
+  progress = Progress("extract", len(pending))
+  # one thread per worker process submits PDFs to the pool, and waits for their URLs
+  pool = ExtractionPool(workers, timeout)
+  try:
+    with open(extracted_path, "a") as f, concurrent.futures.ThreadPoolExecutor(workers) as executor:
+      for entry in executor.map(lambda path: _extract(pool, path), pending):
+        extracted[entry["path"]] = entry
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        progress.update()
+  finally:
+    pool.close()
+  failed = [e["path"] for e in extracted.values() if "error" in e]
+  if failed:
+    logger.warning(f"extract: {len(failed)} PDFs failed (see {extracted_path}), and are retried when the run is resumed")
+  # only PDFs that were extracted have URLs to robustify
+  extracted = {path: e for path, e in extracted.items() if "error" not in e}
+  if not robustify:
+    return
+
+  # robustify each unique URI (across the corpus) that was not robustified in a previous run
+  results: Dict[str, dict] = {}
+  for payload in read_jsonl(robustified_path):
+    MappingStore.merge(results, payload)
+  uris = set(url for e in extracted.values() for url in e["urls"])
+  pending = sorted(uri for uri in uris if uri not in results or (retry_failed and not results[uri]["ok"]))
+  logger.info(f"robustify: {len(uris)} unique URIs, {len(uris) - len(pending)} robustified in a previous run")
+  app = flask.Flask("pdflinks")
+  app.config['MAPPING_FOLDER'] = out_dir
+  # keep mappings flat in ``out_dir`` (the service shards them when it first reads them)
+  app.config['MAPPING_SHARD_DEPTH'] = 0
+  app.config['HTTP_POOL_SIZE'] = threads
+  # log per-URI calls only when verbose
+  app.logger.setLevel(logger.getEffectiveLevel() if logger.isEnabledFor(logging.DEBUG) else logging.WARNING)
+  util = APIUtil(app)
+  progress = Progress("robustify", len(pending))
+  with open(robustified_path, "a") as f, concurrent.futures.ThreadPoolExecutor(threads) as pool:
+    for payload in pool.map(util.call_robust_links_svc, pending):
+      MappingStore.merge(results, payload)
+      f.write(json.dumps(payload) + "\n")
+      f.flush()
+      progress.update()
+
+  # write the mappings of each PDF
+  progress = Progress("write", len(extracted))
+  for e in extracted.values():
+    payloads = [results[url] for url in e["urls"] if url in results]
+    if payloads:
+      util.mappings.extend(e["pdf_hash"], payloads)
+    progress.update()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+  parser = argparse.ArgumentParser(prog="python -m pdflinks.cli", description=__doc__.strip().splitlines()[0])
+  parser.add_argument("inputs", nargs="+", help="directories, PDFs, or manifest files (one PDF path per line)")
+  parser.add_argument("--out", default="./mappings", help="directory to write mappings and progress to")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes to extract URLs with")
+  parser.add_argument("--timeout", type=float, default=300, help="seconds that the extraction of each PDF may take")
+  parser.add_argument("--threads", type=int, default=10, help="number of threads to robustify URIs with")
+  parser.add_argument("--retry-failed", action="store_true", help="robustify URIs that failed in a previous run again")
+  parser.add_argument("--no-robustify", dest="robustify", action="store_false", help="only extract URLs")
+  parser.add_argument("--verbose", action="store_true", help="log each call to the Robust Links service")
+  args = parser.parse_args(argv)
+  logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="[%(asctime)s] %(levelname)s: %(message)s", stream=sys.stderr)
+  run(find_pdfs(args.inputs), args.out, args.workers, args.threads, args.retry_failed, args.robustify, args.timeout)
+
+
+if __name__ == "__main__":
+  main()
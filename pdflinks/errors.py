@@ -14,3 +14,26 @@ class URLError(Exception):
 
   def __str__(self) -> str:
     return f"Invalid URL: {self.url}"
+
+
+class ExtractionError(Exception):
+  """
+  The ``ExtractionError`` is raised when URLs could not be extracted from a PDF,
+  e.g., because its extraction exceeded a time or memory limit, or crashed the worker extracting it.
+
+  An error is ``transient`` if extracting the same PDF again may succeed (e.g., if it timed out under load, or if no
+  worker was available), rather than being caused by the PDF itself (e.g., if it is malformed).
+
+  :param reason: Why the extraction failed
+  :param transient: Whether extracting the PDF again may succeed
+  :param args: Optional arguments to propagate into the base ``Exception`` class.
+
+  """
+
+  def __init__(self, reason: str, transient: bool = False, *args: object) -> None:
+    super().__init__(*args)
+    self.reason = reason
+    self.transient = transient
+
+  def __str__(self) -> str:
+    return f"Could not extract URLs: {self.reason}"
@@ -1,28 +1,259 @@
+import concurrent.futures
 import ctypes
 import logging
-from typing import Set, List
+import os
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar
 
 import PyPDF2.pdf
 import pypdfium
 
-from .errors import URLError
-from .util import URLUtil
+from .util import Metrics, URLUtil
+
+T = TypeVar("T")
+
+
+# PDFium is not thread-safe, so calls to it from threads of the same process are serialized
+_pdfium_lock = threading.RLock()
+
+
+def _init_pdfium() -> None:
+  # this line is very important, otherwise it would not work
+  pypdfium.FPDF_InitLibraryWithConfig(pypdfium.FPDF_LIBRARY_CONFIG(2, None, None, 0))
+
+
+def _count_pages(fp: str) -> Optional[int]:
+  """
+  Count the pages in a PDF (Using PDFium)
+
+  :param fp: Path to PDF
+  :return: Number of pages in PDF (or None if PDFium cannot read it)
+
+  """
+  with _pdfium_lock:
+    _init_pdfium()
+    doc = pypdfium.FPDF_LoadDocument(fp, None)
+    if not doc:
+      return None
+    page_count = pypdfium.FPDF_GetPageCount(doc)
+    pypdfium.FPDF_CloseDocument(doc)
+  return page_count
+
+
+def _read_annot_urls(fp: str) -> List[str]:
+  """
+  Read URL-like strings from the link annotations of a PDF (Using PyPDF2)
+
+  This function may be run in a worker process, so it returns the URL-like strings as-is,
+  leaving their canonicalization to the caller.
+
+  :param fp: Path to PDF
+  :return: List of URL-like strings in the link annotations
+
+  """
+  urls = []
+  with open(fp, "rb") as file:
+    pdf = PyPDF2.pdf.PdfFileReader(file)
+    for page in pdf.pages:
+      page: PyPDF2.pdf.PageObject = page.getObject()
+      if "/Annots" in page:
+        for annot in page["/Annots"]:
+          annot = annot.getObject()
+          if "/A" in annot:
+            ann = annot["/A"].getObject()
+          elif "/S" in annot:
+            ann = annot["/S"].getObject()
+          else:
+            continue
+          if "/URI" in ann:
+            urls.append(ann["/URI"])
+  return urls
+
+
+def _read_link_uris(doc, page) -> List[str]:
+  # read the URIs of the link annotations of a loaded page
+  uris = []
+  buf_len = 2048
+  buffer = ctypes.create_string_buffer(buf_len)
+  pos = ctypes.c_int(0)
+  link = pypdfium.FPDF_LINK()
+  while pypdfium.FPDFLink_Enumerate(page, ctypes.byref(pos), ctypes.byref(link)):
+    action = pypdfium.FPDFLink_GetAction(link)
+    if not action or pypdfium.FPDFAction_GetType(action) != pypdfium.PDFACTION_URI:
+      continue
+    uri_length = pypdfium.FPDFAction_GetURIPath(doc, action, buffer, buf_len)
+    if uri_length > buf_len:
+      # the URI does not fit in the buffer, so read it again with a buffer large enough
+      buf_len = uri_length
+      buffer = ctypes.create_string_buffer(buf_len)
+      uri_length = pypdfium.FPDFAction_GetURIPath(doc, action, buffer, buf_len)
+    if uri_length > 1:
+      # URIs are 7-bit ASCII strings, terminated by a NUL character
+      uris.append(buffer.raw[:uri_length - 1].decode("latin-1"))
+  return uris
+
+
+def _read_web_links(page, buffer: ctypes.Array) -> List[str]:
+  # read the URL-like strings in the text of a loaded page
+  urls = []
+  buf_len = len(buffer)
+  buffer_ = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_ushort))
+  # load text in PDF page
+  text = pypdfium.FPDFText_LoadPage(page)
+  # Load links in PDF text
+  links = pypdfium.FPDFLink_LoadWebLinks(text)
+  link_count = pypdfium.FPDFLink_CountWebLinks(links)
+  # get each URL
+  for j in range(link_count):
+    url_length = pypdfium.FPDFLink_GetURL(links, j, buffer_, buf_len)
+    url_nums = buffer[:url_length - 1]
+    urls.append("".join(map(chr, url_nums)).strip())
+  pypdfium.FPDFLink_CloseWebLinks(links)
+  pypdfium.FPDFText_ClosePage(text)
+  return urls
+
+
+def _read_text_urls(fp: str, start: int, stop: int) -> List[str]:
+  """
+  Read URL-like strings from the text of pages ``start`` to ``stop - 1`` of a PDF (Using PDFium)
+
+  This function is run in worker processes, so it loads its own copy of the document (PDFium is not thread-safe),
+  and returns the URL-like strings as-is, leaving their canonicalization to the caller.
+
+  :param fp: Path to PDF
+  :param start: Index of the first page to read
+  :param stop: Index of the page to stop reading at (exclusive)
+  :return: List of URL-like strings in the text of the given pages
+
+  """
+  return _read_page_urls(fp, start, stop, annots=False)[1]
+
+
+def _read_page_urls(fp: str, start: int, stop: int, annots: bool = True) -> Tuple[List[str], List[str]]:
+  """
+  Read URL-like strings from both the link annotations and the text of pages ``start`` to ``stop - 1`` of a PDF,
+  loading the document (and each page) only once (Using PDFium)
+
+  This function is run in worker processes, so it loads its own copy of the document (PDFium is not thread-safe),
+  and returns the URL-like strings as-is, leaving their canonicalization to the caller.
+
+  :param fp: Path to PDF
+  :param start: Index of the first page to read
+  :param stop: Index of the page to stop reading at (exclusive)
+  :param annots: Whether to read the link annotations (default: True)
+  :return: Lists of URL-like strings in the link annotations, and in the text, of the given pages
+
+  """
+  annot_urls, text_urls = [], []
+  buffer = (ctypes.c_ushort * 2048)()
+  with _pdfium_lock:
+    _init_pdfium()
+    doc = pypdfium.FPDF_LoadDocument(fp, None)
+    for i in range(start, stop):
+      page_annot_urls, page_text_urls = _read_page(doc, i, buffer, annots)
+      annot_urls.extend(page_annot_urls)
+      text_urls.extend(page_text_urls)
+    pypdfium.FPDF_CloseDocument(doc)
+  return annot_urls, text_urls
+
+
+def _read_page(doc, i: int, buffer: ctypes.Array, annots: bool = True) -> Tuple[List[str], List[str]]:
+  # read the URL-like strings in the link annotations and the text of a page, and release the page afterwards
+  page = pypdfium.FPDF_LoadPage(doc, i)
+  annot_urls = _read_link_uris(doc, page) if annots else []
+  text_urls = _read_web_links(page, buffer)
+  pypdfium.FPDF_ClosePage(page)
+  return annot_urls, text_urls
 
 
 class Extractor:
   """
   The ``Extractor`` class is used to perform URL extraction from PDF documents.
-  It uses `PyPDF2 <https://pypi.org/project/PyPDF2/>`_ and `PyPDFIUM <https://pypi.org/project/pypdfium/>`_ for this.
-  Here, PyPDF2 is used to extract URLs from PDF annotations, while PyPDFIUM is used to extract URLs from PDF text.
+  It uses `PyPDFIUM <https://pypi.org/project/pypdfium/>`_ and `PyPDF2 <https://pypi.org/project/PyPDF2/>`_ for this.
+
+  With the (default) ``pdfium`` engine, URLs from PDF annotations and URLs from PDF text are both extracted by PyPDFIUM,
+  in a single pass that loads the document (and each page) only once. PyPDF2 is only used to extract URLs from PDF
+  annotations of documents that PyPDFIUM cannot read. With the ``pypdf2`` engine, PyPDF2 is used to extract URLs from
+  PDF annotations, while PyPDFIUM is used to extract URLs from PDF text, in two separate passes.
 
   When extracting URLs, priority is given to URLs from PDF annotations, as they were found less error-prone than URLs from PDF text.
   This is because URLs in PDF text may be extracted partially (e.g., truncated due to a newline character) or with
   additional characters (e.g., with unwanted letters from the sentence following a URL).
 
+  Each extraction result is tagged with the ``version`` of the extractor that produced it.
+  Bump ``VERSION`` whenever the extraction logic changes, so that cached results are invalidated.
+
+  Pages of large PDFs are extracted concurrently, using a pool of worker processes.
+  With the ``pypdf2`` engine, the same pool is used to extract annotated URLs alongside text URLs.
+
+  :param workers: Number of worker processes to extract with (default: number of CPUs, 1 disables the pool)
+  :param parallel_page_threshold: Minimum number of pages for a PDF to be extracted with the pool
+  :param concurrent_passes: Whether to run both passes of the ``pypdf2`` engine concurrently (default: True)
+  :param engine: Extraction engine, either ``pdfium`` (single pass, default) or ``pypdf2`` (two passes)
+  :param metrics: Metrics to record the time spent on each stage of extraction in (if any)
+
   """
 
-  def __init__(self):
+  VERSION = "2"
+
+  ENGINE_PDFIUM = "pdfium"
+  ENGINE_PYPDF2 = "pypdf2"
+
+  def __init__(self, workers: Optional[int] = None, parallel_page_threshold: int = 100, concurrent_passes: bool = True,
+               engine: str = ENGINE_PDFIUM, metrics: Optional[Metrics] = None):
+    if engine not in (self.ENGINE_PDFIUM, self.ENGINE_PYPDF2):
+      raise ValueError(f"unknown extraction engine: {engine}")
     self.util = URLUtil()
+    self.engine = engine
+    self.workers = workers or os.cpu_count() or 1
+    self.parallel_page_threshold = parallel_page_threshold
+    self.concurrent_passes = concurrent_passes
+    self.metrics = metrics or Metrics()
+    self._pool = None
+    self._pool_lock = threading.Lock()
+
+  def get_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Return the pool of worker processes used for extraction (created on first use).
+
+    :return: Pool of worker processes
+
+    """
+    with self._pool_lock:
+      if self._pool is None:
+        self._pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+      return self._pool
+
+  def canonicalize_urls(self, urls: Iterable[str]) -> Set[str]:
+    """
+    Canonicalize URL-like strings, and drop the ones that are not valid URLs (see ``URLUtil.canonicalize_urls``).
+
+    :param urls: URL-like strings
+    :return: Set of canonical URLs
+
+    """
+    return self.util.canonicalize_urls(urls)
+
+  @property
+  def version(self) -> str:
+    """
+    Version tag of the extraction logic, which changes when ``VERSION``, the engine, or the blacklist changes
+    (so that URLs cached by one engine are not served once another is configured).
+
+    :return: Version tag of the extractor
+
+    """
+    return f"{self.VERSION}-{self.engine}-{self.util.blacklist_digest[:8]}"
+
+  def count_pages(self, fp: str) -> Optional[int]:
+    """
+    Count the pages in a PDF (Using PDFium)
+
+    :param fp: Path to PDF
+    :return: Number of pages in PDF (or None if PDFium cannot read it)
+
+    """
+    return _count_pages(fp)
 
   def extract_annot_urls(self, fp: str) -> Set[str]:
     """
@@ -32,82 +263,176 @@ class Extractor:
     :return: Set of Annotated URLs in PDF
 
     """
-    urls = set()
-    with open(fp, "rb") as file:
-      pdf = PyPDF2.pdf.PdfFileReader(file)
-      for page in pdf.pages:
-        page: PyPDF2.pdf.PageObject = page.getObject()
-        if "/Annots" in page:
-          for annot in page["/Annots"]:
-            annot = annot.getObject()
-            if "/A" in annot:
-              ann = annot["/A"].getObject()
-            elif "/S" in annot:
-              ann = annot["/S"].getObject()
-            else:
-              continue
-            if "/URI" in ann:
-              try:
-                urls.add(self.util.canonicalize_url(ann["/URI"]))
-              except URLError as e:
-                logging.debug(e)
-    return urls
+    return self.canonicalize_urls(_read_annot_urls(fp))
+
+  def _submit(self, fn: Callable[..., T], *args) -> "concurrent.futures.Future[T]":
+    # submit a task to the pool, while counting the tasks that are pending
+    pending = self.metrics.gauge("pdflinks_extractor_pending", "Number of extraction tasks submitted, but not completed")
+    pending.inc()
+    future = self.get_pool().submit(fn, *args)
+    future.add_done_callback(lambda _: pending.dec())
+    return future
+
+  def _read_pages(self, fp: str, page_count: int, read: Callable[[str, int, int], T]) -> Iterator[T]:
+    # read all pages of a PDF serially, or (for large PDFs) split them into page ranges, and read them in the pool
+    if self.workers <= 1 or page_count < self.parallel_page_threshold:
+      yield read(fp, 0, page_count)
+      return
+    # split pages into (more) ranges (than workers), to balance load across workers
+    num_ranges = min(page_count, self.workers * 4)
+    bounds = [page_count * k // num_ranges for k in range(num_ranges + 1)]
+    futures = [self._submit(read, fp, start, stop) for start, stop in zip(bounds, bounds[1:])]
+    for future in concurrent.futures.as_completed(futures):
+      yield future.result()
 
   def extract_text_urls(self, fp: str) -> Set[str]:
     """
     Extract Text URLs from PDF (Using PDFium)
 
+    PDFs with at least ``parallel_page_threshold`` pages are split into page ranges,
+    which are read concurrently in a pool of ``workers`` processes.
+    Smaller PDFs are read serially in the current process.
+
     :param fp: Path to PDF
     :return: Set of Text URLs in PDF
 
     """
+    page_count = _count_pages(fp)
+    if page_count is None:
+      logging.warning(f"PDFium could not read {fp}, so no text URLs were extracted")
+      return set()
+    # collect URL-like strings of all pages, to canonicalize them in one batch
     urls = set()
-    buf_len = 2048
-    buffer = (ctypes.c_ushort * buf_len)()
-    buffer_ = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_ushort))
-    # this line is very important, otherwise it would not work
-    pypdfium.FPDF_InitLibraryWithConfig(pypdfium.FPDF_LIBRARY_CONFIG(2, None, None, 0))
+    for text_urls in self._read_pages(fp, page_count, _read_text_urls):
+      urls.update(text_urls)
+    return self.canonicalize_urls(urls)
 
-    doc = pypdfium.FPDF_LoadDocument(fp, None)
-    page_count = pypdfium.FPDF_GetPageCount(doc)
-    for i in range(page_count):
-      # load PDF page
-      page = pypdfium.FPDF_LoadPage(doc, i)
-      # load text in PDF page
-      text = pypdfium.FPDFText_LoadPage(page)
-      # Load links in PDF text
-      links = pypdfium.FPDFLink_LoadWebLinks(text)
-      link_count = pypdfium.FPDFLink_CountWebLinks(links)
-      # get each URL
-      for j in range(link_count):
-        url_length = pypdfium.FPDFLink_GetURL(links, j, buffer_, buf_len)
-        url_nums = buffer[:url_length - 1]
-        url = "".join(map(chr, url_nums)).strip()
-        try:
-          urls.add(self.util.canonicalize_url(url))
-        except URLError as e:
-          logging.debug(e)
-      pypdfium.FPDFLink_CloseWebLinks(links)
-      pypdfium.FPDFText_ClosePage(text)
-      pypdfium.FPDF_ClosePage(page)
-    pypdfium.FPDF_CloseDocument(doc)
-    return urls
+  def extract_page_urls(self, fp: str) -> Tuple[Set[str], Set[str]]:
+    """
+    Extract Annotated URLs and Text URLs from PDF, in a single pass (Using PDFium)
+
+    Each page is loaded once, and both its link annotations and its text are read from it.
+    Like ``extract_text_urls``, large PDFs are read concurrently in a pool of ``workers`` processes.
+    If PDFium cannot read the PDF, annotated URLs are extracted using PyPDF2 instead (and no text URLs are extracted).
+
+    :param fp: Path to PDF
+    :return: Set of Annotated URLs, and Set of Text URLs in PDF
+
+    """
+    page_count = _count_pages(fp)
+    if page_count is None:
+      logging.warning(f"PDFium could not read {fp}, so falling back to PyPDF2 for annotated URLs")
+      return self.extract_annot_urls(fp), set()
+    # collect URL-like strings of all pages, to canonicalize them in one batch
+    annot_urls, text_urls = set(), set()
+    for page_annot_urls, page_text_urls in self._read_pages(fp, page_count, _read_page_urls):
+      annot_urls.update(page_annot_urls)
+      text_urls.update(page_text_urls)
+    return self.canonicalize_urls(annot_urls), self.canonicalize_urls(text_urls)
 
   def extract_all_urls(self, fp: str) -> List[str]:
     """
-    Extract All URLs from PDF (Using PyPDF2 and PDFium)
+    Extract All URLs from PDF (Using PDFium, and PyPDF2 if needed)
+
+    With the ``pypdf2`` engine, unless ``concurrent_passes`` is False (or the pool is disabled), annotated URLs are
+    read in a worker process while text URLs are being extracted, since both passes are independent reads of the same PDF.
 
     :param fp: Path to PDF
     :return: Set of All URLs in PDF
 
     """
-    # extract annotated URLs (baseline, always valid)
-    annot_urls = set(self.extract_annot_urls(fp))
-    # extract full text URLs (error-prone)
-    full_text_urls = set(self.extract_text_urls(fp))
-    # pick unique URLs from full_text_urls
-    full_text_urls = self.util.pick_uniq_urls(full_text_urls)
-    # pick URLs from full_text_urls do not match (exact/partial) any URL in annot_urls
-    full_text_urls = self.util.pick_new_urls(full_text_urls, annot_urls)
+    if self.engine == self.ENGINE_PDFIUM:
+      # extract annotated URLs (baseline, always valid) and full text URLs (error-prone) together
+      with self.metrics.timer("page_extraction"):
+        annot_urls, full_text_urls = self.extract_page_urls(fp)
+    elif self.concurrent_passes and self.workers > 1:
+      # read annotated URLs in the background
+      annot_future = self._submit(_read_annot_urls, fp)
+      # extract full text URLs (error-prone)
+      with self.metrics.timer("text_extraction"):
+        full_text_urls = set(self.extract_text_urls(fp))
+      # extract annotated URLs (baseline, always valid)
+      with self.metrics.timer("annot_extraction"):
+        annot_urls = self.canonicalize_urls(annot_future.result())
+    else:
+      # extract annotated URLs (baseline, always valid)
+      with self.metrics.timer("annot_extraction"):
+        annot_urls = set(self.extract_annot_urls(fp))
+      # extract full text URLs (error-prone)
+      with self.metrics.timer("text_extraction"):
+        full_text_urls = set(self.extract_text_urls(fp))
+    return self.merge_urls(annot_urls, full_text_urls)
+
+  def merge_urls(self, annot_urls: Set[str], full_text_urls: Set[str]) -> List[str]:
+    """
+    Merge the Annotated URLs and Text URLs of a PDF into its list of All URLs
+
+    :param annot_urls: Set of Annotated URLs in PDF
+    :param full_text_urls: Set of Text URLs in PDF
+    :return: Sorted list of All URLs in PDF
+
+    """
+    with self.metrics.timer("dedup"):
+      # pick unique URLs from full_text_urls
+      full_text_urls = self.util.pick_uniq_urls(full_text_urls)
+      # pick URLs from full_text_urls do not match (exact/partial) any URL in annot_urls
+      full_text_urls = self.util.pick_new_urls(full_text_urls, annot_urls)
     # concatenate, sort, and return
     return sorted(annot_urls.union(full_text_urls))
+
+  def iter_page_urls(self, fp: str) -> Iterator[Tuple[Set[str], Set[str]]]:
+    """
+    Yield the Annotated URLs and Text URLs of each page of a PDF, one page at a time (Using PDFium)
+
+    Only one page is loaded at a time, and it is released before the next page is loaded,
+    so memory use stays bounded regardless of the number of pages.
+    If PDFium cannot read the PDF, the Annotated URLs of the whole PDF are yielded at once (Using PyPDF2).
+
+    :param fp: Path to PDF
+    :return: A generator of (Set of Annotated URLs, Set of Text URLs) for each page
+
+    """
+    buffer = (ctypes.c_ushort * 2048)()
+    with _pdfium_lock:
+      _init_pdfium()
+      doc = pypdfium.FPDF_LoadDocument(fp, None)
+      page_count = pypdfium.FPDF_GetPageCount(doc) if doc else 0
+    if not doc:
+      logging.warning(f"PDFium could not read {fp}, so falling back to PyPDF2 for annotated URLs")
+      yield self.extract_annot_urls(fp), set()
+      return
+    try:
+      for i in range(page_count):
+        # only hold the lock while reading a page, so that other threads can use PDFium in-between
+        with _pdfium_lock:
+          annot_urls, text_urls = _read_page(doc, i, buffer)
+        yield self.canonicalize_urls(annot_urls), self.canonicalize_urls(text_urls)
+    finally:
+      with _pdfium_lock:
+        pypdfium.FPDF_CloseDocument(doc)
+
+  def iter_urls(self, fp: str, on_done: Optional[Callable[[List[str]], None]] = None) -> Iterator[str]:
+    """
+    Yield the URLs of a PDF as its pages are extracted, one page at a time (see ``iter_page_urls``)
+
+    Each URL is yielded once, when it is first found. Since later pages are not known yet, Text URLs are only
+    matched against the Annotated URLs of the same page, so a few Text URLs that ``extract_all_urls`` would drop
+    may be yielded. Once all pages are extracted, ``on_done`` is called with the same list of All URLs that
+    ``extract_all_urls`` returns (e.g., to cache it).
+
+    :param fp: Path to PDF
+    :param on_done: Function to call with the list of All URLs in PDF, once extraction is complete
+    :return: A generator of URLs in PDF
+
+    """
+    annot_urls, full_text_urls, seen = set(), set(), set()
+    for page_annot_urls, page_text_urls in self.iter_page_urls(fp):
+      annot_urls.update(page_annot_urls)
+      full_text_urls.update(page_text_urls)
+      # pick unique URLs from page_text_urls that do not match (exact/partial) any URL in page_annot_urls
+      page_text_urls = self.util.pick_new_urls(self.util.pick_uniq_urls(page_text_urls), page_annot_urls)
+      for url in sorted(page_annot_urls.union(page_text_urls) - seen):
+        seen.add(url)
+        yield url
+    if on_done is not None:
+      on_done(self.merge_urls(annot_urls, full_text_urls))
@@ -0,0 +1,232 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Iterator, List, Optional
+
+from .robustifier import Robustifier
+from .util import MappingStore, PDFStore, TTLCache
+
+
+class JobQueue:
+  """
+  The ``JobQueue`` class runs robustification jobs in the background, decoupled from any HTTP connection.
+
+  A job robustifies a list of URIs of a PDF. Jobs (and the status of each of their URIs) are persisted in a local
+  `SQLite <https://docs.python.org/3/library/sqlite3.html>`_ database, and are run by a pool of worker threads using
+  the ``Robustifier``. Each mapping is recorded as soon as it completes (and is also stored in the ``MappingStore``).
+
+  Several processes may share the same database. Each job is claimed by one worker (atomically), and running jobs
+  are kept alive by a heartbeat of the process running them. Jobs whose heartbeat is older than ``lease`` seconds
+  (e.g., since the process running them stopped) are queued again, and only their pending URIs are robustified.
+  URIs that already have a successful mapping (stored for the PDF, or cached) are never re-requested.
+
+  No worker threads run until ``start`` is called.
+
+  :param db_path: Path of the SQLite database
+  :param robustifier: The ``Robustifier`` used to robustify URIs
+  :param mappings: The ``MappingStore`` to store generated mappings in
+  :param mapping_cache: Cache of recent successful mappings, keyed by URI (if any)
+  :param workers: Number of jobs to run concurrently
+  :param pdfs: The ``PDFStore`` to record the mapping status of PDFs in (if any)
+  :param lease: Seconds after its last heartbeat that a running job is considered abandoned
+
+  """
+
+  STATUS_QUEUED = "queued"
+  STATUS_RUNNING = "running"
+  STATUS_DONE = "done"
+  STATUS_FAILED = "failed"
+
+  def __init__(self, db_path: str, robustifier: Robustifier, mappings: MappingStore,
+               mapping_cache: Optional[TTLCache] = None, workers: int = 2, pdfs: Optional[PDFStore] = None,
+               lease: float = 60) -> None:
+    self.robustifier = robustifier
+    self.mappings = mappings
+    self.pdfs = pdfs
+    self.mapping_cache = mapping_cache
+    self.workers = workers
+    self.lease = lease
+    # other processes may hold the database for a moment (e.g., while claiming a job)
+    self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    self._lock = threading.Lock()
+    # notified whenever a job is queued or a URI is completed
+    self._changed = threading.Condition(self._lock)
+    self._threads = []
+    # ids of the jobs run by this process, whose heartbeat it keeps
+    self._running = set()
+    with self._lock, self._db:
+      self._db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, pdf_hash TEXT, status TEXT, error TEXT, "
+                       "created REAL, updated REAL, heartbeat REAL)")
+      self._db.execute("CREATE TABLE IF NOT EXISTS job_uris ("
+                       "job_id TEXT, uri TEXT, ok INTEGER, payload TEXT, seq INTEGER, PRIMARY KEY (job_id, uri))")
+      # add the heartbeat to databases created by earlier versions (whose running jobs then count as abandoned)
+      if "heartbeat" not in set(row[1] for row in self._db.execute("PRAGMA table_info(jobs)")):
+        self._db.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+
+  def start(self) -> None:
+    """
+    Start the worker threads (and the heartbeat of the jobs that they run), unless they were started already.
+
+    """
+    with self._lock:
+      if self._threads:
+        return
+      threads = [threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True) for i in range(self.workers)]
+      threads.append(threading.Thread(target=self._beat, name="job-heartbeat", daemon=True))
+      self._threads.extend(threads)
+    for thread in threads:
+      thread.start()
+
+  def submit(self, pdf_hash: str, uris: List[str]) -> str:
+    """
+    Queue a job to robustify URIs of a PDF, and return its id.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :param uris: URIs (of the PDF) to robustify
+    :return: The id of the job
+
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    uris = list(dict.fromkeys(uri.strip() for uri in uris))
+    with self._changed, self._db:
+      self._db.execute("INSERT INTO jobs (id, pdf_hash, status, created, updated) VALUES (?, ?, ?, ?, ?)",
+                       (job_id, pdf_hash, self.STATUS_QUEUED, now, now))
+      self._db.executemany("INSERT INTO job_uris VALUES (?, ?, NULL, NULL, NULL)", [(job_id, uri) for uri in uris])
+      self._changed.notify_all()
+    return job_id
+
+  def get(self, job_id: str) -> Optional[dict]:
+    """
+    Return the status of a job, or None if it does not exist.
+
+    The status has the fields ``id``, ``pdf_hash``, ``status`` (one of ``queued``, ``running``, ``done`` or
+    ``failed``), ``error``, ``created``, ``updated``, ``total`` (number of URIs), ``completed`` (number of URIs
+    processed), and ``ok`` (number of URIs robustified successfully).
+
+    :param job_id: The id of the job
+    :return: The status of the job (or None)
+
+    """
+    with self._lock:
+      row = self._db.execute("SELECT id, pdf_hash, status, error, created, updated FROM jobs WHERE id = ?",
+                             (job_id,)).fetchone()
+      if row is None:
+        return None
+      total, completed, ok = self._db.execute(
+        "SELECT COUNT(*), COUNT(seq), COALESCE(SUM(ok), 0) FROM job_uris WHERE job_id = ?", (job_id,)).fetchone()
+    keys = ("id", "pdf_hash", "status", "error", "created", "updated")
+    return {**dict(zip(keys, row)), "total": total, "completed": completed, "ok": ok}
+
+  def events(self, job_id: str, after: int = 0) -> Iterator[dict]:
+    """
+    Yield the mappings generated by a job, in the order they were completed, until the job is finished.
+
+    Mappings that were completed before this call are yielded first, so a client can re-attach to a job at any
+    time, and skip the first ``after`` mappings that it already received.
+
+    :param job_id: The id of the job
+    :param after: Number of mappings to skip
+    :return: A generator of mappings
+
+    """
+    while True:
+      with self._changed:
+        rows = self._db.execute("SELECT seq, payload FROM job_uris WHERE job_id = ? AND seq > ? ORDER BY seq",
+                                (job_id, after)).fetchall()
+        status, = self._db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not rows and status in (self.STATUS_DONE, self.STATUS_FAILED):
+          return
+        if not rows:
+          self._changed.wait(timeout=1)
+          continue
+      for seq, payload in rows:
+        after = seq
+        yield json.loads(payload)
+
+  def _requeue_abandoned(self) -> None:
+    # queue the running jobs whose heartbeat has expired again (called with the lock held)
+    with self._db:
+      self._db.execute("UPDATE jobs SET status = ? WHERE status = ? AND COALESCE(heartbeat, 0) < ?",
+                       (self.STATUS_QUEUED, self.STATUS_RUNNING, time.time() - self.lease))
+
+  def _claim(self) -> Optional[tuple]:
+    # wait for a queued job, and mark it as running.
+    # jobs may be queued (or abandoned) by other processes, which cannot notify this one, so the queue is also polled
+    with self._changed:
+      while True:
+        self._requeue_abandoned()
+        for row in self._db.execute("SELECT id, pdf_hash FROM jobs WHERE status = ? ORDER BY created LIMIT ?",
+                                    (self.STATUS_QUEUED, self.workers + 1)).fetchall():
+          # the job is only claimed if no other worker (of any process) claimed it first
+          now = time.time()
+          with self._db:
+            claimed = self._db.execute(
+              "UPDATE jobs SET status = ?, updated = ?, heartbeat = ? WHERE id = ? AND status = ?",
+              (self.STATUS_RUNNING, now, now, row[0], self.STATUS_QUEUED)).rowcount
+          if claimed:
+            self._running.add(row[0])
+            return row
+        self._changed.wait(timeout=min(5, self.lease / 4))
+
+  def _beat(self) -> None:
+    # renew the heartbeat of the jobs run by this process, well within their lease
+    while True:
+      time.sleep(self.lease / 4)
+      with self._lock, self._db:
+        self._db.executemany("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = ?",
+                             [(time.time(), job_id, self.STATUS_RUNNING) for job_id in self._running])
+
+  def _record(self, job_id: str, pdf_hash: str, payload: dict) -> None:
+    # record a completed URI of a job
+    self.mappings.append(pdf_hash, payload)
+    with self._changed, self._db:
+      self._db.execute("UPDATE job_uris SET ok = ?, payload = ?, "
+                       "seq = (SELECT COALESCE(MAX(seq), 0) + 1 FROM job_uris WHERE job_id = ?) "
+                       "WHERE job_id = ? AND uri = ?",
+                       (int(payload["ok"]), json.dumps(payload), job_id, job_id, payload["uri"]))
+      self._db.execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time(), job_id))
+      self._changed.notify_all()
+
+  def _finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+    with self._changed, self._db:
+      self._db.execute("UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                       (status, error, time.time(), job_id))
+      self._running.discard(job_id)
+      self._changed.notify_all()
+
+  def _run(self, job_id: str, pdf_hash: str) -> None:
+    with self._lock:
+      rows = self._db.execute("SELECT uri FROM job_uris WHERE job_id = ? AND seq IS NULL", (job_id,)).fetchall()
+    # record the URIs that were robustified already, without re-requesting them
+    stored = self.mappings.load(pdf_hash) or {}
+    pending = []
+    for uri, in rows:
+      payload = stored.get(uri)
+      if (payload is None or not payload["ok"]) and self.mapping_cache is not None:
+        payload = self.mapping_cache.get(uri)
+      if payload is not None and payload["ok"]:
+        self._record(job_id, pdf_hash, payload)
+      else:
+        pending.append(uri)
+    # robustify the pending URIs
+    for payload in self.robustifier.robustify(pending):
+      if payload["ok"] and self.mapping_cache is not None:
+        self.mapping_cache.put(payload["uri"], payload)
+      self._record(job_id, pdf_hash, payload)
+    if self.mappings.compact(pdf_hash) is not None and self.pdfs is not None:
+      self.pdfs.set_status(pdf_hash, mapping=PDFStore.MAPPING_STORED)
+
+  def _work(self) -> None:
+    while True:
+      job_id, pdf_hash = self._claim()
+      try:
+        self._run(job_id, pdf_hash)
+      except Exception as e:
+        logging.exception(f"job {job_id} failed")
+        self._finish(job_id, self.STATUS_FAILED, str(e))
+      else:
+        self._finish(job_id, self.STATUS_DONE)
@@ -0,0 +1,310 @@
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from .errors import ExtractionError
+from .extractor import Extractor
+from .util import Metrics
+
+try:
+  import resource
+except ImportError:  # not available on Windows
+  resource = None
+
+
+class _StageTimings(Metrics):
+  # metrics of a worker process, which keep the stage timings of the current job, for the parent to record
+
+  def __init__(self) -> None:
+    super().__init__()
+    self.stages: List[Tuple[str, float]] = []
+
+  def observe_stage(self, stage: str, seconds: float) -> None:
+    self.stages.append((stage, seconds))
+
+
+def _serve(conn: multiprocessing.connection.Connection, engine: str, memory_limit: Optional[int], max_jobs: int) -> None:
+  # main loop of a worker process: run up to max_jobs jobs sent over conn, and exit
+  if memory_limit and resource is not None:
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+  # worker processes cannot have a pool of their own, so they extract serially
+  metrics = _StageTimings()
+  extractor = Extractor(workers=1, engine=engine, metrics=metrics)
+  conn.send(("ready", None))
+  for _ in range(max_jobs):
+    try:
+      op, fp = conn.recv()
+    except EOFError:
+      return
+    try:
+      if op == "count_pages":
+        result = extractor.count_pages(fp)
+      elif op == "extract_all_urls":
+        result = extractor.extract_all_urls(fp)
+      else:
+        done = []
+        for url in extractor.iter_urls(fp, on_done=done.append):
+          conn.send(("item", url))
+        result = done[0]
+      reply = ("result", result)
+    except MemoryError:
+      # the heap may be left in a bad state, so the worker is not reused
+      conn.send(("fatal", "exceeded the memory limit"))
+      return
+    except Exception as e:
+      reply = ("error", repr(e))
+    conn.send(("stages", metrics.stages))
+    metrics.stages = []
+    conn.send(reply)
+
+
+class _Worker:
+  # a worker process, and the parent's end of the pipe to it
+
+  def __init__(self, process: multiprocessing.Process, conn: multiprocessing.connection.Connection) -> None:
+    self.process = process
+    self.conn = conn
+    self.jobs = 0
+    self.ready = False
+
+
+class ExtractionPool:
+  """
+  The ``ExtractionPool`` class extracts URLs from PDFs in a supervised pool of worker processes, so that a malformed or
+  pathological PDF cannot hang, bloat, or crash the service itself.
+
+  It has the same interface as the ``Extractor`` that it runs (``version``, ``count_pages``, ``extract_all_urls`` and
+  ``iter_urls``). Each worker process runs one job at a time, and extracts serially (so large PDFs are not split into
+  page ranges). Workers are started up front, and each job is subject to the following limits.
+
+  * ``timeout``: Seconds that a job may run for. Workers that exceed it are killed (PDFium cannot be interrupted).
+  * ``memory_limit``: Bytes of address space that a worker may use (``RLIMIT_AS``, where supported).
+    Allocations beyond it fail, and the worker is replaced.
+  * ``max_jobs``: Number of jobs after which a worker is replaced, to bound the memory that leaks across jobs.
+
+  Jobs that hit a limit, or crash their worker, raise an ``ExtractionError``, and the worker is replaced right away,
+  so other jobs are unaffected. Jobs wait for a free worker if all workers are busy, for up to ``timeout`` seconds.
+  Timeouts and crashes may be caused by load rather than by the PDF, so their errors are ``transient``, as are those
+  of jobs that found no free worker in time, or whose worker did not start within ``START_TIMEOUT`` seconds (which
+  are not counted as failed extractions).
+
+  The time that each stage of extraction took in the worker (see ``Extractor``) is recorded in ``metrics``, as if
+  it was extracted in this process.
+
+  :param workers: Number of worker processes
+  :param timeout: Seconds that a job may run for
+  :param memory_limit: Bytes of address space that a worker may use (None for no limit)
+  :param max_jobs: Number of jobs that a worker runs before it is replaced
+  :param engine: Extraction engine of the ``Extractor`` in each worker
+  :param metrics: Metrics to record stage timings, failed jobs and replaced workers in (if any)
+
+  """
+
+  START_TIMEOUT = 30
+
+  def __init__(self, workers: int = 2, timeout: float = 60, memory_limit: Optional[int] = 1 << 30, max_jobs: int = 100,
+               engine: str = Extractor.ENGINE_PDFIUM, metrics: Optional[Metrics] = None) -> None:
+    self.timeout = timeout
+    self.memory_limit = memory_limit
+    self.max_jobs = max_jobs
+    self.engine = engine
+    self.metrics = metrics or Metrics()
+    # workers are started from a clean process (not forked from this one, whose threads may hold locks)
+    methods = multiprocessing.get_all_start_methods()
+    self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    self._version = Extractor(workers=1, engine=engine).version
+    self._idle: "queue.Queue[_Worker]" = queue.Queue()
+    self._workers: List[_Worker] = []
+    self._lock = threading.Lock()
+    self._closed = False
+    for _ in range(workers):
+      self._idle.put(self._spawn())
+
+  @property
+  def version(self) -> str:
+    """
+    Version tag of the extraction logic (see ``Extractor.version``).
+
+    :return: Version tag of the extractor
+
+    """
+    return self._version
+
+  def _spawn(self) -> _Worker:
+    parent_conn, child_conn = self._context.Pipe()
+    process = self._context.Process(target=_serve, args=(child_conn, self.engine, self.memory_limit, self.max_jobs),
+                                    name="pdflinks-extractor", daemon=True)
+    process.start()
+    child_conn.close()
+    worker = _Worker(process, parent_conn)
+    with self._lock:
+      self._workers.append(worker)
+    return worker
+
+  def _retire(self, worker: _Worker, reason: str) -> None:
+    # stop a worker (killing it, unless it exits by itself), and start another in its place
+    self.metrics.counter("pdflinks_extractor_recycled_total", "Number of extraction workers replaced, by reason",
+                         ["reason"]).inc(reason=reason)
+    worker.process.join(1 if reason == "max_jobs" else 0)
+    if worker.process.is_alive():
+      worker.process.kill()
+      worker.process.join()
+    worker.conn.close()
+    with self._lock:
+      self._workers.remove(worker)
+      if self._closed:
+        return
+    self._idle.put(self._spawn())
+
+  def _recv(self, worker: _Worker, timeout: float) -> Tuple[str, Any]:
+    # receive a message from a worker (or a "timeout" or "crash" message, if it does not send one in time)
+    if not worker.conn.poll(max(timeout, 0)):
+      return "timeout", f"no response within {timeout:g}s"
+    try:
+      return worker.conn.recv()
+    except EOFError:
+      worker.process.join(1)
+      return "crash", f"the extraction worker exited unexpectedly (exit code {worker.process.exitcode})"
+
+  def _run(self, op: str, fp: str) -> Iterator[Tuple[str, Any]]:
+    # run a job on a free worker, yielding the messages that it sends, until its result
+    try:
+      worker = self._idle.get(timeout=self.timeout)
+    except queue.Empty:
+      self.metrics.counter("pdflinks_extraction_failures_total", "Number of failed extractions, by reason",
+                           ["reason"]).inc(reason="busy")
+      raise ExtractionError(f"no extraction worker was free within {self.timeout}s", transient=True)
+    # why the worker is replaced afterwards (None if it is reused)
+    retire_reason = "abandoned"
+    try:
+      if not worker.ready:
+        kind, value = self._recv(worker, self.START_TIMEOUT)
+        if kind != "ready":
+          # the PDF was not sent yet, so this is a failure of the pool (not of the PDF)
+          retire_reason = "start"
+          logging.error(f"an extraction worker failed to start: {value}")
+          raise ExtractionError("no extraction worker is available", transient=True)
+        worker.ready = True
+      # workers may have a different working directory
+      worker.conn.send((op, os.path.abspath(fp)))
+      worker.jobs += 1
+      # only the time spent waiting for the worker counts towards the timeout (not the time spent by the consumer)
+      budget = self.timeout
+      while True:
+        started = time.monotonic()
+        kind, value = self._recv(worker, budget)
+        budget -= time.monotonic() - started
+        if kind == "stages":
+          for stage, seconds in value:
+            self.metrics.observe_stage(stage, seconds)
+          continue
+        if kind != "item":
+          break
+        yield kind, value
+      failure = "memory" if kind == "fatal" else kind
+      if kind in ("result", "error"):
+        retire_reason = "max_jobs" if worker.jobs >= self.max_jobs else None
+      else:
+        retire_reason = failure
+      if kind == "result":
+        yield kind, value
+        return
+      if kind == "timeout":
+        value = f"the extraction timed out after {self.timeout}s"
+      self.metrics.counter("pdflinks_extraction_failures_total", "Number of failed extractions, by reason",
+                           ["reason"]).inc(reason=failure)
+      logging.warning(f"extraction of {fp} failed: {value}")
+      raise ExtractionError(value, transient=kind in ("timeout", "crash"))
+    finally:
+      if retire_reason is None:
+        self._idle.put(worker)
+      else:
+        self._retire(worker, retire_reason)
+
+  def _call(self, op: str, fp: str) -> Any:
+    # run a job on a free worker, and return its result
+    with self.metrics.timer(f"isolated_{op}"):
+      for _, value in self._run(op, fp):
+        result = value
+    return result
+
+  def count_pages(self, fp: str) -> Optional[int]:
+    """
+    Count the pages in a PDF, in a worker process (see ``Extractor.count_pages``)
+
+    :param fp: Path to PDF
+    :return: Number of pages in PDF (or None if PDFium cannot read it)
+
+    """
+    return self._call("count_pages", fp)
+
+  def extract_all_urls(self, fp: str) -> List[str]:
+    """
+    Extract All URLs from PDF, in a worker process (see ``Extractor.extract_all_urls``)
+
+    :param fp: Path to PDF
+    :return: List of All URLs in PDF
+
+    """
+    return self._call("extract_all_urls", fp)
+
+  def iter_urls(self, fp: str, on_done: Optional[Callable[[List[str]], None]] = None) -> Iterator[str]:
+    """
+    Yield the URLs of a PDF as its pages are extracted, in a worker process (see ``Extractor.iter_urls``)
+
+    The URLs are read from the worker into a buffer by a separate thread, so the worker is free for other jobs as soon
+    as it is done, however slowly the URLs are consumed. If the generator is closed before the worker is done,
+    the worker is replaced (as it may still be extracting).
+
+    :param fp: Path to PDF
+    :param on_done: Function to call with the list of All URLs in PDF, once extraction is complete
+    :return: A generator of URLs in PDF
+
+    """
+    buffer: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+    closed = threading.Event()
+
+    def drain() -> None:
+      messages = self._run("iter_urls", fp)
+      try:
+        for message in messages:
+          if closed.is_set():
+            break
+          buffer.put(message)
+      except Exception as e:
+        buffer.put(("error", e))
+      finally:
+        messages.close()
+
+    threading.Thread(target=drain, name="pdflinks-extractor-drain", daemon=True).start()
+    try:
+      while True:
+        kind, value = buffer.get()
+        if kind == "item":
+          yield value
+        elif kind == "error":
+          raise value
+        else:
+          if on_done is not None:
+            on_done(value)
+          return
+    finally:
+      closed.set()
+
+  def close(self) -> None:
+    """
+    Stop all worker processes.
+
+    """
+    with self._lock:
+      self._closed = True
+      workers = list(self._workers)
+    for worker in workers:
+      if worker.process.is_alive():
+        worker.process.kill()
+        worker.process.join()
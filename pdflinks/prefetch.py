@@ -0,0 +1,191 @@
+import concurrent.futures
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from .errors import ExtractionError
+from .extractor import Extractor
+from .pool import ExtractionPool
+from .util import ExtractionCache, Metrics, PDFStore
+
+
+class _Progress:
+  # URLs found so far by an extraction that runs page by page, for requests that follow it
+
+  def __init__(self) -> None:
+    self.urls: List[str] = []
+    self.done = False
+    self.error: Optional[BaseException] = None
+    self._cond = threading.Condition()
+
+  def publish(self, url: str) -> None:
+    with self._cond:
+      self.urls.append(url)
+      self._cond.notify_all()
+
+  def finish(self, error: Optional[BaseException] = None) -> None:
+    with self._cond:
+      self.done = True
+      self.error = error
+      self._cond.notify_all()
+
+  def follow(self) -> Iterator[str]:
+    # yield each URL found so far, then each URL as it is found, until the extraction is done (or failed)
+    i = 0
+    while True:
+      with self._cond:
+        self._cond.wait_for(lambda: len(self.urls) > i or self.done)
+        urls, done = self.urls[i:], self.done
+      i += len(urls)
+      yield from urls
+      if done:
+        if self.error is not None:
+          raise self.error
+        return
+
+
+class Prefetcher:
+  """
+  The ``Prefetcher`` class extracts URLs from uploaded PDFs in the background, so that they are (usually) extracted by
+  the time their links page is requested.
+
+  Each PDF is extracted at most once at a time: submitting a PDF that is being extracted returns the extraction
+  in progress, and submitting a PDF whose URLs are cached returns them right away. Results are stored in the
+  ``ExtractionCache``, and the extraction status of each PDF (``running``, ``done`` or ``failed``) is recorded in the
+  ``PDFStore``, so it can be polled. Failed extractions are recorded with ``PDFStore.fail_extraction``, so PDFs whose
+  extraction failed transiently are extracted again when next submitted.
+
+  PDFs with at least ``stream_pages`` pages are extracted page by page (see ``Extractor.iter_urls``), and the URLs
+  found so far are published as they are found, so that their links page can be streamed while they are extracted,
+  instead of waiting for the whole PDF (see ``follow``).
+
+  Extractions run on their own pool of ``workers`` threads, since the ``Extractor`` pool runs page ranges of
+  individual extractions (and waiting on it from its own threads could deadlock).
+
+  :param extractor: The ``Extractor`` (or ``ExtractionPool``) used to extract URLs
+  :param cache: The ``ExtractionCache`` to store extracted URLs in
+  :param pdfs: The ``PDFStore`` of uploaded PDFs
+  :param workers: Number of PDFs to extract concurrently
+  :param metrics: Metrics to record the number of queued extractions in (if any)
+  :param stream_pages: Number of pages from which PDFs are extracted page by page (None to never do so)
+
+  """
+
+  def __init__(self, extractor: Union[Extractor, ExtractionPool], cache: ExtractionCache, pdfs: PDFStore, workers: int = 2,
+               metrics: Optional[Metrics] = None, stream_pages: Optional[int] = None) -> None:
+    self.extractor = extractor
+    self.cache = cache
+    self.pdfs = pdfs
+    self.metrics = metrics or Metrics()
+    self.stream_pages = stream_pages
+    self._pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="prefetch")
+    # extractions in progress (and the progress of those that run page by page), keyed by pdf_hash
+    self._futures: Dict[str, concurrent.futures.Future] = {}
+    self._progress: Dict[str, _Progress] = {}
+    self._lock = threading.Lock()
+    self._gauge = self.metrics.gauge("pdflinks_prefetch_in_progress", "Number of PDFs queued or being extracted in the background")
+
+  def submit(self, pdf_hash: str) -> concurrent.futures.Future:
+    """
+    Start extracting URLs from a PDF in the background (unless it is being extracted already), and return a future of
+    the extracted URLs.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Future of the extracted URLs
+
+    """
+    with self._lock:
+      future, _ = self._submit(pdf_hash)
+    return future
+
+  def follow(self, pdf_hash: str) -> Optional[Iterator[str]]:
+    """
+    Start extracting URLs from a PDF page by page (unless it is being extracted already), and return a generator of
+    the URLs found so far, and then of each URL as it is found (see ``Extractor.iter_urls``), until the extraction is
+    done. Like ``Extractor.iter_urls``, a few URLs that the final list of URLs does not have may be yielded.
+
+    If the PDF is being extracted as a whole instead (e.g., since it has fewer than ``stream_pages`` pages), there is
+    no progress to follow, so it returns None.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: A generator of URLs in the PDF (or None)
+
+    """
+    with self._lock:
+      future, progress = self._submit(pdf_hash, stream=True)
+    if progress is not None:
+      return progress.follow()
+    if future.done() and future.exception() is None:
+      return iter(future.result())
+    return None
+
+  def _submit(self, pdf_hash: str, stream: bool = False) -> Tuple[concurrent.futures.Future, Optional[_Progress]]:
+    # start an extraction (unless one is in progress), and return its future and progress (called with the lock held)
+    future = self._futures.get(pdf_hash)
+    if future is not None:
+      return future, self._progress.get(pdf_hash)
+    urls = self.cache.get(pdf_hash)
+    if urls is not None:
+      self.pdfs.set_status(pdf_hash, extraction=PDFStore.EXTRACTION_DONE)
+      future = concurrent.futures.Future()
+      future.set_result(urls)
+      return future, None
+    if not stream and self.stream_pages is not None:
+      pdf_meta = self.pdfs.get(pdf_hash)
+      stream = pdf_meta is not None and (pdf_meta['pages'] or 0) >= self.stream_pages
+    progress = self._progress[pdf_hash] = _Progress() if stream else None
+    self.pdfs.set_status(pdf_hash, extraction=PDFStore.EXTRACTION_RUNNING)
+    future = self._futures[pdf_hash] = self._pool.submit(self._extract, pdf_hash, progress)
+    self._gauge.inc()
+    return future, progress
+
+  def get(self, pdf_hash: str) -> Optional[concurrent.futures.Future]:
+    """
+    Return the future of an extraction in progress, or None if the PDF is not being extracted.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Future of the extracted URLs (or None)
+
+    """
+    with self._lock:
+      return self._futures.get(pdf_hash)
+
+  def _extract(self, pdf_hash: str, progress: Optional[_Progress] = None) -> List[str]:
+    try:
+      if progress is None:
+        urls = self.extractor.extract_all_urls(self.pdfs.path(pdf_hash))
+      else:
+        done = []
+        for url in self.extractor.iter_urls(self.pdfs.path(pdf_hash), on_done=done.append):
+          progress.publish(url)
+        urls = done[0]
+      self.cache.put(pdf_hash, urls)
+      self.pdfs.set_status(pdf_hash, extraction=PDFStore.EXTRACTION_DONE)
+      if progress is not None:
+        progress.finish()
+      return urls
+    except ExtractionError as e:
+      # already logged by the ExtractionPool
+      self.pdfs.fail_extraction(pdf_hash, e.reason, e.transient)
+      if progress is not None:
+        progress.finish(e)
+      raise
+    except Exception as e:
+      logging.exception(f"extraction of {pdf_hash} failed")
+      self.pdfs.fail_extraction(pdf_hash, repr(e))
+      if progress is not None:
+        progress.finish(e)
+      raise
+    finally:
+      # the result is cached by now, so later requests do not need the future
+      with self._lock:
+        self._futures.pop(pdf_hash, None)
+        self._progress.pop(pdf_hash, None)
+      self._gauge.dec()
+
+  def close(self) -> None:
+    """
+    Stop accepting extractions (the extractions in progress still run to completion).
+
+    """
+    self._pool.shutdown(wait=False)
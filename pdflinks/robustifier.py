@@ -0,0 +1,208 @@
+import asyncio
+import collections
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import aiohttp
+
+from .util import APIUtil
+
+
+class _Flight:
+  # a call in-flight, and the number of callers waiting for it
+
+  def __init__(self, task: asyncio.Future) -> None:
+    self.task = task
+    self.waiters = 0
+
+
+class Robustifier:
+  """
+  The ``Robustifier`` class calls the Robust PDFLinks service to robustify batches of URIs.
+  It runs the calls on an `asyncio <https://docs.python.org/3/library/asyncio.html>`_ event loop in a background
+  thread (using `aiohttp <https://pypi.org/project/aiohttp/>`_), so that hundreds of calls can be in-flight at once
+  without holding an OS thread each.
+
+  At most ``max_concurrency`` calls are in-flight across all batches, and at most ``max_concurrency_per_request``
+  calls are in-flight for any one batch. Calls wait for a free slot in FIFO order, and since each batch only has a few
+  calls waiting at any time, concurrent batches take turns instead of a large batch starving the others.
+
+  Calls are coalesced: a URI that is already being robustified (e.g., for another batch) is not called again, but waits
+  for the call in-flight, and gets its result. Duplicate URIs within a batch are only robustified (and yielded) once.
+
+  :param util: The ``APIUtil`` used to parse responses from the Robust PDFLinks service
+  :param max_concurrency: Maximum number of in-flight calls (across all batches)
+  :param max_concurrency_per_request: Maximum number of in-flight calls per batch
+
+  """
+
+  def __init__(self, util: APIUtil, max_concurrency: int = 100, max_concurrency_per_request: int = 10) -> None:
+    self.util = util
+    self.max_concurrency = max_concurrency
+    self.max_concurrency_per_request = max_concurrency_per_request
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
+    self._lock = threading.Lock()
+    # calls in-flight (only accessed from the event loop), keyed by URI
+    self._flights: Dict[str, _Flight] = {}
+
+  def get_loop(self) -> asyncio.AbstractEventLoop:
+    """
+    Return the event loop which runs the calls (started in a background thread on first use).
+
+    :return: The event loop
+
+    """
+    with self._lock:
+      if self._loop is None:
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="robustifier", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+        self._loop = loop
+      return self._loop
+
+  async def _setup(self) -> None:
+    # these must be created within the event loop
+    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+    connect_timeout, read_timeout = self.util.timeout
+    self._session = aiohttp.ClientSession(
+      connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+      timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+      headers=self.util.ROBUST_LINKS_HEADERS,
+    )
+
+  def close(self) -> None:
+    """
+    Close the HTTP session, and stop the event loop (if started).
+
+    """
+    with self._lock:
+      if self._loop is None:
+        return
+      asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+      self._loop.call_soon_threadsafe(self._loop.stop)
+      self._loop = None
+
+  def robustify(self, uris: Iterable[str]) -> Iterator[dict]:
+    """
+    Robustify a batch of URIs, and yield the status of each robustification as it completes.
+    See ``APIUtil.call_robust_links_svc`` for the fields of each status.
+
+    Closing the returned generator cancels the calls that are still pending.
+
+    :param uris: URIs to robustify
+    :return: A generator of robustification statuses
+
+    """
+    uris = list(dict.fromkeys(uris))
+    results = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(self._run_batch(uris, results.put), self.get_loop())
+    try:
+      while True:
+        payload = results.get()
+        if payload is None:
+          break
+        yield payload
+    finally:
+      future.cancel()
+
+  async def _run_batch(self, uris: List[str], emit: Callable[[Optional[dict]], None]) -> None:
+    pending = collections.deque(uris)
+    queued = self.util.metrics.gauge("pdflinks_robustify_queued", "Number of URIs queued in batches, but not started")
+    queued.inc(len(pending))
+
+    async def worker():
+      while pending:
+        uri = pending.popleft()
+        queued.dec()
+        emit(await self.robustify_uri(uri))
+
+    try:
+      await asyncio.gather(*(worker() for _ in range(min(len(uris), self.max_concurrency_per_request))))
+    finally:
+      # URIs of a cancelled batch are not started
+      queued.dec(len(pending))
+      # signal the end of the batch
+      emit(None)
+
+  async def robustify_uri(self, uri: str) -> dict:
+    """
+    Robustify a URI, sharing the call in-flight for the same URI (if any) instead of calling the service again.
+
+    The shared call is only cancelled once every caller waiting for it is cancelled.
+
+    :param uri: the URL to robustify
+    :return: the status of robustification
+
+    """
+    flight = self._flights.get(uri)
+    if flight is None:
+      flight = self._flights[uri] = _Flight(asyncio.ensure_future(self.call_robust_links_svc(uri)))
+      flight.task.add_done_callback(lambda _: self._land(uri, flight))
+    else:
+      self.util.metrics.counter("pdflinks_robustify_coalesced_total", "Number of calls that shared a call in-flight").inc()
+    flight.waiters += 1
+    try:
+      return await asyncio.shield(flight.task)
+    finally:
+      flight.waiters -= 1
+      if flight.waiters == 0 and not flight.task.done():
+        # later callers must not wait for the cancelled call
+        self._land(uri, flight)
+        flight.task.cancel()
+
+  def _land(self, uri: str, flight: "_Flight") -> None:
+    # forget a call that is no longer in-flight (unless another call for the URI has taken its place)
+    if self._flights.get(uri) is flight:
+      del self._flights[uri]
+
+  async def call_robust_links_svc(self, uri: str) -> dict:
+    """
+    Call the Robust PDFLinks service on a URI (once a slot is free), and return the status of its robustification.
+
+    Like ``APIUtil.call_robust_links_svc``, calls are paced by the rate limiter of ``util``, and calls that fail with a
+    transient error are retried with backoff. The slot is given up while waiting to retry.
+
+    :param uri: the URL to robustify
+    :return: the status of robustification
+
+    """
+    waiting = self.util.metrics.gauge("pdflinks_robustify_waiting", "Number of calls waiting for a free slot")
+    in_flight = self.util.metrics.gauge("pdflinks_robustify_in_flight", "Number of calls in-flight")
+    attempt = 0
+    while True:
+      attempt += 1
+      waiting.inc()
+      try:
+        await self._semaphore.acquire()
+      finally:
+        waiting.dec()
+      in_flight.inc()
+      try:
+        # wait for the rate limiter
+        await asyncio.sleep(self.util.rate_limiter.reserve())
+        self.util.app.logger.info(f"Submitted request to RL service for URL: {uri} (attempt {attempt})")
+        started = time.perf_counter()
+        try:
+          async with self._session.get(self.util.robust_links_api_url, params=self.util.make_robust_links_params(uri)) as res:
+            body = await res.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+          # if the request failed or timed out
+          payload = self.util.make_robust_links_error(uri, f"RL service could not be reached for URI: {uri}. Reason: {e!r}")
+          retry_after = None
+          self.util.observe_robust_links_call(time.perf_counter() - started, "unreachable")
+        else:
+          payload = self.util.parse_robust_links_res(uri, res.status, body)
+          if not self.util.backoff.is_transient(res.status):
+            self.util.observe_robust_links_call(time.perf_counter() - started, "ok" if payload["ok"] else "error")
+            self.util.rate_limiter.relax()
+            return self.util.complete_robust_links_call(payload, attempt)
+          self.util.observe_robust_links_call(time.perf_counter() - started, "transient")
+          retry_after = self.util.handle_transient_status(res.status, res.headers.get("Retry-After"))
+      finally:
+        in_flight.dec()
+        self._semaphore.release()
+      if not self.util.backoff.can_retry(attempt):
+        return self.util.complete_robust_links_call(payload, attempt)
+      await asyncio.sleep(self.util.backoff.delay(attempt, retry_after))
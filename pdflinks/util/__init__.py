@@ -1,2 +1,7 @@
 from .api_util import APIUtil
-from .url_util import URLUtil
\ No newline at end of file
+from .cache_util import ExtractionCache, LRUCache, TTLCache
+from .mapping_util import MappingStore
+from .metrics_util import Metrics
+from .rate_util import Backoff, TokenBucket
+from .storage_util import LocalBackend, MemoryBackend, PDFStore, ShardedTree, StorageBackend
+from .url_util import URLUtil
@@ -1,9 +1,19 @@
 import datetime
 import json
 import os
+import time
+from typing import Mapping, Optional, Tuple
 
 import flask
 import requests
+import requests.adapters
+import werkzeug.http
+
+from .cache_util import TTLCache
+from .mapping_util import MappingStore
+from .metrics_util import Metrics
+from .rate_util import Backoff, TokenBucket
+from .storage_util import LocalBackend, MemoryBackend, PDFStore
 
 
 class APIUtil:
@@ -12,6 +22,30 @@ class APIUtil:
   It consist of default HTTP error response strings, and functions that generate error responses, cast payloads to JSON,
   extract query parameters, call the Robust Links API, handle LDP handshakes, and generate LDN payloads.
 
+  All outbound HTTP calls share a single connection-pooled ``requests.Session``, so that connections are kept alive
+  and reused across calls (and threads). The pool size and timeouts are read from the app config.
+
+  * ``HTTP_POOL_SIZE``: Maximum number of connections kept alive per host (default=10)
+  * ``HTTP_CONNECT_TIMEOUT``: Seconds to wait for a connection to be established (default=5)
+  * ``HTTP_READ_TIMEOUT``: Seconds to wait for the server to send a response (default=60)
+  * ``ROBUST_LINKS_API_URL``: URL of the Robust Links API (default=http://robustlinks.mementoweb.org/api/)
+  * ``ROBUST_LINKS_RATE``: Maximum number of calls per second to the Robust Links API (default=20)
+  * ``ROBUST_LINKS_BURST``: Maximum number of calls to the Robust Links API in a burst (default=20)
+  * ``ROBUST_LINKS_MAX_ATTEMPTS``: Maximum number of attempts per URI, including retries (default=4)
+  * ``ROBUST_LINKS_BACKOFF``: Seconds to wait before the first retry, before jitter (default=0.5)
+  * ``MAPPING_COMPACT_EVERY``: Number of mappings generated for a PDF before they are compacted (default=50)
+  * ``MAPPING_SHARD_DEPTH``: Number of levels of hash-prefix directories that mappings are sharded into (default=2)
+  * ``STORAGE_BACKEND``: Backend that uploaded PDFs are stored in, either ``local`` or ``memory`` (default=local)
+  * ``STORAGE_SHARD_DEPTH``: Number of levels of hash-prefix directories that PDFs are sharded into (default=2)
+  * ``STORAGE_INDEX``: Path of the SQLite index of PDF metadata (default=``<UPLOADS_FOLDER>/index.db``)
+  * ``LDP_INBOX_CACHE_SIZE``: Maximum number of LD servers whose LDP inbox is cached (default=1024)
+  * ``LDP_INBOX_CACHE_TTL``: Seconds an LDP inbox is cached, unless the LD server says otherwise (default=3600)
+  * ``LDP_INBOX_NEGATIVE_TTL``: Maximum seconds a URL that is not an LD server is remembered as such (default=300)
+
+  Uploaded PDFs are only stored if ``UPLOADS_FOLDER`` is set (e.g., the CLI reads PDFs from disk, and sets none).
+
+  :param app: The Flask app being served
+
   """
 
   ERR_TITLE = "Error!"
@@ -19,15 +53,82 @@ class APIUtil:
   ERR_PDF_NOT_FOUND = "The requested PDF file was not found"
   ERR_PDF_META_NOT_FOUND = "The metadata for the requested PDF file was not found. Please try uploading the PDF again to generate metadata."
   ERR_MAPPING_NOT_FOUND = "This PDF does not have any saved URI-R > URI-M mappings"
+  ERR_JOB_NOT_FOUND = "The requested job was not found"
+  ERR_EXTRACTION_FAILED = "Links could not be extracted from the requested PDF file"
   ERR_ONLY_PDF_ALLOWED = "You are only allowed to upload PDF files"
   ERR_MALFORMED_LDN = "The LDN is malformed"
   ERR_MISSING_PARAM_FILE = "Missing required parameter 'file'"
   ERR_MISSING_PARAM_LD_SERVER_URL = "Missing required parameter 'ld_server_url'"
+  ERR_MISSING_PARAM_PDF_HASH = "Missing required parameter 'pdf_hash'"
+  ERR_MISSING_PARAM_URIS = "Missing required parameter 'uris'"
+  ERR_MISSING_PARAM_NOTIFICATIONS = "Missing required parameter 'notifications' (a list of objects with 'pdf_hash' and 'ld_server_url')"
   ERR_MISSING_PARAM_PDF_URL = "Missing required query parameter 'pdf_url'"
   ERR_MISSING_PARAM_MAPPING_URL = "Missing required query parameter 'mapping_url'"
 
+  ROBUST_LINKS_HEADERS = {"Accept": "application/json"}
+
   def __init__(self, app: flask.Flask):
     self.app = app
+    # shared connection pool for outbound HTTP calls
+    pool_size = app.config.get('HTTP_POOL_SIZE', 10)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    self.session = requests.Session()
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+    self.timeout = (app.config.get('HTTP_CONNECT_TIMEOUT', 5), app.config.get('HTTP_READ_TIMEOUT', 60))
+    self.robust_links_api_url = app.config.get('ROBUST_LINKS_API_URL', "http://robustlinks.mementoweb.org/api/")
+    # client-side rate limiting and retries for the Robust Links API
+    self.rate_limiter = TokenBucket(app.config.get('ROBUST_LINKS_RATE', 20), app.config.get('ROBUST_LINKS_BURST', 20))
+    self.backoff = Backoff(app.config.get('ROBUST_LINKS_MAX_ATTEMPTS', 4), app.config.get('ROBUST_LINKS_BACKOFF', 0.5))
+    # persistent URI-R -> URI-M mappings of each PDF
+    self.mappings = MappingStore(app.config['MAPPING_FOLDER'], app.config.get('MAPPING_COMPACT_EVERY', 50),
+                                 app.config.get('MAPPING_SHARD_DEPTH', 2))
+    # uploaded PDFs, and an index of their metadata
+    self.pdfs = self.make_pdf_store(app.config) if 'UPLOADS_FOLDER' in app.config else None
+    # metrics of the service (served at /metrics)
+    self.metrics = Metrics()
+    # LDP inbox (or why there is none) of each LD server
+    self.ldp_inboxes = TTLCache(app.config.get('LDP_INBOX_CACHE_SIZE', 1024), app.config.get('LDP_INBOX_CACHE_TTL', 3600))
+    self.ldp_inbox_negative_ttl = app.config.get('LDP_INBOX_NEGATIVE_TTL', 300)
+
+  @staticmethod
+  def make_pdf_store(config: flask.Config) -> PDFStore:
+    """
+    Create the ``PDFStore`` of uploaded PDFs, with the backend chosen by ``STORAGE_BACKEND``.
+
+    :param config: Config of the Flask app
+    :return: The ``PDFStore``
+
+    """
+    uploads_folder = config['UPLOADS_FOLDER']
+    backend_name = config.get('STORAGE_BACKEND', 'local')
+    if backend_name == 'local':
+      backend = LocalBackend(uploads_folder, config.get('STORAGE_SHARD_DEPTH', 2))
+      index_path = config.get('STORAGE_INDEX', os.path.join(uploads_folder, "index.db"))
+    elif backend_name == 'memory':
+      # uploads are still staged in the uploads folder
+      os.makedirs(uploads_folder, exist_ok=True)
+      backend = MemoryBackend()
+      index_path = config.get('STORAGE_INDEX', ":memory:")
+    else:
+      raise ValueError(f"unknown storage backend: {backend_name}")
+    return PDFStore(backend, index_path, config.get('EXTRACTION_MAX_FAILURES', 3))
+
+  @staticmethod
+  def make_not_modified_res(etag: str):
+    """
+    Generate a ``304 Not Modified`` response, if the request already has the representation with the given ETag
+    (i.e., if its ``If-None-Match`` header matches the ETag). Otherwise, return None.
+
+    :param etag: Strong ETag of the current representation
+    :return: A ``304 Not Modified`` response (or None)
+
+    """
+    if not flask.request.if_none_match.contains(etag):
+      return None
+    res = flask.Response(status=304)
+    res.set_etag(etag)
+    return res
 
   @staticmethod
   def make_error_res(status: int, message: str):
@@ -70,22 +171,122 @@ class APIUtil:
     * ``uri``: The URL which was sent to the Robust PDFLinks service
     * ``error``: A friendly description of the error
 
+    Both responses also have an ``attempts`` field, with the number of calls made to the Robust PDFLinks service.
+    Calls are paced by ``rate_limiter``, and calls that fail with a transient error (e.g., a timeout, or an HTTP 429
+    or 503 response) are retried with a jittered exponential backoff, as decided by ``backoff``.
+
+    :param uri: the URL to robustify
+    :return: the status of robustification
+
+    """
+
+    attempt = 0
+    while True:
+      attempt += 1
+      # wait for the rate limiter
+      time.sleep(self.rate_limiter.reserve())
+      # log the function call
+      self.app.logger.info(f"Submitted request to RL service for URL: {uri} (attempt {attempt})")
+      # send the request
+      started = time.perf_counter()
+      try:
+        res = self.session.get(self.robust_links_api_url, params=self.make_robust_links_params(uri),
+                               headers=self.ROBUST_LINKS_HEADERS, timeout=self.timeout)
+      except requests.RequestException as e:
+        # if the request failed or timed out
+        payload = self.make_robust_links_error(uri, f"RL service could not be reached for URI: {uri}. Reason: {e}")
+        retry_after = None
+        self.observe_robust_links_call(time.perf_counter() - started, "unreachable")
+      else:
+        payload = self.parse_robust_links_res(uri, res.status_code, res.text)
+        if not self.backoff.is_transient(res.status_code):
+          self.observe_robust_links_call(time.perf_counter() - started, "ok" if payload["ok"] else "error")
+          self.rate_limiter.relax()
+          return self.complete_robust_links_call(payload, attempt)
+        self.observe_robust_links_call(time.perf_counter() - started, "transient")
+        retry_after = self.handle_transient_status(res.status_code, res.headers.get("Retry-After"))
+      if not self.backoff.can_retry(attempt):
+        return self.complete_robust_links_call(payload, attempt)
+      time.sleep(self.backoff.delay(attempt, retry_after))
+
+  def observe_robust_links_call(self, seconds: float, outcome: str) -> None:
+    """
+    Record the latency and outcome of a call to the Robust PDFLinks service, in ``pdflinks_upstream_seconds``.
+
+    :param seconds: Time taken by the call
+    :param outcome: Outcome of the call (``ok``, ``error``, ``transient`` or ``unreachable``)
+
+    """
+    self.metrics.histogram("pdflinks_upstream_seconds", "Latency of calls to the Robust Links service, by outcome",
+                           ["outcome"]).observe(seconds, outcome=outcome)
+
+  def complete_robust_links_call(self, payload: dict, attempts: int) -> dict:
+    """
+    Count the robustification of a URI (as robustified or failed) after its last attempt, and return its status.
+
+    :param payload: Status of robustification, as parsed from the last response
+    :param attempts: Number of calls made to the Robust PDFLinks service
+    :return: the status of robustification, with its number of ``attempts``
+
+    """
+    self.metrics.counter("pdflinks_robustified_total", "Number of URIs robustified, by outcome", ["outcome"]) \
+      .inc(outcome="ok" if payload["ok"] else "failed")
+    self.metrics.histogram("pdflinks_upstream_attempts", "Number of calls to the Robust Links service per URI",
+                           buckets=range(1, self.backoff.max_attempts + 1)).observe(attempts)
+    return {**payload, "attempts": attempts}
+
+  def handle_transient_status(self, status_code: int, retry_after: str = None):
+    """
+    Throttle calls to the Robust PDFLinks service if it responded with an overload status (e.g., HTTP 429 or 503).
+
+    :param status_code: HTTP status code of the response
+    :param retry_after: Value of the ``Retry-After`` header of the response (if any)
+    :return: Number of seconds the Robust PDFLinks service asked clients to wait (or None)
+
+    """
+    retry_after = self.backoff.parse_retry_after(retry_after)
+    if status_code in self.backoff.THROTTLE_STATUS_CODES:
+      self.app.logger.warning(f"RL service returned HTTP {status_code}, throttling requests")
+      self.rate_limiter.throttle(retry_after)
+    return retry_after
+
+  @staticmethod
+  def make_robust_links_params(uri: str) -> dict:
+    """
+    Generate the query parameters of a Robust PDFLinks service call to robustify a URI.
+
     :param uri: the URL to robustify
+    :return: the query parameters
+
+    """
+    return {"url": uri, "anchor_text": uri}
+
+  def make_robust_links_error(self, uri: str, errmsg: str) -> dict:
+    """
+    Generate (and log) an error response for the robustification of a URI.
+
+    :param uri: the URL that was robustified
+    :param errmsg: A friendly description of the error
     :return: the status of robustification
 
     """
+    self.app.logger.warning(errmsg)
+    return {"ok": False, "uri": uri, "error": errmsg}
 
-    # log the function call
-    self.app.logger.info(f"Submitted request to RL service for URL: {uri}")
+  def parse_robust_links_res(self, uri: str, status_code: int, body: str) -> dict:
+    """
+    Parse a response from the Robust PDFLinks service, and return the status of the robustification of a URI.
+    See ``call_robust_links_svc`` for the fields of the returned status.
 
-    # send the request
-    params = {"url": uri, "anchor_text": uri}
-    headers = {"Accept": "application/json"}
-    res = requests.get(f"http://robustlinks.mementoweb.org/api/", params=params, headers=headers)
+    :param uri: the URL that was robustified
+    :param status_code: HTTP status code of the response
+    :param body: Body of the response
+    :return: the status of robustification
+
+    """
 
     def error_res(__errmsg: str):
-      self.app.logger.warning(__errmsg)
-      return {"ok": False, "uri": uri, "error": __errmsg}
+      return self.make_robust_links_error(uri, __errmsg)
 
     def success_res(__rl: any, __uri_r_key='original_url_as_href', __uri_m_key='memento_url_as_href'):
       self.app.logger.info(f"RL service robustified URL: {uri}")
@@ -96,30 +297,32 @@ class APIUtil:
 
     try:
       # try converting response to JSON
-      res_json: dict = res.json()
+      res_json: dict = json.loads(body)
     except json.JSONDecodeError:
       # if the response is not JSON
-      return error_res(f"RL service returned HTTP {res.status_code} with a non JSON response for URI: {uri}")
+      return error_res(f"RL service returned HTTP {status_code} with a non JSON response for URI: {uri}")
     else:
       # if the response is JSON
-      if 'robust_links_html' in res_json:
+      if not isinstance(res_json, dict):
+        # handle responses that are not JSON objects
+        return error_res(f"RL service returned HTTP {status_code} with an unknown JSON response for URI: {uri}")
+      elif 'robust_links_html' in res_json:
         # handle responses with 'robust_links_html'
         return success_res(res_json['robust_links_html'])
       elif 'friendly error' in res_json:
         # handle responses with 'friendly error'
         errmsg = res_json['friendly error'].strip()
-        return error_res(f"RL service returned HTTP {res.status_code} for URI: {uri}. Message: {errmsg}")
+        return error_res(f"RL service returned HTTP {status_code} for URI: {uri}. Message: {errmsg}")
       else:
         # handle responses that do not have the expected fields
-        return error_res(f"RL service returned HTTP {res.status_code} with an unknown JSON response for URI: {uri}")
+        return error_res(f"RL service returned HTTP {status_code} with an unknown JSON response for URI: {uri}")
 
   def generate_ldn_payload(self, pdf_hash: str, ld_server_url: str, ldp_inbox_url: str):
     """
     Generate an LDN payload for a PDF, given the ``pdf_hash``, ``ld_server_url``, and ``ldp_inbox_url``.
 
-    This function checks if the PDF exists and if not, returns a ``400 Bad Request`` HTTP response.
-    Next, it checks if the PDF metadata exists and if not, returns a ``400 Bad Request`` HTTP response.
-    Upon doing so, it gets the original PDF name from the metadata.
+    This function looks up the PDF in the index of uploaded PDFs and if not found, returns a ``404 Not Found`` HTTP
+    response. Upon doing so, it gets the original PDF name from the metadata.
 
     Next, it checks if URI-R -> URI-M mappings exists for the PDF and if not, returns a ``400 Bad Request`` HTTP response.
     Upon doing so, it gets the last modified time of the URI-R -> URI-M mappings.
@@ -131,36 +334,66 @@ class APIUtil:
     :return: An LDN as a JSON response
 
     """
-    # assert that PDF exists
-    pdf_path = os.path.join(self.app.config['UPLOADS_FOLDER'], pdf_hash + ".pdf")
-    if not os.path.exists(pdf_path):
-      return flask.abort(self.make_error_res(404, self.ERR_PDF_NOT_FOUND))
-    # assert that PDF metadata exists
-    pdf_meta_path = os.path.join(self.app.config['UPLOADS_FOLDER'], pdf_hash + ".pdf.txt")
-    if not os.path.exists(pdf_meta_path):
-      return flask.abort(self.make_error_res(404, self.ERR_PDF_META_NOT_FOUND))
-    # get the original pdf name from metadata
-    with open(pdf_meta_path) as f:
-      pdf_name = f.readline()
-    # assert that the URI-R -> URI-M mappings exist for the PDF
-    mapping_path = os.path.join(self.app.config['MAPPING_FOLDER'], pdf_hash + ".pdf.json")
-    if not os.path.exists(mapping_path):
-      return flask.abort(self.make_error_res(404, self.ERR_MAPPING_NOT_FOUND))
+    ldn_payload, error = self.make_ldn_payload(pdf_hash, ld_server_url, ldp_inbox_url, flask.request.host_url)
+    if ldn_payload is None:
+      return flask.abort(self.make_error_res(404, error))
+    # return LDN payload as JSON
+    return flask.jsonify(ldn_payload)
+
+  def make_ldn_payload(self, pdf_hash: str, ld_server_url: str, ldp_inbox_url: str,
+                       host_url: str) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Build the LDN payload for a PDF (see ``generate_ldn_payload``), without needing a request (e.g., in a thread).
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :param ld_server_url: URL of the Linked Data (LD) Server
+    :param ldp_inbox_url: URL of the LDP inbox of the given LD Server
+    :param host_url: URL of this service (e.g., ``flask.request.host_url``)
+    :return: The LDN payload (or None), and why it could not be built (or None)
+
+    """
+    # assert that PDF exists (and get the original pdf name from its metadata)
+    pdf_meta = self.pdfs.get(pdf_hash)
+    if pdf_meta is None:
+      return None, self.ERR_PDF_NOT_FOUND
+    pdf_name = pdf_meta['filename']
+    # assert that the URI-R -> URI-M mappings exist for the PDF (and compact them)
+    mapping_path = self.mappings.compact(pdf_hash)
+    if mapping_path is None:
+      return None, self.ERR_MAPPING_NOT_FOUND
     # last modified time of the URI-R -> URI-M mappings
     mapping_mtime = datetime.datetime.fromtimestamp(os.path.getmtime(mapping_path)).isoformat()
+    hostname = host_url.strip(' /')
     # generate LDN payload
-    ldn_args = {
-      'hostname': flask.request.host_url.strip(' /'),
-      'pdf_hash': pdf_hash,
-      'pdf_name': pdf_name,
-      'created_time': datetime.datetime.now().isoformat(),
-      'published_time': mapping_mtime,
-      'ld_server_url': ld_server_url,
-      'ldp_inbox_url': ldp_inbox_url
-    }
-    payload = flask.render_template("ldn.json", **ldn_args)
-    # return LDN payload as JSON
-    return flask.jsonify(flask.json.loads(payload))
+    return {
+      "@context": [
+        "https://www.w3.org/ns/activitystreams",
+        {
+          "sorg": "http://schema.org/",
+          "ldp": "http://www.w3.org/ns/ldp#",
+          "dcterms": "http://purl.org/dc/terms/",
+          "dcterms:created": {"@id": "dcterms:created", "@type": "xsd:dateTime"},
+        },
+      ],
+      "summary": f"Robust PDFLinks service Created Robust Links for {pdf_name}",
+      "published": mapping_mtime,
+      "dcterms:created": datetime.datetime.now().isoformat(),
+      "type": ["Offer"],
+      "actor": {"id": hostname, "type": "Service", "name": "Robust PDFLinks"},
+      "object": {
+        "type": "Document",
+        "mediaType": "application/json",
+        "name": f"Robust Links for {pdf_name}",
+        "url": f"{hostname}/mappings/{pdf_hash}",
+      },
+      "origin": {
+        "type": ["Article", "sorg:ScholarlyArticle"],
+        "mediaType": "application/pdf",
+        "name": pdf_name,
+        "url": f"{hostname}/pdfs/{pdf_hash}",
+      },
+      "target": {"id": ld_server_url, "ldp:inbox": ldp_inbox_url, "type": "Service"},
+    }, None
 
   def get_req_payload_as_json(self):
     """
@@ -217,16 +450,136 @@ class APIUtil:
 
     This function performs a HEAD request to the ``ld_server_url``, and parses the link headers of the response.
     If a LDP inbox URL is found in the link header, it returns it.
-    If not found, it returns a ``400 Bad Request`` HTTP response.
+    If not found, or if the LD server could not be reached, it returns a ``400 Bad Request`` HTTP response.
+
+    The result is cached for as long as the ``Cache-Control`` (or ``Expires``) header of the response allows, or for
+    ``LDP_INBOX_CACHE_TTL`` seconds if it has neither. URLs that are not LD servers are cached for at most
+    ``LDP_INBOX_NEGATIVE_TTL`` seconds. URLs that could not be reached are not cached.
 
     :param ld_server_url: URL of the Linked Data (LD) server
     :return: The URL of the LDP inbox of the LD server
 
+    """
+    ldp_inbox_url, error = self.lookup_ldp_inbox_url(ld_server_url)
+    if ldp_inbox_url is None:
+      return flask.abort(self.make_error_res(400, error))
+    return ldp_inbox_url
+
+  def lookup_ldp_inbox_url(self, ld_server_url: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Return the LDP inbox of an LD server from the cache, or else discover it (see ``resolve_ldp_inbox_url``).
+
+    :param ld_server_url: URL of the Linked Data (LD) server
+    :return: The URL of the LDP inbox (or None), and why it was not found (or None)
+
+    """
+    cached = self.ldp_inboxes.get(ld_server_url)
+    self.metrics.count_cache("ldp_inbox", cached is not None)
+    if cached is None:
+      cached = self.discover_ldp_inbox_url(ld_server_url)
+    return cached
+
+  def discover_ldp_inbox_url(self, ld_server_url: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Discover the LDP inbox of an LD server (see ``resolve_ldp_inbox_url``), and cache the result.
+
+    :param ld_server_url: URL of the Linked Data (LD) server
+    :return: The URL of the LDP inbox (or None), and why it was not found (or None)
+
     """
     # Send HTTP HEAD request to LD Server URL
-    res = requests.head(ld_server_url)
+    try:
+      res = self.session.head(ld_server_url, timeout=self.timeout)
+    except requests.RequestException:
+      return None, f"The URL {ld_server_url} could not be reached"
+    ttl = self.get_freshness_lifetime(res.headers, self.ldp_inboxes.ttl)
     # Get LDP Inbox URL from Link Header
     ldn_inbox_rel = "http://www.w3.org/ns/ldp#inbox"
-    if ldn_inbox_rel not in res.links:
-      return flask.abort(self.make_error_res(400, f"The URL {ld_server_url} is not an LD Server"))
-    return res.links[ldn_inbox_rel]['url']
+    if ldn_inbox_rel in res.links:
+      result = res.links[ldn_inbox_rel]['url'], None
+    else:
+      result = None, f"The URL {ld_server_url} is not an LD Server"
+      ttl = min(ttl, self.ldp_inbox_negative_ttl)
+    if ttl > 0:
+      self.ldp_inboxes.put(ld_server_url, result, ttl)
+    return result
+
+  @staticmethod
+  def get_freshness_lifetime(headers: Mapping[str, str], default: float) -> float:
+    """
+    Return the number of seconds that a response may be cached for, as given by its ``Cache-Control`` header
+    (``no-store``, ``no-cache``, ``s-maxage`` or ``max-age``), or else its ``Expires`` header.
+
+    :param headers: Headers of the response
+    :param default: Number of seconds to return if neither header limits caching
+    :return: Number of seconds the response may be cached for (0 if it must not be cached)
+
+    """
+    cache_control = werkzeug.http.parse_cache_control_header(headers.get('Cache-Control'))
+    if cache_control.no_store or cache_control.no_cache:
+      return 0
+    max_age = cache_control.get('s-maxage', cache_control.max_age)
+    if max_age is not None:
+      try:
+        return max(int(max_age), 0)
+      except ValueError:
+        return 0
+    expires = werkzeug.http.parse_date(headers.get('Expires'))
+    if expires is not None:
+      date = werkzeug.http.parse_date(headers.get('Date')) or datetime.datetime.now(datetime.timezone.utc)
+      return max((expires - date).total_seconds(), 0)
+    if 'Expires' in headers:
+      # an invalid Expires header means the response has expired already
+      return 0
+    return default
+
+  def send_ldn_payload(self, ldp_inbox_url: str, ldn_payload: dict):
+    """
+    Send an LDN payload to the given LDP inbox, and return the response from the LDP inbox.
+
+    If the LDP inbox could not be reached, it returns a ``502 Bad Gateway`` HTTP response.
+
+    :param ldp_inbox_url: URL of the LDP inbox of a LD Server
+    :param ldn_payload: The LDN payload to send
+    :return: The response from the LDP inbox
+
+    """
+    try:
+      return self.session.post(ldp_inbox_url, json=ldn_payload, headers={'Content-Type': 'application/ld+json'}, timeout=self.timeout)
+    except requests.RequestException:
+      return flask.abort(self.make_error_res(502, f"The LDP inbox {ldp_inbox_url} could not be reached"))
+
+  def deliver_ldn(self, pdf_hash: str, ld_server_url: str, ldp_inbox_url: Optional[str], host_url: str,
+                  error: Optional[str] = None) -> dict:
+    """
+    Send the LDN payload of a PDF to the LDP inbox of an LD server, and return the status of the delivery.
+    Unlike ``send_ldn_payload``, errors are returned in the status instead of aborting the request (e.g., so that many
+    deliveries can be made concurrently, outside of the request).
+
+    The status has the fields ``pdf_hash``, ``ld_server_url``, ``ldp_inbox_url``, ``ok`` (whether the LDP inbox
+    accepted the LDN), ``status`` (the HTTP status returned by the LDP inbox, if any), and ``error`` (if not ok).
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :param ld_server_url: URL of the Linked Data (LD) Server
+    :param ldp_inbox_url: URL of the LDP inbox of the given LD Server (or None if it was not found)
+    :param host_url: URL of this service (e.g., ``flask.request.host_url``)
+    :param error: Why the LDP inbox was not found (if it was not)
+    :return: The status of the delivery
+
+    """
+    status = {"pdf_hash": pdf_hash, "ld_server_url": ld_server_url, "ldp_inbox_url": ldp_inbox_url, "ok": False,
+              "status": None, "error": error}
+    if ldp_inbox_url is not None:
+      ldn_payload, status["error"] = self.make_ldn_payload(pdf_hash, ld_server_url, ldp_inbox_url, host_url)
+      if ldn_payload is not None:
+        try:
+          res = self.session.post(ldp_inbox_url, json=ldn_payload, headers={'Content-Type': 'application/ld+json'}, timeout=self.timeout)
+          status["status"] = res.status_code
+          status["ok"] = res.ok
+          if not res.ok:
+            status["error"] = f"The LDP inbox {ldp_inbox_url} returned HTTP {res.status_code}"
+        except requests.RequestException:
+          status["error"] = f"The LDP inbox {ldp_inbox_url} could not be reached"
+    self.metrics.counter("pdflinks_ldn_deliveries_total", "Number of LDNs delivered (or not), by outcome", ["outcome"]) \
+      .inc(outcome="ok" if status["ok"] else "error")
+    return status
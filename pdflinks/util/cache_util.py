@@ -0,0 +1,183 @@
+import collections
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Hashable, List, Optional
+
+
+class LRUCache:
+  """
+  The ``LRUCache`` class is a bounded, thread-safe, in-memory key-value store.
+  When it grows beyond ``max_size`` entries, the least recently used entries are evicted first.
+
+  :param max_size: Maximum number of entries kept in memory
+
+  """
+
+  def __init__(self, max_size: int = 128) -> None:
+    self.max_size = max_size
+    self._data = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    """
+    Return the value stored for ``key`` (or ``default``), and mark it as recently used.
+
+    :param key: Key to look up
+    :param default: Value to return if ``key`` is not cached
+    :return: The cached value (or ``default``)
+
+    """
+    with self._lock:
+      if key not in self._data:
+        return default
+      self._data.move_to_end(key)
+      return self._data[key]
+
+  def put(self, key: Hashable, value: Any) -> None:
+    """
+    Store ``value`` for ``key``, evicting the least recently used entries if the cache is full.
+
+    :param key: Key to store
+    :param value: Value to store
+
+    """
+    with self._lock:
+      self._data[key] = value
+      self._data.move_to_end(key)
+      while len(self._data) > self.max_size:
+        self._data.popitem(last=False)
+
+  def __contains__(self, key: Hashable) -> bool:
+    with self._lock:
+      return key in self._data
+
+  def __len__(self) -> int:
+    with self._lock:
+      return len(self._data)
+
+
+class TTLCache(LRUCache):
+  """
+  The ``TTLCache`` class is an ``LRUCache`` whose entries expire ``ttl`` seconds after they were stored.
+  Expired entries are treated as missing, and are dropped when they are looked up (or evicted).
+
+  :param max_size: Maximum number of entries kept in memory
+  :param ttl: Default number of seconds an entry remains valid
+
+  """
+
+  def __init__(self, max_size: int = 128, ttl: float = 3600) -> None:
+    super().__init__(max_size)
+    self.ttl = ttl
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    """
+    Return the value stored for ``key`` (or ``default`` if it is missing or expired), and mark it as recently used.
+
+    :param key: Key to look up
+    :param default: Value to return if ``key`` is not cached
+    :return: The cached value (or ``default``)
+
+    """
+    entry = super().get(key)
+    if entry is None:
+      return default
+    expires_at, value = entry
+    if expires_at <= time.monotonic():
+      with self._lock:
+        if self._data.get(key) is entry:
+          del self._data[key]
+      return default
+    return value
+
+  def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+    """
+    Store ``value`` for ``key``, to expire after ``ttl`` seconds (default: ``self.ttl``).
+
+    :param key: Key to store
+    :param value: Value to store
+    :param ttl: Number of seconds the entry remains valid
+
+    """
+    super().put(key, (time.monotonic() + (self.ttl if ttl is None else ttl), value))
+
+  def __contains__(self, key: Hashable) -> bool:
+    sentinel = object()
+    return self.get(key, sentinel) is not sentinel
+
+
+class ExtractionCache:
+  """
+  The ``ExtractionCache`` class stores the URLs extracted from PDFs, keyed by the PDF hash and the extractor version.
+
+  PDFs are content-addressed by their MD5 hash, so an extraction result remains valid for as long as the extraction
+  logic stays the same. The extractor version changes whenever the extraction logic or the blacklist changes, which
+  gives a new cache key, and thereby invalidates older entries automatically.
+
+  Recently used entries are served from a bounded in-memory LRU, and all entries are persisted as JSON files
+  (``<pdf_hash>.<version>.json``) in ``cache_dir``, so that they survive restarts.
+
+  :param cache_dir: Directory to persist extraction results in
+  :param version: Version tag of the extractor that produced the results
+  :param max_size: Maximum number of extraction results kept in memory
+
+  """
+
+  def __init__(self, cache_dir: str, version: str, max_size: int = 128) -> None:
+    self.cache_dir = cache_dir
+    self.version = version
+    self.memory = LRUCache(max_size)
+    os.makedirs(cache_dir, exist_ok=True)
+
+  def path(self, pdf_hash: str) -> str:
+    """
+    Return the path of the file which persists the extraction result of a PDF.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Path of the cache file
+
+    """
+    return os.path.join(self.cache_dir, f"{pdf_hash}.{self.version}.json")
+
+  def get(self, pdf_hash: str) -> Optional[List[str]]:
+    """
+    Return the cached extraction result of a PDF, or None if it was not cached.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: List of URLs extracted from the PDF (or None)
+
+    """
+    urls = self.memory.get(pdf_hash)
+    if urls is not None:
+      return urls
+    try:
+      with open(self.path(pdf_hash)) as f:
+        urls = json.load(f)
+    except (OSError, ValueError):
+      return None
+    self.memory.put(pdf_hash, urls)
+    return urls
+
+  def put(self, pdf_hash: str, urls: List[str]) -> None:
+    """
+    Cache the extraction result of a PDF, both in memory and on disk.
+
+    The file is written to a temporary path first, and then moved into place,
+    so that concurrent readers never observe a partially written result.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :param urls: List of URLs extracted from the PDF
+
+    """
+    self.memory.put(pdf_hash, urls)
+    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "w") as f:
+        json.dump(urls, f)
+      os.replace(tmp_path, self.path(pdf_hash))
+    except OSError:
+      os.remove(tmp_path)
+      raise
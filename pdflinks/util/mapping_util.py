@@ -0,0 +1,187 @@
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, Optional
+
+from .storage_util import ShardedTree
+
+
+class MappingStore:
+  """
+  The ``MappingStore`` class persists the ``URI-R -> URI-M`` mappings generated for each PDF.
+
+  Each mapping is appended to a log (``<pdf_hash>.pdf.jsonl``, in JSON Lines format) as soon as it is generated,
+  so that a crash loses at most the mapping being written. Every ``compact_every`` mappings (and whenever a compacted
+  view is requested), the log is merged into a snapshot (``<pdf_hash>.pdf.json``), which is written atomically, and
+  the log is cleared. The snapshot is a JSON object of mappings keyed by URI-R, which is served as-is.
+
+  Mappings are merged instead of overwritten, so robustifying a PDF again keeps the mappings generated earlier.
+  A failed robustification never replaces a successful one for the same URI-R.
+
+  Files are stored in a ``ShardedTree`` (e.g., ``<mapping_dir>/d4/1d/<pdf_hash>.pdf.json``), unless ``shard_depth``
+  is 0, in which case they are stored flat in ``mapping_dir``.
+
+  :param mapping_dir: Directory to store mappings in
+  :param compact_every: Number of appended mappings after which a log is compacted
+  :param shard_depth: Number of levels of sharding (0 disables sharding)
+
+  """
+
+  def __init__(self, mapping_dir: str, compact_every: int = 50, shard_depth: int = 2) -> None:
+    self.mapping_dir = mapping_dir
+    self.tree = ShardedTree(mapping_dir, shard_depth)
+    self.compact_every = compact_every
+    self._locks = collections.defaultdict(threading.RLock)
+    self._counts = collections.Counter()
+    # digest of the snapshot of each PDF, along with the (mtime, size) of the snapshot it was computed for
+    self._digests = {}
+    self._lock = threading.Lock()
+
+  def _get_lock(self, pdf_hash: str) -> threading.RLock:
+    with self._lock:
+      return self._locks[pdf_hash]
+
+  def snapshot_path(self, pdf_hash: str) -> str:
+    """
+    Return the path of the compacted snapshot of mappings of a PDF.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Path of the snapshot
+
+    """
+    return self.tree.path(pdf_hash + ".pdf.json")
+
+  def log_path(self, pdf_hash: str) -> str:
+    """
+    Return the path of the log of mappings of a PDF, which were appended since the last compaction.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Path of the log
+
+    """
+    return self.tree.path(pdf_hash + ".pdf.jsonl")
+
+  @staticmethod
+  def merge(mappings: Dict[str, dict], payload: dict) -> None:
+    """
+    Merge a mapping into a dict of mappings, unless it would replace a successful mapping with a failed one.
+
+    :param mappings: Dict of mappings, keyed by URI-R
+    :param payload: Mapping to merge (as streamed by ``/robustify``)
+
+    """
+    uri = payload["uri"]
+    if payload["ok"] or not mappings.get(uri, {}).get("ok", False):
+      mappings[uri] = payload
+
+  def append(self, pdf_hash: str, payload: dict) -> None:
+    """
+    Append a mapping to the log of a PDF, and compact the log every ``compact_every`` mappings.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :param payload: Mapping to append (as streamed by ``/robustify``)
+
+    """
+    with self._get_lock(pdf_hash):
+      with open(self.tree.make_path(pdf_hash + ".pdf.jsonl"), "a") as f:
+        f.write(json.dumps(payload) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+      self._counts[pdf_hash] += 1
+      if self._counts[pdf_hash] >= self.compact_every:
+        self.compact(pdf_hash)
+
+  def extend(self, pdf_hash: str, payloads: Iterable[dict]) -> None:
+    """
+    Append many mappings to the log of a PDF at once, and compact the log.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :param payloads: Mappings to append (as streamed by ``/robustify``)
+
+    """
+    with self._get_lock(pdf_hash):
+      with open(self.tree.make_path(pdf_hash + ".pdf.jsonl"), "a") as f:
+        f.writelines(json.dumps(payload) + "\n" for payload in payloads)
+        f.flush()
+        os.fsync(f.fileno())
+      self.compact(pdf_hash)
+
+  def load(self, pdf_hash: str) -> Optional[Dict[str, dict]]:
+    """
+    Return all mappings of a PDF (i.e., the snapshot merged with the log), or None if it has no mappings.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Dict of mappings, keyed by URI-R (or None)
+
+    """
+    with self._get_lock(pdf_hash):
+      mappings = None
+      if os.path.exists(self.snapshot_path(pdf_hash)):
+        with open(self.snapshot_path(pdf_hash)) as f:
+          mappings = json.load(f)
+      if os.path.exists(self.log_path(pdf_hash)):
+        mappings = mappings or {}
+        with open(self.log_path(pdf_hash)) as f:
+          for line in f:
+            try:
+              self.merge(mappings, json.loads(line))
+            except ValueError:
+              # skip lines that were partially written (e.g., during a crash)
+              continue
+      return mappings
+
+  def compact(self, pdf_hash: str) -> Optional[str]:
+    """
+    Merge the log of a PDF into its snapshot, and return the path of the snapshot (or None if it has no mappings).
+
+    The snapshot is written to a temporary path first, and then moved into place, so that readers never observe a
+    partially written snapshot. The log is only cleared afterwards, so a crash in-between loses no mappings.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Path of the snapshot (or None)
+
+    """
+    with self._get_lock(pdf_hash):
+      self._counts.pop(pdf_hash, None)
+      if not os.path.exists(self.log_path(pdf_hash)):
+        return self.snapshot_path(pdf_hash) if os.path.exists(self.snapshot_path(pdf_hash)) else None
+      mappings = self.load(pdf_hash)
+      fd, tmp_path = tempfile.mkstemp(dir=self.mapping_dir, suffix=".tmp")
+      try:
+        with os.fdopen(fd, "w") as f:
+          json.dump(mappings, f)
+        os.replace(tmp_path, self.tree.make_path(pdf_hash + ".pdf.json"))
+      except OSError:
+        os.remove(tmp_path)
+        raise
+      os.remove(self.log_path(pdf_hash))
+      return self.snapshot_path(pdf_hash)
+
+  def digest(self, pdf_hash: str) -> Optional[str]:
+    """
+    Return the MD5 digest of the compacted snapshot of mappings of a PDF (e.g., to use as an ETag).
+
+    Digests are recomputed only when the snapshot changes, as told by its modified time and size.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Digest of the snapshot (or None if it has no mappings)
+
+    """
+    with self._get_lock(pdf_hash):
+      path = self.compact(pdf_hash)
+      if path is None:
+        return None
+      stat = os.stat(path)
+      key = (stat.st_mtime_ns, stat.st_size)
+      cached = self._digests.get(pdf_hash)
+      if cached is not None and cached[0] == key:
+        return cached[1]
+      md5 = hashlib.md5()
+      with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+          md5.update(chunk)
+      self._digests[pdf_hash] = (key, md5.hexdigest())
+      return md5.hexdigest()
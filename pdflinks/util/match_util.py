@@ -0,0 +1,238 @@
+import collections
+import ipaddress
+import urllib.parse
+from typing import FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+
+class SubstringIndex:
+  """
+  The ``SubstringIndex`` class is an Aho-Corasick automaton over a sequence of strings (i.e., its *keys*).
+  It is used to tell which keys occur within which strings, without comparing every pair of strings.
+
+  Keys are identified by their position in ``keys``.
+  Building the index takes time linear to the total length of the keys,
+  and each query takes time linear to the length of the queried string(s).
+
+  :param keys: Strings to index
+
+  """
+
+  def __init__(self, keys: Sequence[str]) -> None:
+    # trie of keys (goto function), failure links, and smallest key index ending at each node
+    self.goto = [{}]
+    self.fail = [0]
+    self.first = [None]
+    self.nodes = []
+    for i, key in enumerate(keys):
+      node = 0
+      for ch in key:
+        child = self.goto[node].get(ch)
+        if child is None:
+          child = len(self.goto)
+          self.goto[node][ch] = child
+          self.goto.append({})
+          self.fail.append(0)
+          self.first.append(None)
+        node = child
+      if self.first[node] is None:
+        self.first[node] = i
+      self.nodes.append(node)
+    # nearest node along the failure links that terminates a key (dictionary links)
+    self.out = [None] * len(self.goto)
+    # smallest key index ending at each node, or at any node along its failure links
+    self.first_within_node = list(self.first)
+    # compute failure links in breadth-first order, so that the failure link of a node is always resolved first
+    queue = collections.deque(self.goto[0].values())
+    while queue:
+      node = queue.popleft()
+      fail = self.fail[node]
+      self.out[node] = fail if self.first[fail] is not None else self.out[fail]
+      self.first_within_node[node] = self._min(self.first_within_node[node], self.first_within_node[fail])
+      for ch, child in self.goto[node].items():
+        f = fail
+        while f and ch not in self.goto[f]:
+          f = self.fail[f]
+        self.fail[child] = self.goto[f].get(ch, 0)
+        queue.append(child)
+
+  @staticmethod
+  def _min(a: Optional[int], b: Optional[int]) -> Optional[int]:
+    if a is None:
+      return b
+    if b is None:
+      return a
+    return min(a, b)
+
+  def _step(self, node: int, ch: str) -> int:
+    while node and ch not in self.goto[node]:
+      node = self.fail[node]
+    return self.goto[node].get(ch, 0)
+
+  def first_within(self, text: str) -> Optional[int]:
+    """
+    Return the smallest index of a key that occurs within ``text``.
+
+    :param text: String to search for keys
+    :return: The smallest index of a key occurring within ``text`` (or None if no key does)
+
+    """
+    node = 0
+    first = self.first_within_node[0]
+    for ch in text:
+      node = self._step(node, ch)
+      first = self._min(first, self.first_within_node[node])
+    return first
+
+  def first_containing(self, texts: Sequence[str]) -> List[Optional[int]]:
+    """
+    Return, for each key, the smallest index of a string in ``texts`` that contains it.
+
+    :param texts: Strings to search for keys
+    :return: For each key, the smallest index of a string in ``texts`` containing it (or None if none does)
+
+    """
+    containing = [None] * len(self.goto)
+    for i, text in enumerate(texts):
+      node = 0
+      for pos in range(len(text) + 1):
+        if pos > 0:
+          node = self._step(node, text[pos - 1])
+        # mark every key ending here, until reaching one that an earlier text has marked.
+        # keys along its dictionary links were marked along with it, so they need not be visited again.
+        hit = node if self.first[node] is not None else self.out[node]
+        while hit is not None and containing[hit] is None:
+          containing[hit] = i
+          hit = self.out[hit]
+    return [containing[node] for node in self.nodes]
+
+
+class Blacklist:
+  """
+  The ``Blacklist`` class tells whether a URL is blacklisted, by matching its parts against structured entries.
+
+  Each entry is one of the following (lines starting with ``#`` are ignored):
+
+  * a scheme (e.g., ``mailto:``), which matches URLs with that scheme.
+  * an IP network in CIDR notation (e.g., ``10.0.0.0/8``), which matches URLs whose host is an IP address within it.
+  * an IPv4 pattern of four octets, each of which is a number or a set of numbers (e.g., ``{0,255}.{0,255}.0.0``),
+    which matches URLs whose host is an IPv4 address whose octets are all within the pattern.
+  * a domain (e.g., ``doi.org``), which matches URLs whose host is that domain, or a subdomain of it.
+
+  The host of a URL is parsed once, and matched against the domains via a trie of their reversed labels
+  (e.g., ``doi.org`` is stored as ``org -> doi``), so matching takes time linear to the number of labels of the host,
+  regardless of the number of entries. Paths and queries are never matched, so ``https://example.com/doi.org`` or
+  ``https://notdoi.org.example.com`` are not blacklisted by ``doi.org``.
+
+  :param entries: Blacklist entries
+
+  """
+
+  def __init__(self, entries: Iterable[str]) -> None:
+    self.schemes = set()
+    self.networks = []
+    # allowed values of each octet, per IPv4 pattern
+    self.octet_patterns: List[Tuple[FrozenSet[int], ...]] = []
+    # trie of reversed domain labels, where None marks the end of a domain
+    self.domains = {}
+    for entry in entries:
+      entry = entry.strip().lower()
+      if not entry or entry.startswith("#"):
+        continue
+      if entry.endswith(":"):
+        self.schemes.add(entry[:-1])
+        continue
+      try:
+        self.networks.append(ipaddress.ip_network(entry))
+        continue
+      except ValueError:
+        pass
+      if "{" in entry:
+        self.octet_patterns.append(self.parse_octet_pattern(entry))
+        continue
+      node = self.domains
+      for label in reversed(entry.strip(".").split(".")):
+        node = node.setdefault(label, {})
+      node[None] = {}
+
+  @staticmethod
+  def parse_octet_pattern(entry: str) -> Tuple[FrozenSet[int], ...]:
+    """
+    Return the allowed values of each octet of an IPv4 pattern (e.g., ``{0,255}.{0,255}.0.0``).
+
+    :param entry: IPv4 pattern
+    :return: Set of allowed values of each of the four octets
+    :raises ValueError: If the entry is not a valid IPv4 pattern
+
+    """
+    octets = entry.split(".")
+    if len(octets) != 4:
+      raise ValueError(f"invalid IPv4 pattern: {entry}")
+    pattern = []
+    for octet in octets:
+      values = frozenset(int(value) for value in octet.strip("{}").split(","))
+      if not all(0 <= value <= 255 for value in values):
+        raise ValueError(f"invalid IPv4 pattern: {entry}")
+      pattern.append(values)
+    return tuple(pattern)
+
+  @staticmethod
+  def split_url(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Return the scheme and the host of a URL, which may not have a scheme (e.g., ``doi.org/10.1000/1``).
+
+    :param url: URL to split
+    :return: The (lower-case) scheme and host of the URL (or None for each part that is missing)
+
+    """
+    if "://" in url:
+      parts = urllib.parse.urlsplit(url)
+      return parts.scheme.lower() or None, parts.hostname
+    scheme, sep, rest = url.partition(":")
+    if sep and not rest[:1].isdigit():
+      # a scheme without an authority (e.g., mailto:), unlike a host with a port (e.g., localhost:8080)
+      return scheme.lower(), None
+    return None, urllib.parse.urlsplit("//" + url).hostname
+
+  def match_host(self, host: str) -> bool:
+    """
+    Return whether a host is a blacklisted IP address, or a blacklisted domain (or a subdomain of it).
+
+    :param host: Host to match
+    :return: True if the host is blacklisted, else False
+
+    """
+    try:
+      address = ipaddress.ip_address(host)
+    except ValueError:
+      pass
+    else:
+      if any(address in network for network in self.networks):
+        return True
+      return address.version == 4 and any(all(octet in values for octet, values in zip(address.packed, pattern))
+                                          for pattern in self.octet_patterns)
+    node = self.domains
+    for label in reversed(host.rstrip(".").split(".")):
+      node = node.get(label)
+      if node is None:
+        return False
+      if None in node:
+        return True
+    return False
+
+  def match(self, url: str) -> bool:
+    """
+    Return whether a URL is blacklisted.
+
+    :param url: URL to match
+    :return: True if the URL is blacklisted, else False
+
+    """
+    # schemes are matched before splitting, since schemes without an authority may look like hosts (e.g., tel:123)
+    if url.partition(":")[0].lower() in self.schemes:
+      return True
+    try:
+      _, host = self.split_url(url)
+    except ValueError:
+      # malformed URLs (e.g., with an invalid IPv6 host) are left to the other validation rules
+      return False
+    return host is not None and self.match_host(host)
@@ -0,0 +1,288 @@
+import bisect
+import contextlib
+import math
+import threading
+import time
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import flask
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+  if not labels:
+    return ""
+  values = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+  return "{" + values + "}"
+
+
+def _escape(value: str) -> str:
+  return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+  if value == math.inf:
+    return "+Inf"
+  return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+  TYPE = ""
+
+  def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> None:
+    self.name = name
+    self.doc = doc
+    self.labelnames = tuple(labelnames)
+    self._lock = threading.Lock()
+
+  def _key(self, labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    if set(labels) != set(self.labelnames):
+      raise ValueError(f"{self.name} expects labels {self.labelnames}, but got {tuple(labels)}")
+    return tuple((name, str(labels[name])) for name in self.labelnames)
+
+  def _samples(self) -> List[str]:
+    raise NotImplementedError
+
+  def render(self) -> List[str]:
+    with self._lock:
+      samples = self._samples()
+    return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.TYPE}", *samples]
+
+
+class Counter(_Metric):
+  """
+  A ``Counter`` is a (labelled) value that only goes up, e.g., the number of calls made.
+
+  """
+  TYPE = "counter"
+
+  def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> None:
+    super().__init__(name, doc, labelnames)
+    self._values = {}
+
+  def inc(self, amount: float = 1, **labels: str) -> None:
+    """
+    Increase the value of the counter for the given labels.
+
+    :param amount: Amount to increase by
+    :param labels: Values of the labels of the counter
+
+    """
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def _samples(self) -> List[str]:
+    return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+  """
+  A ``Gauge`` is a (labelled) value that goes up and down, e.g., the number of calls in-flight.
+
+  """
+  TYPE = "gauge"
+
+  def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> None:
+    super().__init__(name, doc, labelnames)
+    self._values = {}
+
+  def set(self, value: float, **labels: str) -> None:
+    """
+    Set the value of the gauge for the given labels.
+
+    :param value: Value to set
+    :param labels: Values of the labels of the gauge
+
+    """
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = value
+
+  def inc(self, amount: float = 1, **labels: str) -> None:
+    """
+    Increase the value of the gauge for the given labels.
+
+    :param amount: Amount to increase by
+    :param labels: Values of the labels of the gauge
+
+    """
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def dec(self, amount: float = 1, **labels: str) -> None:
+    """
+    Decrease the value of the gauge for the given labels.
+
+    :param amount: Amount to decrease by
+    :param labels: Values of the labels of the gauge
+
+    """
+    self.inc(-amount, **labels)
+
+  def _samples(self) -> List[str]:
+    return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+  """
+  A ``Histogram`` counts (labelled) observations in cumulative buckets, e.g., the latency of calls.
+
+  """
+  TYPE = "histogram"
+
+  def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = ()) -> None:
+    super().__init__(name, doc, labelnames)
+    self.buckets = tuple(sorted(buckets)) + (math.inf,)
+    # bucket counts (non-cumulative), sum, and count of observations, for each set of labels
+    self._values = {}
+
+  def observe(self, value: float, **labels: str) -> None:
+    """
+    Count an observation in the histogram, for the given labels.
+
+    :param value: Value observed
+    :param labels: Values of the labels of the histogram
+
+    """
+    key = self._key(labels)
+    with self._lock:
+      counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+      counts[bisect.bisect_left(self.buckets, value)] += 1
+      self._values[key] = (counts, total + value, count + 1)
+
+  def _samples(self) -> List[str]:
+    samples = []
+    for key, (counts, total, count) in sorted(self._values.items()):
+      cumulative = 0
+      for bound, bucket_count in zip(self.buckets, counts):
+        cumulative += bucket_count
+        labels = _format_labels(key + (("le", _format_value(bound)),))
+        samples.append(f"{self.name}_bucket{labels} {cumulative}")
+      samples.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+      samples.append(f"{self.name}_count{_format_labels(key)} {count}")
+    return samples
+
+
+class Metrics:
+  """
+  The ``Metrics`` class is a registry of counters, gauges and histograms, which are rendered in the
+  `Prometheus text format <https://prometheus.io/docs/instrumenting/exposition_formats/>`_ (e.g., for ``/metrics``).
+
+  Metrics are created on first use, and are looked up by name afterwards. The time spent on each stage of processing
+  (e.g., hashing an upload, or extracting text URLs) is measured with ``timer``, which records it in the
+  ``pdflinks_stage_seconds`` histogram, and (within a request) in the timing breakdown of that request.
+
+  """
+
+  LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+  SIZE_BUCKETS = tuple(1 << k for k in range(10, 31, 2))
+
+  def __init__(self) -> None:
+    self._metrics: Dict[str, _Metric] = {}
+    self._lock = threading.Lock()
+
+  def _get(self, cls: type, name: str, doc: str, labelnames: Sequence[str], **kwargs) -> _Metric:
+    with self._lock:
+      metric = self._metrics.get(name)
+      if metric is None:
+        metric = self._metrics[name] = cls(name, doc, labelnames, **kwargs)
+      return metric
+
+  def counter(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Counter:
+    """
+    Return the counter with the given name (created on first use).
+
+    :param name: Name of the counter
+    :param doc: Description of the counter
+    :param labelnames: Names of the labels of the counter
+    :return: The counter
+
+    """
+    return self._get(Counter, name, doc, labelnames)
+
+  def gauge(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Gauge:
+    """
+    Return the gauge with the given name (created on first use).
+
+    :param name: Name of the gauge
+    :param doc: Description of the gauge
+    :param labelnames: Names of the labels of the gauge
+    :return: The gauge
+
+    """
+    return self._get(Gauge, name, doc, labelnames)
+
+  def histogram(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    """
+    Return the histogram with the given name (created on first use).
+
+    :param name: Name of the histogram
+    :param doc: Description of the histogram
+    :param labelnames: Names of the labels of the histogram
+    :param buckets: Upper bounds of the buckets of the histogram
+    :return: The histogram
+
+    """
+    return self._get(Histogram, name, doc, labelnames, buckets=buckets)
+
+  def observe_stage(self, stage: str, seconds: float) -> None:
+    """
+    Record the time spent on a stage of processing, in ``pdflinks_stage_seconds`` and in the timing breakdown of
+    the current request (if any).
+
+    :param stage: Name of the stage
+    :param seconds: Time spent on the stage
+
+    """
+    self.histogram("pdflinks_stage_seconds", "Time spent on each stage of processing", ["stage"]).observe(seconds, stage=stage)
+    if flask.has_request_context():
+      timings = flask.g.setdefault("timings", [])
+      timings.append((stage, seconds))
+
+  @contextlib.contextmanager
+  def timer(self, stage: str) -> Iterator[None]:
+    """
+    Measure the time spent within a ``with`` block as a stage of processing (see ``observe_stage``).
+
+    :param stage: Name of the stage
+
+    """
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe_stage(stage, time.perf_counter() - started)
+
+  def count_cache(self, cache: str, hit: bool) -> None:
+    """
+    Count a lookup of a cache, as a hit or a miss, in ``pdflinks_cache_lookups_total``.
+
+    :param cache: Name of the cache
+    :param hit: Whether the lookup was a hit
+
+    """
+    self.counter("pdflinks_cache_lookups_total", "Number of cache lookups, by cache and result", ["cache", "result"]) \
+      .inc(cache=cache, result="hit" if hit else "miss")
+
+  @staticmethod
+  def format_server_timing(timings: Sequence[Tuple[str, float]]) -> str:
+    """
+    Format a timing breakdown as the value of a ``Server-Timing`` header (with durations in milliseconds).
+
+    :param timings: Pairs of stage name and seconds spent on it
+    :return: Value of the ``Server-Timing`` header
+
+    """
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings)
+
+  def render(self) -> str:
+    """
+    Render all metrics in the Prometheus text format.
+
+    :return: The rendered metrics
+
+    """
+    with self._lock:
+      metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+    return "".join(line + "\n" for metric in metrics for line in metric.render())
@@ -0,0 +1,147 @@
+import email.utils
+import random
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+  """
+  The ``TokenBucket`` class is a thread-safe, client-side rate limiter.
+
+  Tokens are added at ``rate`` tokens per second, up to ``burst`` tokens, and each call consumes one token.
+  Callers reserve a token with ``reserve``, which returns how long they must wait before using it.
+  This lets the same bucket throttle both threads (via ``time.sleep``) and coroutines (via ``asyncio.sleep``).
+
+  The rate adapts to the upstream server: ``throttle`` halves it (down to ``min_rate``) and pauses all callers until
+  the server's ``Retry-After`` has passed, while ``relax`` raises it again, step by step, back up to ``max_rate``.
+
+  :param max_rate: Maximum (and initial) number of tokens added per second
+  :param burst: Maximum number of tokens that can be saved up
+  :param min_rate: Minimum number of tokens added per second, when throttled
+
+  """
+
+  def __init__(self, max_rate: float = 20, burst: int = 20, min_rate: float = 1) -> None:
+    self.max_rate = max_rate
+    self.min_rate = min(min_rate, max_rate)
+    self.rate = max_rate
+    self.burst = burst
+    self.tokens = float(burst)
+    self.updated = time.monotonic()
+    self.blocked_until = 0.0
+    self._lock = threading.Lock()
+
+  def _refill(self, now: float) -> None:
+    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def reserve(self) -> float:
+    """
+    Reserve a token, and return the number of seconds to wait before using it.
+
+    :return: Number of seconds to wait
+
+    """
+    with self._lock:
+      now = time.monotonic()
+      self._refill(now)
+      self.tokens -= 1
+      return max(0.0, -self.tokens / self.rate, self.blocked_until - now)
+
+  def throttle(self, retry_after: Optional[float] = None) -> None:
+    """
+    Slow down after the upstream server signalled that it is overloaded (e.g., HTTP 429 or 503).
+
+    :param retry_after: Number of seconds the server asked clients to wait (if given)
+
+    """
+    with self._lock:
+      now = time.monotonic()
+      self._refill(now)
+      self.rate = max(self.min_rate, self.rate / 2)
+      if retry_after:
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+
+  def relax(self) -> None:
+    """
+    Speed up (by a tenth of ``max_rate``) after the upstream server handled a call normally.
+
+    """
+    with self._lock:
+      if self.rate < self.max_rate:
+        self._refill(time.monotonic())
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class Backoff:
+  """
+  The ``Backoff`` class decides whether (and when) to retry calls that failed with a transient error.
+  Delays grow exponentially with each attempt (up to ``cap`` seconds), with full jitter, so that clients that failed
+  together do not retry together. A delay is never shorter than the ``Retry-After`` given by the server.
+
+  :param max_attempts: Maximum number of attempts per call (including the first)
+  :param base: Delay (in seconds) before the first retry, without jitter
+  :param cap: Maximum delay (in seconds) before a retry, without jitter
+
+  """
+
+  TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+  THROTTLE_STATUS_CODES = {429, 503}
+
+  def __init__(self, max_attempts: int = 4, base: float = 0.5, cap: float = 30) -> None:
+    self.max_attempts = max_attempts
+    self.base = base
+    self.cap = cap
+
+  def is_transient(self, status_code: int) -> bool:
+    """
+    Return whether a response with the given status code is worth retrying.
+
+    :param status_code: HTTP status code of the response
+    :return: True if the call should be retried, else False
+
+    """
+    return status_code in self.TRANSIENT_STATUS_CODES
+
+  def can_retry(self, attempt: int) -> bool:
+    """
+    Return whether a call may be retried after its ``attempt``-th attempt.
+
+    :param attempt: Number of attempts made so far
+    :return: True if the call may be retried, else False
+
+    """
+    return attempt < self.max_attempts
+
+  def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    Return the number of seconds to wait before retrying a call after its ``attempt``-th attempt.
+
+    :param attempt: Number of attempts made so far
+    :param retry_after: Number of seconds the server asked clients to wait (if given)
+    :return: Number of seconds to wait
+
+    """
+    delay = random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+    return max(delay, retry_after or 0)
+
+  @staticmethod
+  def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse the value of a ``Retry-After`` header, which is either a number of seconds or an HTTP date.
+
+    :param value: Value of the ``Retry-After`` header (if any)
+    :return: Number of seconds to wait (or None if not given or malformed)
+
+    """
+    if not value:
+      return None
+    try:
+      return max(0.0, float(value))
+    except ValueError:
+      pass
+    try:
+      return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+      return None
@@ -0,0 +1,404 @@
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Set
+
+
+def shard_path(root: str, key: str, depth: int = 2, width: int = 2) -> str:
+  """
+  Return the path of a file named ``key`` in a directory tree sharded by the prefix of ``key``.
+  E.g., with ``depth=2`` and ``width=2``, the key ``d41d8cd9.pdf`` is stored at ``<root>/d4/1d/d41d8cd9.pdf``.
+
+  :param root: Root directory of the tree
+  :param key: Name of the file (which starts with a hash)
+  :param depth: Number of levels of sharding (0 disables sharding)
+  :param width: Number of characters of the key used per level
+  :return: Path of the file
+
+  """
+  shards = [key[i * width:(i + 1) * width] for i in range(depth)]
+  return os.path.join(root, *shards, key)
+
+
+class ShardedTree:
+  """
+  The ``ShardedTree`` class maps file names to paths in a directory tree sharded by their prefix (see ``shard_path``).
+
+  Looking up a path has no side effects, except that files stored flat in ``root`` (i.e., before sharding was
+  introduced) are moved into their shard the first time their path is looked up, so existing deployments migrate
+  lazily. Shard directories are only created for files that are written (see ``make_path``).
+
+  :param root: Root directory of the tree
+  :param depth: Number of levels of sharding (0 disables sharding)
+
+  """
+
+  def __init__(self, root: str, depth: int = 2) -> None:
+    # absolute, since ``flask.send_file`` resolves relative paths against the app root instead
+    self.root = os.path.abspath(root)
+    self.depth = depth
+    # shard directories known to exist, and names of files known to be in their shard, to avoid checking them again
+    self._dirs: Set[str] = set()
+    self._migrated: Set[str] = set()
+    self._lock = threading.Lock()
+    os.makedirs(root, exist_ok=True)
+
+  def path(self, key: str) -> str:
+    """
+    Return the path of the file ``key`` (which may not exist). Shard directories are not created.
+
+    :param key: Name of the file
+    :return: Path of the file
+    :raise ValueError: If ``key`` is not a plain file name (e.g., if it has a path separator)
+
+    """
+    # keys are file names within the tree, so that no key (or shard of it) can resolve outside of it
+    if key.startswith(".") or os.sep in key or (os.altsep and os.altsep in key):
+      raise ValueError(f"invalid key: {key!r}")
+    path = shard_path(self.root, key, self.depth)
+    if key in self._migrated:
+      return path
+    with self._lock:
+      if os.path.exists(path):
+        self._migrated.add(key)
+      else:
+        legacy_path = os.path.join(self.root, key)
+        if legacy_path != path and os.path.exists(legacy_path):
+          self._make_parent(path)
+          os.replace(legacy_path, path)
+          self._migrated.add(key)
+    return path
+
+  def make_path(self, key: str) -> str:
+    """
+    Return the path of the file ``key`` (see ``path``), creating its shard directory if needed, so it can be written.
+
+    :param key: Name of the file
+    :return: Path of the file
+
+    """
+    path = self.path(key)
+    with self._lock:
+      self._make_parent(path)
+    return path
+
+  def _make_parent(self, path: str) -> None:
+    parent = os.path.dirname(path)
+    if parent not in self._dirs:
+      os.makedirs(parent, exist_ok=True)
+      self._dirs.add(parent)
+
+
+class StorageBackend:
+  """
+  The ``StorageBackend`` class is the interface of a store of immutable blobs (e.g., PDFs), keyed by name.
+
+  Blobs are added from local files, and read through local paths, since PDF libraries and ``flask.send_file`` need
+  them. A backend that stores blobs remotely (e.g., an object store) downloads them to a local cache when read.
+
+  """
+
+  def put(self, key: str, src_path: str) -> None:
+    """
+    Store the file at ``src_path`` as the blob ``key`` (unless it exists already). The file may be moved.
+
+    :param key: Key of the blob
+    :param src_path: Path of the file to store
+
+    """
+    raise NotImplementedError
+
+  def exists(self, key: str) -> bool:
+    """
+    Return whether the blob ``key`` exists.
+
+    :param key: Key of the blob
+    :return: True if the blob exists, else False
+
+    """
+    raise NotImplementedError
+
+  def get_path(self, key: str) -> Optional[str]:
+    """
+    Return a local path of the blob ``key``, or None if it does not exist.
+
+    :param key: Key of the blob
+    :return: Local path of the blob (or None)
+
+    """
+    raise NotImplementedError
+
+  def delete(self, key: str) -> None:
+    """
+    Delete the blob ``key`` (if it exists).
+
+    :param key: Key of the blob
+
+    """
+    raise NotImplementedError
+
+
+class LocalBackend(StorageBackend):
+  """
+  The ``LocalBackend`` class stores blobs as files in a local ``ShardedTree``, so that no directory grows too large.
+
+  :param root: Root directory of the tree
+  :param shard_depth: Number of levels of sharding (0 disables sharding)
+
+  """
+
+  def __init__(self, root: str, shard_depth: int = 2) -> None:
+    self.tree = ShardedTree(root, shard_depth)
+
+  def put(self, key: str, src_path: str) -> None:
+    path = self.tree.make_path(key)
+    if not os.path.exists(path):
+      os.replace(src_path, path)
+
+  def exists(self, key: str) -> bool:
+    return os.path.exists(self.tree.path(key))
+
+  def get_path(self, key: str) -> Optional[str]:
+    path = self.tree.path(key)
+    return path if os.path.exists(path) else None
+
+  def delete(self, key: str) -> None:
+    path = self.tree.path(key)
+    if os.path.exists(path):
+      os.remove(path)
+
+
+class MemoryBackend(StorageBackend):
+  """
+  The ``MemoryBackend`` class stores blobs in memory. It stands in for a remote object store (e.g., in tests):
+  like one, it keeps no local files of its own, and copies blobs into a local cache directory when they are read.
+
+  :param cache_dir: Directory to cache blobs in when read (default: a temporary directory)
+
+  """
+
+  def __init__(self, cache_dir: Optional[str] = None) -> None:
+    self.cache_dir = cache_dir or tempfile.mkdtemp(prefix="pdflinks-")
+    self._blobs: Dict[str, bytes] = {}
+    self._lock = threading.Lock()
+
+  def put(self, key: str, src_path: str) -> None:
+    with open(src_path, "rb") as f:
+      data = f.read()
+    with self._lock:
+      self._blobs.setdefault(key, data)
+
+  def exists(self, key: str) -> bool:
+    with self._lock:
+      return key in self._blobs
+
+  def get_path(self, key: str) -> Optional[str]:
+    with self._lock:
+      data = self._blobs.get(key)
+    if data is None:
+      return None
+    path = os.path.join(self.cache_dir, key)
+    if not os.path.exists(path):
+      fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+      with os.fdopen(fd, "wb") as f:
+        f.write(data)
+      os.replace(tmp_path, path)
+    return path
+
+  def delete(self, key: str) -> None:
+    with self._lock:
+      self._blobs.pop(key, None)
+    path = os.path.join(self.cache_dir, key)
+    if os.path.exists(path):
+      os.remove(path)
+
+
+class PDFStore:
+  """
+  The ``PDFStore`` class stores uploaded PDFs in a ``StorageBackend``, and indexes their metadata in a local
+  `SQLite <https://docs.python.org/3/library/sqlite3.html>`_ database, so that looking up a PDF needs no file access.
+
+  The metadata of a PDF has the fields ``pdf_hash``, ``filename`` (i.e., the original filename), ``size`` (in bytes),
+  ``pages`` (or None if unknown), ``uploaded`` (a UNIX timestamp), ``extraction_status`` (one of ``pending``,
+  ``running``, ``done`` or ``failed``), ``mapping_status`` (``none``, or ``stored`` once mappings are stored),
+  ``extraction_error`` (why its last failed extraction failed, or None), and ``extraction_failures`` (the number of
+  failed extractions).
+
+  A PDF is only marked ``failed`` (so that it is not extracted again) if its extraction failed because of the PDF
+  itself, or failed ``max_failures`` times. Otherwise (e.g., if it timed out under load), it is marked ``pending``
+  again, so that it is extracted again when requested (see ``fail_extraction``).
+
+  PDFs uploaded before the index existed are indexed on first access, with the filename from their ``.pdf.txt`` file.
+  PDFs are only looked up by valid hashes (see ``is_valid_hash``), so other hashes are never looked up in the backend.
+
+  :param backend: Backend to store PDFs in
+  :param index_path: Path of the SQLite database of metadata
+  :param max_failures: Number of transient failures after which a PDF is marked ``failed``
+
+  """
+
+  EXTRACTION_PENDING = "pending"
+  EXTRACTION_RUNNING = "running"
+  EXTRACTION_DONE = "done"
+  EXTRACTION_FAILED = "failed"
+
+  MAPPING_NONE = "none"
+  MAPPING_STORED = "stored"
+
+  FIELDS = ("pdf_hash", "filename", "size", "pages", "uploaded", "extraction_status", "mapping_status",
+            "extraction_error", "extraction_failures")
+
+  HASH_PATTERN = re.compile("[0-9a-f]{32}")
+
+  def __init__(self, backend: StorageBackend, index_path: str, max_failures: int = 3) -> None:
+    self.backend = backend
+    self.max_failures = max_failures
+    self._db = sqlite3.connect(index_path, check_same_thread=False)
+    self._lock = threading.Lock()
+    with self._lock, self._db:
+      self._db.execute("CREATE TABLE IF NOT EXISTS pdfs (pdf_hash TEXT PRIMARY KEY, filename TEXT, size INTEGER, "
+                       "pages INTEGER, uploaded REAL, extraction_status TEXT, mapping_status TEXT, "
+                       "extraction_error TEXT, extraction_failures INTEGER NOT NULL DEFAULT 0)")
+      # add the columns that indexes created by earlier versions do not have
+      columns = set(row[1] for row in self._db.execute("PRAGMA table_info(pdfs)"))
+      if "extraction_error" not in columns:
+        self._db.execute("ALTER TABLE pdfs ADD COLUMN extraction_error TEXT")
+        # earlier versions marked PDFs failed on any failure (even transient ones), so they are extracted again
+        self._db.execute("UPDATE pdfs SET extraction_status = ? WHERE extraction_status = ?",
+                         (self.EXTRACTION_PENDING, self.EXTRACTION_FAILED))
+      if "extraction_failures" not in columns:
+        self._db.execute("ALTER TABLE pdfs ADD COLUMN extraction_failures INTEGER NOT NULL DEFAULT 0")
+
+  @classmethod
+  def is_valid_hash(cls, pdf_hash: str) -> bool:
+    """
+    Return whether a string is a valid hash of a PDF (i.e., an MD5 hash as 32 lowercase hex digits).
+
+    :param pdf_hash: String to check
+    :return: True if the string is a valid hash, else False
+
+    """
+    return isinstance(pdf_hash, str) and cls.HASH_PATTERN.fullmatch(pdf_hash) is not None
+
+  @staticmethod
+  def key(pdf_hash: str) -> str:
+    """
+    Return the key of the blob of a PDF.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Key of the blob
+
+    """
+    return pdf_hash + ".pdf"
+
+  def add(self, pdf_hash: str, src_path: str, filename: str, pages: Optional[int] = None) -> dict:
+    """
+    Store an uploaded PDF (unless it was uploaded before), and index its metadata.
+    If it was uploaded before, only its original filename is updated.
+
+    :param pdf_hash: MD5 hash of the PDF
+    :param src_path: Path of the uploaded file (which may be moved)
+    :param filename: Original filename of the PDF
+    :param pages: Number of pages in the PDF (if known)
+    :return: Metadata of the PDF
+
+    """
+    size = os.path.getsize(src_path)
+    self.backend.put(self.key(pdf_hash), src_path)
+    with self._lock, self._db:
+      self._db.execute("INSERT OR IGNORE INTO pdfs (pdf_hash, filename, size, pages, uploaded, extraction_status, "
+                       "mapping_status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (pdf_hash, filename, size, pages, time.time(), self.EXTRACTION_PENDING, self.MAPPING_NONE))
+      self._db.execute("UPDATE pdfs SET filename = ? WHERE pdf_hash = ?", (filename, pdf_hash))
+    return self.get(pdf_hash)
+
+  def get(self, pdf_hash: str) -> Optional[dict]:
+    """
+    Return the metadata of a PDF, or None if it was not uploaded.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Metadata of the PDF (or None)
+
+    """
+    if not self.is_valid_hash(pdf_hash):
+      return None
+    with self._lock:
+      row = self._db.execute(f"SELECT {', '.join(self.FIELDS)} FROM pdfs WHERE pdf_hash = ?", (pdf_hash,)).fetchone()
+    if row is None:
+      return self._index_legacy(pdf_hash)
+    return dict(zip(self.FIELDS, row))
+
+  def _index_legacy(self, pdf_hash: str) -> Optional[dict]:
+    # index a PDF that was uploaded before the index existed (if any)
+    if not self.backend.exists(self.key(pdf_hash)):
+      return None
+    path = self.backend.get_path(self.key(pdf_hash))
+    meta_path = self.backend.get_path(self.key(pdf_hash) + ".txt")
+    filename = pdf_hash + ".pdf"
+    if meta_path is not None:
+      with open(meta_path) as f:
+        filename = f.readline()
+    with self._lock, self._db:
+      self._db.execute("INSERT OR IGNORE INTO pdfs (pdf_hash, filename, size, uploaded, extraction_status, "
+                       "mapping_status) VALUES (?, ?, ?, ?, ?, ?)",
+                       (pdf_hash, filename, os.path.getsize(path), os.path.getmtime(path),
+                        self.EXTRACTION_PENDING, self.MAPPING_NONE))
+    return self.get(pdf_hash)
+
+  def exists(self, pdf_hash: str) -> bool:
+    """
+    Return whether a PDF was uploaded.
+
+    :param pdf_hash: MD5 hash of a PDF
+    :return: True if the PDF was uploaded, else False
+
+    """
+    return self.get(pdf_hash) is not None
+
+  def path(self, pdf_hash: str) -> Optional[str]:
+    """
+    Return a local path of an uploaded PDF, or None if it was not uploaded.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :return: Local path of the PDF (or None)
+
+    """
+    if not self.is_valid_hash(pdf_hash):
+      return None
+    return self.backend.get_path(self.key(pdf_hash))
+
+  def set_status(self, pdf_hash: str, extraction: Optional[str] = None, mapping: Optional[str] = None,
+                 pages: Optional[int] = None) -> None:
+    """
+    Update the extraction status, the mapping status, and/or the number of pages of a PDF.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :param extraction: New extraction status (if any)
+    :param mapping: New mapping status (if any)
+    :param pages: Number of pages in the PDF (if known)
+
+    """
+    with self._lock, self._db:
+      self._db.execute("UPDATE pdfs SET extraction_status = COALESCE(?, extraction_status), "
+                       "mapping_status = COALESCE(?, mapping_status), pages = COALESCE(?, pages) WHERE pdf_hash = ?",
+                       (extraction, mapping, pages, pdf_hash))
+
+  def fail_extraction(self, pdf_hash: str, error: str, transient: bool = False) -> None:
+    """
+    Record a failed extraction of a PDF. If the failure is ``transient`` (see ``ExtractionError``), the PDF is marked
+    ``pending`` again, so that it is extracted again, until it has failed ``max_failures`` times (including this one).
+    Otherwise (or from then on), the PDF is marked ``failed``.
+
+    :param pdf_hash: MD5 hash of an uploaded PDF
+    :param error: Why the extraction failed
+    :param transient: Whether extracting the PDF again may succeed
+
+    """
+    with self._lock, self._db:
+      self._db.execute("UPDATE pdfs SET extraction_error = ?, extraction_failures = extraction_failures + 1, "
+                       "extraction_status = CASE WHEN ? AND extraction_failures + 1 < ? THEN ? ELSE ? END "
+                       "WHERE pdf_hash = ?",
+                       (error, transient, self.max_failures, self.EXTRACTION_PENDING, self.EXTRACTION_FAILED, pdf_hash))
@@ -1,10 +1,16 @@
+import hashlib
+import logging
 import os
-import re
-from typing import Set
+from typing import Iterable, Set
 
 import validators
 
 from pdflinks.errors import URLError
+from .cache_util import LRUCache
+from .match_util import Blacklist, SubstringIndex
+
+# marks URL-like strings that were not canonicalized before
+_UNSEEN = object()
 
 
 class URLUtil:
@@ -13,13 +19,23 @@ class URLUtil:
   It provides functions to validate whether URL-like strings are actually URLs, transform URL strings
   into canonical formats, and to filter out duplicates from URL collections.
 
+  The verdict on each URL-like string (i.e., its canonical URL, or that it is invalid) is memoized in a bounded LRU,
+  so strings that recur across pages and PDFs (e.g., in running headers, or DOIs) are only canonicalized once.
+
+  :param memo_size: Maximum number of verdicts kept in memory
+
   """
 
-  def __init__(self) -> None:
+  def __init__(self, memo_size: int = 100000) -> None:
     base_dir = os.path.dirname(os.path.realpath(__file__))
-    # load blacklisted URLs as regex, for validation
+    # load blacklisted schemes, IP networks and domains, for validation
     with open(f"{base_dir}/../config/blacklist.txt") as f:
-      self.blacklist = re.compile("|".join(sorted(map(str.strip, f.readlines()))), re.I)
+      lines = f.readlines()
+    self.blacklist = Blacklist(lines)
+    # digest of the blacklist, to detect changes in validation rules
+    self.blacklist_digest = hashlib.md5("".join(lines).encode()).hexdigest()
+    # canonical URL (or None, if invalid) of recently seen URL-like strings
+    self.verdicts = LRUCache(memo_size)
 
   def canonicalize_url(self, url: str) -> str:
     """
@@ -45,6 +61,30 @@ class URLUtil:
     # return validated url
     return url
 
+  def canonicalize_urls(self, urls: Iterable[str]) -> Set[str]:
+    """
+    Canonicalize a collection of URL-like strings at once, and drop the ones that are not valid URLs.
+
+    Duplicate strings are canonicalized once, and strings that were seen before are not canonicalized again.
+
+    :param urls: URL-like strings
+    :return: Set of canonical URLs
+
+    """
+    canonical_urls = set()
+    for url in set(urls):
+      canonical_url = self.verdicts.get(url, _UNSEEN)
+      if canonical_url is _UNSEEN:
+        try:
+          canonical_url = self.canonicalize_url(url)
+        except URLError as e:
+          logging.debug(e)
+          canonical_url = None
+        self.verdicts.put(url, canonical_url)
+      if canonical_url is not None:
+        canonical_urls.add(canonical_url)
+    return canonical_urls
+
   def validate_url(self, url: str):
     """
     Ensure that URL is syntactically valid
@@ -54,7 +94,7 @@ class URLUtil:
 
     """
     # validate against blacklist
-    if self.blacklist.search(url):
+    if self.blacklist.match(url):
       raise URLError(url)
     # validate if the given string is a public URL
     try:
@@ -79,25 +119,45 @@ class URLUtil:
     """
     Return a subset of unique URLs from ``pool`` (favors shorter URLs by default)
 
+    This gives the same result as picking URLs (ordered by length) that do not match any URL picked before them,
+    as determined by ``has_match``. Instead of matching each URL against every picked URL, it uses a ``SubstringIndex``,
+    since a URL matches a picked URL exactly when it matches some URL ordered before it.
+
     :param pool: pool of URLs
     :param prefer_long: Whether to favor short URLs (default) or long URLs
     :return: a subset of URLs
 
     """
-    uniq_urls = set()
-    for url in sorted(pool, key=len, reverse=prefer_long):
-      if not URLUtil.has_match(url, uniq_urls):
-        uniq_urls.add(url)
-    return uniq_urls
+    urls = sorted(pool, key=len, reverse=prefer_long)
+    keys = [url[8:] for url in urls]
+    index = SubstringIndex(keys)
+    if prefer_long:
+      # a URL is picked if no (longer) URL before it contains it
+      firsts = index.first_containing(keys)
+    else:
+      # a URL is picked if it contains no (shorter) URL before it
+      firsts = [index.first_within(key) for key in keys]
+    return set(url for i, url in enumerate(urls) if firsts[i] == i)
 
   @staticmethod
   def pick_new_urls(pool: Set[str], ignore_list: Set[str]) -> Set[str]:
     """
     Return a subset of URLs from ``pool`` that does not match any URL in ``ignore_list``
 
+    This gives the same result as filtering ``pool`` using ``has_match``, but uses a ``SubstringIndex`` instead.
+
     :param pool: pool of URLs
     :param ignore_list: list of URLs to ignore
     :return: a subset of URLs
 
     """
-    return set(url for url in pool if not URLUtil.has_match(url, ignore_list))
+    if not ignore_list:
+      return set(pool)
+    urls = list(pool)
+    keys = [url[8:] for url in urls]
+    ignore_keys = [url[8:] for url in ignore_list]
+    # URLs contained in some URL in ignore_list
+    contained = SubstringIndex(keys).first_containing(ignore_keys)
+    # URLs containing some URL in ignore_list
+    ignore_index = SubstringIndex(ignore_keys)
+    return set(url for url, key, c in zip(urls, keys, contained) if c is None and ignore_index.first_within(key) is None)
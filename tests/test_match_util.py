@@ -0,0 +1,115 @@
+"""
+Tests of the structured ``Blacklist`` matching, with the blacklist that is shipped in ``config/blacklist.txt``.
+
+IPv4 hosts are also tested against the regexes that the blacklist was made of before it was structured. Addresses
+are generated with octets that are likely to be netmask octets, or within private networks. All addresses are seeded,
+so the same addresses are tested on each run.
+
+"""
+import ipaddress
+import os
+import random
+import re
+
+import pytest
+
+from pdflinks.util.match_util import Blacklist
+
+SEEDS = range(200)
+
+# the address entries of the blacklist, before it was structured (searched anywhere in a URL)
+REFERENCE_PATTERNS = [
+  r"127\.0\.0\.1",
+  r"10\.\d{1,3}\.\d{1,3}\.\d{1,3}",
+  r"172\.(16|17|18|19|20|21|22|23|24|25|26|27|28|29|30|31)\.\d{1,3}\.\d{1,3}",
+  r"192\.168\.\d{1,3}\.\d{1,3}",
+  r"(255|254|252|248|240|224|192|128|0+)\.(255|254|252|248|240|224|192|128|0+)\."
+  r"(255|254|252|248|240|224|192|128|0+)\.(255|254|252|248|240|224|192|128|0+)",
+]
+MASK_OCTETS = [0, 128, 192, 224, 240, 248, 252, 254, 255]
+# networks in which the blacklist matches more addresses than the reference (i.e., all of them)
+GROWN_NETWORKS = [ipaddress.ip_network("0.0.0.0/8"), ipaddress.ip_network("127.0.0.0/8")]
+
+
+@pytest.fixture(scope="module")
+def blacklist() -> Blacklist:
+  with open(os.path.join(os.path.dirname(__file__), "..", "pdflinks", "config", "blacklist.txt")) as f:
+    return Blacklist(f)
+
+
+def reference_match_address(address: str) -> bool:
+  # whether an IPv4 address was blacklisted before the blacklist was structured
+  return any(re.fullmatch(pattern, address) for pattern in REFERENCE_PATTERNS)
+
+
+def make_address(rng: random.Random) -> str:
+  # an IPv4 address whose octets are mostly netmask octets, with a fraction of private network prefixes
+  octets = [rng.choice(MASK_OCTETS) if rng.random() < 0.8 else rng.randrange(256) for _ in range(4)]
+  if rng.random() < 0.2:
+    octets[:2] = rng.choice([[10, octets[1]], [172, rng.randrange(14, 34)], [192, 168], [127, 0]])
+  return ".".join(map(str, octets))
+
+
+@pytest.mark.parametrize("url", ["mailto:someone@example.com", "MAILTO:someone@example.com", "tel:+1-555-0100",
+                                 "sms:+15550100"])
+def test_scheme(blacklist: Blacklist, url: str):
+  assert blacklist.match(url)
+
+
+@pytest.mark.parametrize("url, expected", [
+  ("http://10.1.2.3/", True),
+  ("http://172.16.0.1:8080/x", True),
+  ("http://172.31.255.255", True),
+  ("http://172.32.0.1", False),
+  ("https://192.168.1.1/admin", True),
+  ("http://127.0.0.1:5000/", True),
+  ("http://[::1]/", True),
+  ("http://[fd12::1]/", True),
+  ("http://[2001:db8::1]/", False),
+  ("http://8.8.8.8/", False),
+  ("http://255.255.255.0/", True),
+  ("http://192.128.0.0/", True),
+  ("http://128.128.0.0/", True),
+  ("http://128.128.0.1/", False),
+  ("10.0.0.1/index.html", True),
+])
+def test_network(blacklist: Blacklist, url: str, expected: bool):
+  assert blacklist.match(url) == expected
+
+
+@pytest.mark.parametrize("url, expected", [
+  ("https://doi.org/10.1000/1", True),
+  ("https://dx.doi.org/10.1000/1", True),
+  ("https://DOI.ORG/10.1000/1", True),
+  ("https://doi.org./10.1000/1", True),
+  ("https://doi.org:443/10.1000/1", True),
+  ("doi.org/10.1000/1", True),
+  ("http://localhost:8080/", True),
+  ("https://export.arxiv.org/abs/1234.5678", True),
+  ("https://notdoi.org.example.com/", False),
+  ("https://mydoi.org/", False),
+  ("https://doi.org.example.com/", False),
+  ("https://example.com/doi.org", False),
+  ("https://example.com/?next=orcid.org", False),
+  ("https://acm.org/", False),
+])
+def test_domain(blacklist: Blacklist, url: str, expected: bool):
+  assert blacklist.match(url) == expected
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_address(blacklist: Blacklist, seed: int):
+  rng = random.Random(seed)
+  for _ in range(20):
+    address = make_address(rng)
+    matched = blacklist.match(f"http://{address}/")
+    if reference_match_address(address):
+      assert matched, address
+    elif not any(ipaddress.ip_address(address) in network for network in GROWN_NETWORKS):
+      assert not matched, address
+
+
+@pytest.mark.parametrize("entry", ["{0,256}.0.0.0", "{0,255}.0.0", "{0,x}.0.0.0"])
+def test_invalid_octet_pattern(entry: str):
+  with pytest.raises(ValueError):
+    Blacklist([entry])
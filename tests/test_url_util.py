@@ -0,0 +1,80 @@
+"""
+Tests of the indexed URL matching in ``URLUtil``, against the pairwise ``has_match`` logic that it replaced.
+
+Pools are generated from a small alphabet, so that many URLs are substrings of others (including of several others,
+and of URLs of the same length). All pools are seeded, so the same pools are tested on each run.
+
+"""
+import random
+from typing import List, Set
+
+import pytest
+
+from pdflinks.util import URLUtil
+from pdflinks.util.match_util import SubstringIndex
+
+SEEDS = range(200)
+
+
+def reference_pick_uniq_urls(pool: Set[str], prefer_long: bool = False) -> Set[str]:
+  # pick_uniq_urls before it was indexed
+  uniq_urls = set()
+  for url in sorted(pool, key=len, reverse=prefer_long):
+    if not URLUtil.has_match(url, uniq_urls):
+      uniq_urls.add(url)
+  return uniq_urls
+
+
+def reference_pick_new_urls(pool: Set[str], ignore_list: Set[str]) -> Set[str]:
+  # pick_new_urls before it was indexed
+  return set(url for url in pool if not URLUtil.has_match(url, ignore_list))
+
+
+def make_pool(rng: random.Random, count: int) -> Set[str]:
+  # URLs over a small alphabet, a fraction of which are truncated, or extended, copies of others
+  urls: List[str] = []
+  for _ in range(count):
+    if urls and rng.random() < 0.4:
+      url = rng.choice(urls)
+      if rng.random() < 0.5:
+        url = url[:rng.randrange(len("https://"), len(url) + 1)]
+      else:
+        url = url + "".join(rng.choices("ab/", k=rng.randrange(1, 4)))
+    else:
+      url = "https://" + "".join(rng.choices("ab/.", k=rng.randrange(0, 8)))
+    urls.append(url)
+  return set(urls)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("prefer_long", [False, True])
+def test_pick_uniq_urls(seed: int, prefer_long: bool):
+  pool = make_pool(random.Random(seed), random.Random(seed).randrange(0, 40))
+  assert URLUtil.pick_uniq_urls(pool, prefer_long) == reference_pick_uniq_urls(pool, prefer_long)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_pick_new_urls(seed: int):
+  rng = random.Random(seed)
+  pool = make_pool(rng, rng.randrange(0, 40))
+  # an ignore list that overlaps with the pool, and has URLs both longer and shorter than those in it
+  ignore_list = set(rng.sample(sorted(pool), min(len(pool), rng.randrange(0, 5)))) | make_pool(rng, rng.randrange(0, 10))
+  assert URLUtil.pick_new_urls(pool, ignore_list) == reference_pick_new_urls(pool, ignore_list)
+
+
+def test_pick_new_urls_without_ignore_list():
+  pool = make_pool(random.Random(0), 20)
+  assert URLUtil.pick_new_urls(pool, set()) == pool
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_substring_index(seed: int):
+  rng = random.Random(seed)
+  keys = ["".join(rng.choices("ab", k=rng.randrange(0, 4))) for _ in range(rng.randrange(1, 10))]
+  texts = ["".join(rng.choices("ab", k=rng.randrange(0, 8))) for _ in range(rng.randrange(0, 10))]
+  index = SubstringIndex(keys)
+  for text in texts:
+    expected = next((i for i, key in enumerate(keys) if key in text), None)
+    assert index.first_within(text) == expected
+  expected = [next((i for i, text in enumerate(texts) if key in text), None) for key in keys]
+  assert index.first_containing(texts) == expected